@@ -2,13 +2,24 @@
 Everything to do with Graphs, Nodes, Edges, and how to search them. ALl of
 this was made for a graph database.
 
-TODO:
-Add a parameter that takes an evaluator function for filtering elements.
-Currently can only filter elements by equality of their properties
+Wherever elements are filtered by a properties dict, a Predicate can be given
+instead, eg. g.nodes(Eq('type', 'user') & Range('age', 18, 30))
 """
 
 
+from array import array
 from collections import defaultdict, deque
+import concurrent.futures
+import contextlib
+import functools
+import gc
+import heapq
+import itertools
+import multiprocessing
+import operator
+import os
+import sys
+import threading
 
 
 class GraphError(Exception):
@@ -20,80 +31,514 @@ class GraphError(Exception):
 		return repr(self.error_message)
 
 
-def filter(graph_elements, properties=None, **kwargs):
-	if properties is None:
-		properties = dict(kwargs)
+# stands in for a property an element doesn't have
+_MISSING = object()
+
+
+class Predicate(object):
+	"""
+	A condition on the properties of a graph element. Predicates are combined
+	with &, | and ~, and compiled once into a function that takes an
+	element's properties dict and returns whether it matches.
+	"""
+	_compiled = None
+	
+	def compile(self):
+		"""Returns the matcher function for this predicate, building it once"""
+		if self._compiled is None:
+			self._compiled = self._compile()
+		return self._compiled
+	
+	def _compile(self):
+		raise NotImplementedError
+	
+	def ids(self, indexes):
+		"""
+		Returns the ids of the only elements that can match, looked up in
+		indexes, or None if indexes can't narrow the search down
+		
+		Keyword arguments:
+		indexes -- a dict mapping property keys to PropertyIndexes
+		"""
+		return None
+	
+	def __and__(self, other):
+		return And(self, other)
+	
+	def __or__(self, other):
+		return Or(self, other)
+	
+	def __invert__(self):
+		return Not(self)
+
+
+class Eq(Predicate):
+	"""Matches elements whose property key == value"""
+	def __init__(self, key, value):
+		self.key = key
+		self.value = value
+	
+	def _compile(self):
+		key, value = self.key, self.value
+		def match(properties):
+			return properties.get(key, _MISSING) == value
+		return match
+	
+	def ids(self, indexes):
+		if self.key not in indexes:
+			return None
+		try:
+			return indexes[self.key].lookup(self.value)
+		except GraphError:
+			return None
+
+
+class In(Predicate):
+	"""Matches elements whose property key is one of values"""
+	def __init__(self, key, values):
+		self.key = key
+		self.values = tuple(values)
+	
+	def _compile(self):
+		key = self.key
+		try:
+			values = frozenset(self.values)
+		except TypeError:
+			values = self.values
+		def match(properties):
+			try:
+				return properties.get(key, _MISSING) in values
+			except TypeError:
+				return False
+		return match
+	
+	def ids(self, indexes):
+		if self.key not in indexes:
+			return None
+		ids = {}
+		try:
+			for value in self.values:
+				ids.update(dict.fromkeys(indexes[self.key].lookup(value)))
+		except GraphError:
+			return None
+		return ids.keys()
+
+
+class Range(Predicate):
+	"""
+	Matches elements whose property key lies between low and high. Either
+	bound can be None to leave that side open. Values that can't be compared
+	with the bounds don't match.
+	"""
+	def __init__(self, key, low=None, high=None, include_low=True,
+				include_high=True):
+		self.key = key
+		self.low = low
+		self.high = high
+		self.include_low = include_low
+		self.include_high = include_high
+	
+	def _compile(self):
+		key = self.key
+		low = self.low
+		high = self.high
+		above_low = operator.ge if self.include_low else operator.gt
+		below_high = operator.le if self.include_high else operator.lt
+		if low is None and high is None:
+			def match(properties):
+				return key in properties
+		elif high is None:
+			def match(properties):
+				value = properties.get(key, _MISSING)
+				try:
+					return value is not _MISSING and above_low(value, low)
+				except TypeError:
+					return False
+		elif low is None:
+			def match(properties):
+				value = properties.get(key, _MISSING)
+				try:
+					return value is not _MISSING and below_high(value, high)
+				except TypeError:
+					return False
+		else:
+			def match(properties):
+				value = properties.get(key, _MISSING)
+				try:
+					return (value is not _MISSING and above_low(value, low)
+							and below_high(value, high))
+				except TypeError:
+					return False
+		return match
+
+
+class Prefix(Predicate):
+	"""Matches elements whose property key is a string starting with prefix"""
+	def __init__(self, key, prefix):
+		self.key = key
+		self.prefix = prefix
+	
+	def _compile(self):
+		key, prefix = self.key, self.prefix
+		def match(properties):
+			value = properties.get(key)
+			return isinstance(value, str) and value.startswith(prefix)
+		return match
+
+
+class Where(Predicate):
+	"""Matches elements that have property key and function(value) is true"""
+	def __init__(self, key, function):
+		self.key = key
+		self.function = function
+	
+	def _compile(self):
+		key, function = self.key, self.function
+		def match(properties):
+			value = properties.get(key, _MISSING)
+			return value is not _MISSING and bool(function(value))
+		return match
+
+
+class And(Predicate):
+	"""Matches elements that match all of predicates"""
+	def __init__(self, *predicates):
+		self.predicates = predicates
+	
+	def _compile(self):
+		if all(type(p) is Eq for p in self.predicates):
+			# the common case of a properties dict gets a single loop
+			items = tuple((p.key, p.value) for p in self.predicates)
+			def match(properties):
+				get = properties.get
+				for key, value in items:
+					if get(key, _MISSING) != value:
+						return False
+				return True
+			return match
+		matchers = tuple(p.compile() for p in self.predicates)
+		def match(properties):
+			for matcher in matchers:
+				if not matcher(properties):
+					return False
+			return True
+		return match
+	
+	def ids(self, indexes):
+		best_ids = None
+		for predicate in self.predicates:
+			ids = predicate.ids(indexes)
+			if ids is not None and (best_ids is None or len(ids) < len(best_ids)):
+				best_ids = ids
+		return best_ids
+
+
+class Or(Predicate):
+	"""Matches elements that match any of predicates"""
+	def __init__(self, *predicates):
+		self.predicates = predicates
+	
+	def _compile(self):
+		matchers = tuple(p.compile() for p in self.predicates)
+		def match(properties):
+			for matcher in matchers:
+				if matcher(properties):
+					return True
+			return False
+		return match
+	
+	def ids(self, indexes):
+		ids = {}
+		for predicate in self.predicates:
+			predicate_ids = predicate.ids(indexes)
+			if predicate_ids is None:
+				return None
+			ids.update(dict.fromkeys(predicate_ids))
+		return ids.keys()
+
+
+class Not(Predicate):
+	"""Matches elements that don't match predicate"""
+	def __init__(self, predicate):
+		self.predicate = predicate
+	
+	def _compile(self):
+		matcher = self.predicate.compile()
+		def match(properties):
+			return not matcher(properties)
+		return match
+
+
+def _query(properties, kwargs):
+	"""
+	Combines the properties and kwargs arguments of a query into a single
+	Predicate. Returns None if the query has no conditions.
+	
+	Keyword arguments:
+	properties -- None, a Predicate, or a dict of properties to match
+	kwargs -- a dict of properties to match
+	"""
+	if isinstance(properties, Predicate):
+		predicates = [properties]
+	elif properties:
+		predicates = [Eq(k, v) for k, v in properties.items()]
 	else:
-		properties.update(kwargs)
+		predicates = []
+	predicates.extend(Eq(k, v) for k, v in kwargs.items())
+	if not predicates:
+		return None
+	elif len(predicates) == 1:
+		return predicates[0]
+	return And(*predicates)
+
+def _select(graph_elements, query):
+	"""Returns a list of the graph_elements matching query, which may be None"""
+	if query is None:
+		return list(graph_elements)
+	match = query.compile()
+	return [element for element in graph_elements if match(element.properties)]
+
+def filter(graph_elements, properties=None, **kwargs):
+	"""
+	Returns an ElementList of the graph_elements having all the properties in
+	properties and kwargs combined
+	
+	Keyword arguments:
+	graph_elements -- an iterable of nodes or edges
+	properties -- a dict containing properties to filter by, or a Predicate
+	kwargs -- a dict containing properties to filter by
+	"""
+	return ElementList(_select(graph_elements, _query(properties, kwargs)))
+
+def ifilter(graph_elements, properties=None, **kwargs):
+	"""
+	Like filter() but returns an ElementIterator that filters graph_elements
+	as it is consumed
+	"""
+	return ElementIterator(graph_elements)._where(_query(properties, kwargs))
+
+class ElementIterator(object):
+	"""
+	A lazy sequence of graph elements, produced one at a time as it is
+	consumed. Can only be consumed once, and the graph it came from must not
+	be changed while it is. Methods that narrow the sequence return a new
+	ElementIterator over this one, so calls can be chained:
+		g.iter_nodes(type='user').filter_by_property(age=21).limit(10).list()
+	"""
+	def __init__(self, graph_elements):
+		self._iterator = iter(graph_elements)
+	
+	def __iter__(self):
+		return self
+	
+	def __next__(self):
+		return next(self._iterator)
+	
+	def _where(self, query):
+		if query is None:
+			return self
+		match = query.compile()
+		return ElementIterator(element for element in self._iterator
+								if match(element.properties))
 	
+	def filter_by_property(self, properties=None, **kwargs):
+		"""
+		Filters graph elements by property
+		Keyword arguments:
+		properties -- a dict containing properties to filter by, or a
+			Predicate
+		kwargs -- a dict containing properties to filter by
+		"""
+		return self._where(_query(properties, kwargs))
+	
+	def first(self):
+		"""Returns the next element, or None if there are no more"""
+		return next(self._iterator, None)
 	
-	result_list = []
-	for element in graph_elements:
-		if all(k in element.properties and element.properties[k] == v
-				for k, v in properties.items()):
-			result_list.append(element)
-	return ElementList(result_list)
+	def limit(self, n):
+		"""Returns an ElementIterator over at most the next n elements"""
+		return ElementIterator(itertools.islice(self._iterator, n))
+	
+	def count(self):
+		"""Consumes the remaining elements and returns how many there were"""
+		count = 0
+		for _ in self._iterator:
+			count += 1
+		return count
+	
+	def list(self):
+		"""Consumes the remaining elements and returns them in an ElementList"""
+		return ElementList(self._iterator)
 
 class ElementList(list):
 	def filter_by_property(self, properties=None, **kwargs):
 		"""
 		Filters graph elements by property
 		Keyword arguments:
-		properties -- a dict containing properties to filter by
+		properties -- a dict containing properties to filter by, or a
+			Predicate
 		kwargs -- a dict containing properties to filter by
 		"""
-		if properties is None:
-			properties = {}
-		properties.update(kwargs)
-		result_list = ElementList()
-		for element in self:
-			if all(k in element.properties and element.properties[k] == v
-					for k, v in properties.items()):
-				result_list.append(element)
-		return result_list
+		return ElementList(_select(self, _query(properties, kwargs)))
+
+# indexes of the two adjacency lists kept per label in Node._edges
+OUTGOING = 0
+INCOMING = 1
+
+_set_slot = object.__setattr__
+
+_DIRECTION_INDEXES = {'outgoing': OUTGOING, 'incoming': INCOMING}
+
+def _adjacency_lists(node, label):
+	"""Returns node._edges[label], creating it if it doesn't exist"""
+	lists = node._edges.get(label)
+	if lists is None:
+		lists = node._edges[label] = [[], []]
+	return lists
+
+# the Edge slot holding an edge's position in each of its adjacency lists
+_POSITION_SLOTS = ('_start_position', '_end_position')
+
+def _append_edge(node, edge, direction):
+	"""Adds edge to the end of node's adjacency list for direction"""
+	edges = _adjacency_lists(node, edge.label)[direction]
+	_set_slot(edge, _POSITION_SLOTS[direction], len(edges))
+	edges.append(edge)
+
+def _take_out_edge(node, edge, direction):
+	"""
+	Takes edge out of node's adjacency list for direction in constant time,
+	by moving the last edge of the list into its place
+	"""
+	lists = node._edges[edge.label]
+	edges = lists[direction]
+	slot = _POSITION_SLOTS[direction]
+	last = edges.pop()
+	if last is not edge:
+		position = getattr(edge, slot)
+		edges[position] = last
+		_set_slot(last, slot, position)
+	if not lists[OUTGOING] and not lists[INCOMING]:
+		del node._edges[edge.label]
+
+def _unlink_edge(edge):
+	"""Takes edge out of the adjacency lists of both its nodes"""
+	_take_out_edge(edge.start_node, edge, OUTGOING)
+	_take_out_edge(edge.end_node, edge, INCOMING)
+
 
 class Node(object):
 	"""
 	A node in a graph. Node properties can be accessed like attributes.
+	Nodes have no instance dict, only the slots below.
 	
 	Instance variables:
 	id -- the unique id of the node in the graph. Do not modify
 	properties -- a dict containing the properties of the graph. The keys of
 		this dict need to be strings. Key names in the dict must not overlap
 		with object/class variable or method names
-	_edges -- a default dict containing defaultdicts representing _edges, and
-		their direction
-		eg. _edges['knows']['outgoing'] == [all outgoing _edges labelled 'knows']
+	_edges -- a dict mapping edge labels to a pair of lists, the outgoing and
+		the incoming edges with that label
+		eg. _edges['knows'][OUTGOING] == [all outgoing _edges labelled 'knows']
+		Removing an edge moves the last edge of each of its lists into its
+		place, so the lists are only in the order edges were added until one
+		is removed
+	_graph -- the graph the node was added to, or None. Property assignments
+		go through it so its indexes stay up to date
+	
+	Nodes of a graph opened from a snapshot have properties and _edges read
+	in the first time they are used.
 	"""
-	_initialized = False
+	__slots__ = ('id', 'properties', '_edges', '_graph')
+	
 	def __init__(self, id, properties=None, **kwargs):
-		self.id = id
+		# slots are set directly, skipping the __setattr__ below
 		if properties is None:
-			self.properties = {}
-		else:
-			self.properties = properties
-		self.properties.update(kwargs)
-		# syntax: eg. _edges['knows']['incoming'] == [incoming knows get_edges]
-		self._edges = {}
-		self._initialized = True
+			properties = {}
+		if kwargs:
+			properties.update(kwargs)
+		_set_slot(self, '_graph', None)
+		_set_slot(self, 'id', id)
+		_set_slot(self, 'properties', properties)
+		_set_slot(self, '_edges', {})
 	
 	def __setattr__(self, name, value):
-		# If this object hasn't finished its __init__ method 
-		if not self._initialized:
+		if name in _NODE_SLOTS:
 			object.__setattr__(self, name, value)
+		elif self._graph is not None:
+			self._graph._set_property(self, name, value)
 		else:
-			if name in self.__dict__:
-				object.__setattr__(self, name, value)
-			else:
-				self.properties[name] = value
+			self.properties[name] = value
 	
 	def __getattr__(self, name):
 		"""When python can't find the attribute it comes here"""
-		return self.properties[name]
+		if name in _NODE_SLOTS or name.startswith('__'):
+			if name in _LAZY_SLOTS:
+				graph = getattr(self, '_graph', None)
+				if graph is not None and graph._snapshot is not None:
+					return graph._snapshot.load(self, name)
+			# a slot that hasn't been set yet, eg. while unpickling, or a
+			# special method lookup like copy's __deepcopy__
+			raise AttributeError(name)
+		try:
+			return self.properties[name]
+		except KeyError:
+			# so hasattr() and getattr() with a default work, eg. rpyc's
+			# probes for exposed_ names through a netref
+			raise AttributeError(name)
 	
-	def __getstate__(self): return self.__dict__
-	def __setstate__(self, d): self.__dict__.update(d)
-		
+	def __getstate__(self):
+		return (self.id, self.properties, self._edges, self._graph)
+	
+	def __setstate__(self, state):
+		if isinstance(state, dict):
+			# pickled before nodes had slots and paired adjacency lists
+			edges = {label: [direction_edge_map['outgoing'],
+							direction_edge_map['incoming']]
+					for label, direction_edge_map in state['_edges'].items()}
+			state = (state['id'], state['properties'], edges,
+					state.get('_graph'))
+		for name, value in zip(Node.__slots__, state):
+			object.__setattr__(self, name, value)
+		# edges don't pickle their positions, their nodes put them back
+		for lists in self._edges.values():
+			for direction in (OUTGOING, INCOMING):
+				slot = _POSITION_SLOTS[direction]
+				for position, edge in enumerate(lists[direction]):
+					_set_slot(edge, slot, position)
+	
+	def _adjacency(self, label, direction):
+		"""
+		Yields (edges, direction) for the adjacency lists of this node with
+		label (any label if None) and direction, without copying them
+		"""
+		if direction not in DIRECTIONS:
+			raise GraphError('"{0}" is not valid direction'.format(direction))
+		if label is None:
+			label_lists = self._edges.values()
+		elif label in self._edges:
+			label_lists = (self._edges[label],)
+		else:
+			return
+		if direction == 'any':
+			for lists in label_lists:
+				yield lists[OUTGOING], 'outgoing'
+				yield lists[INCOMING], 'incoming'
+		else:
+			index = OUTGOING if direction == 'outgoing' else INCOMING
+			for lists in label_lists:
+				yield lists[index], direction
+	
+	def iter_edges(self, label=None, direction='any', properties=None,
+				**kwargs):
+		"""
+		Like edges() but returns an ElementIterator that finds the edges as it
+		is consumed
+		"""
+		edges = (edge
+				for edges, _ in self._adjacency(label, direction)
+				for edge in edges)
+		return ElementIterator(edges)._where(_query(properties, kwargs))
 	
 	def edges(self, label=None, direction='any', properties=None, **kwargs):
 		"""
@@ -103,40 +548,47 @@ class Node(object):
 		
 		Keyword arguments:
 		label -- the label of the get_edges to be returned
-		direction -- 'incoming', 'outgoing', or 'both'
-		properties -- the properties of the get_edges to be returned
+		direction -- 'incoming', 'outgoing', or 'any'
+		properties -- the properties of the get_edges to be returned, or a
+			Predicate
 		kwargs -- the properties of the get_edges to be returned
 		"""
-		if properties is None:
-			properties = {}
-		result_edges = []
-		
-		# simple refactoring of duplicate code
-		def edges_helper(direction_edge_map):
-			if direction == 'incoming' or direction == 'outgoing':
-				filtered_edges = filter(direction_edge_map[direction],
-										properties,
-										**kwargs)
-				result_edges.extend(filtered_edges)
-			elif direction == 'any':
-				for edges in direction_edge_map.values():
-					filtered_edges = filter(edges,
-											properties,
-											**kwargs)
-					result_edges.extend(filtered_edges)
-			else:
-				print("Error: direction isn't a valid direction")
-		
-		if label is None:
-			for direction_edge_map in self._edges.values():
-				edges_helper(direction_edge_map)
-		elif label in self._edges:
-			direction_edge_map = self._edges[label]
-			edges_helper(direction_edge_map)
-		return ElementList(result_edges)
+		with _reading(self._graph):
+			return self.iter_edges(label, direction, properties,
+									**kwargs).list()
 	
+	def iter_adjacent_nodes(self, label=None, direction="outgoing",
+						properties=None, **kwargs):
+		"""
+		Like adjacent_nodes() but returns an ElementIterator that finds the
+		nodes as it is consumed
+		"""
+		adjacency = _compact_adjacency(self)
+		# with no label, 'any' interleaves directions per label, which the
+		# packed arrays don't keep, so the adjacency lists are read instead
+		if adjacency is not None and (label is not None or direction != 'any'):
+			if direction not in DIRECTIONS:
+				raise GraphError('"{0}" is not valid direction'.format(direction))
+			row = adjacency.rows[self.id]
+			nodes = adjacency.nodes
+			if label is None:
+				csrs = [adjacency.csrs[(None, _DIRECTION_INDEXES[direction])]]
+			else:
+				csrs = adjacency.csr_list({label: direction})
+			adjacent = (nodes[target]
+						for offsets, targets in csrs
+						for target in targets[offsets[row]:offsets[row + 1]])
+			return ElementIterator(adjacent)._where(_query(properties, kwargs))
+		def nodes():
+			for edges, d in self._adjacency(label, direction):
+				if d == 'incoming':
+					for edge in edges:
+						yield edge.start_node
+				else:
+					for edge in edges:
+						yield edge.end_node
+		return ElementIterator(nodes())._where(_query(properties, kwargs))
 	
-			
 	def adjacent_nodes(self, label=None, direction="outgoing",
 					properties=None, **kwargs):
 		"""
@@ -151,53 +603,16 @@ class Node(object):
 		label -- label of the edges connecting the adjacent nodes to be
 			returned. Default None.
 		direction -- direction of the edges connecting the nodes to be
-			returned. Can take values 'incoming', 'outgoing', 'both'.
+			returned. Can take values 'incoming', 'outgoing', 'any'.
 			Default 'outgoing'
 		properties -- dict containing properties that the adjacent nodes must
-			have. Default None
+			have, or a Predicate. Default None
 		kwargs -- dict containing properties that the adjacent nodes must have
 			Default None.
 		"""
-		if properties is None:
-			properties = {}
-		result_nodes = ElementList()
-		if label is None:
-			for direction_edges_map in self._edges.values():
-				if direction == 'any':
-					for d, edges in direction_edges_map.items():
-						if d == 'incoming':
-							for edge in edges:
-								result_nodes.append(edge.start_node)
-						else:
-							for edge in edges:
-								result_nodes.append(edge.end_node)
-				elif direction == 'incoming' or direction == 'outgoing':
-					for edge in direction_edges_map[direction]:
-						if direction == 'incoming':
-							result_nodes.append(edge.start_node)
-						else:
-							result_nodes.append(edge.end_node)
-				else:
-					raise GraphError('"{0}" is not valid direction'
-									.format(direction))
-		else:
-			if label in self._edges:
-				direction_edges_map = self._edges[label]
-				if direction == 'incoming':
-					for edge in direction_edges_map[direction]:
-						result_nodes.append(edge.start_node)
-				elif direction == 'outgoing':
-					for edge in direction_edges_map[direction]:
-						result_nodes.append(edge.end_node)
-				elif direction == 'any':
-					for d, edges in direction_edges_map:
-						if d == 'incoming':
-							for edge in edges:
-								result_nodes.append(edge.start_node)
-						else:
-							for edge in edges:
-								result_nodes.append(edge.end_node)
-		return result_nodes.filter_by_property(properties, **kwargs)
+		with _reading(self._graph):
+			return self.iter_adjacent_nodes(label, direction, properties,
+											**kwargs).list()
 	
 	def adjacent_node(self, label=None, direction="outgoing",
 					properties=None, **kwargs):
@@ -205,7 +620,7 @@ class Node(object):
 		Return an arbitrary adjacent node connected to this node by an edge
 		labeled label, with direction == direction. The properties of this
 		adjacent node will be a subset of properties.update(kwargs). Otherwise
-		return None.
+		return None. Stops looking at the first match.
 		
 		If label is None then return all adjacent nodes with the above
 		qualifications minus label.
@@ -214,77 +629,674 @@ class Node(object):
 		label -- label of the edge connecting the adjacent node to be
 			returned. Default None.
 		direction -- Direction of the edge connecting the adjacent node to be
-			returned. Can take values 'incoming', 'outgoing', 'both'. Default
+			returned. Can take values 'incoming', 'outgoing', 'any'. Default
 			'outgoing'
 		properties -- dict containing properties that the adjacent node must
-			have. Default None.
+			have, or a Predicate. Default None.
 		kwargs -- dict containing properties that the adjacent node must
 			have. Default None.
 		"""
-		nodes = self.adjacent_nodes(label, direction, properties, **kwargs)
-		if nodes:
-			return nodes[0]
-		else:
-			return None
+		with _reading(self._graph):
+			return self.iter_adjacent_nodes(label, direction, properties,
+											**kwargs).first()
 
 class Edge(object):
 	"""
 	An edge in a graph. Key names of the properties dict are restricted from
 	['id', 'label', 'start_node', 'end_node'] and any of the method names
 	
-	Both Node and Edge share the same _initialized, getattr, setattr,
-	properties code
+	Both Node and Edge share the same slots based getattr, setattr,
+	properties, _graph code. String labels are interned so every edge with
+	the same label shares one label object. Edges of a graph opened from a
+	snapshot have their properties read in the first time they are used.
+	
+	_start_position and _end_position are the edge's positions in the
+	adjacency lists of its start and end node, so it can be taken out of
+	them without searching. They aren't pickled.
 	"""
-	_initialized = False
+	__slots__ = ('id', 'label', 'start_node', 'end_node', 'properties',
+				'_graph', '_start_position', '_end_position')
+	
 	def __init__(self, id, start_node, label, end_node, properties=None, **kwargs):
-		self.id = id
-		self.label = label
-		self.start_node = start_node
-		self.end_node = end_node
+		if type(label) is str:
+			label = sys.intern(label)
 		if properties is None:
-			self.properties = {}
-		else:
-			self.properties = properties
-		self.properties.update(kwargs)
-		# all this code is because I can't pickle defaultdict of defaultdicts
-		# and I don't want to mess with __getstate__/__setstate__ right now
-		if label not in start_node._edges:
-			start_node._edges[label] = {}
-			start_node._edges[label]['outgoing'] = []
-			start_node._edges[label]['incoming'] = []
-		if label not in end_node._edges:
-			end_node._edges[label] = {}
-			end_node._edges[label]['incoming'] = []
-			end_node._edges[label]['outgoing'] = []
-		
-		start_node._edges[label]['outgoing'].append(self)
-		end_node._edges[label]['incoming'].append(self)
-		self._initialized = True
-		
+			properties = {}
+		if kwargs:
+			properties.update(kwargs)
+		# slots are set directly, skipping the __setattr__ below
+		_set_slot(self, '_graph', None)
+		_set_slot(self, 'id', id)
+		_set_slot(self, 'label', label)
+		_set_slot(self, 'start_node', start_node)
+		_set_slot(self, 'end_node', end_node)
+		_set_slot(self, 'properties', properties)
+		_append_edge(start_node, self, OUTGOING)
+		_append_edge(end_node, self, INCOMING)
+	
 	def __setattr__(self, name, value):
-		# If this object hasn't finished its __init__ method 
-		if not self._initialized:
+		if name == 'label' and self._graph is not None:
+			self._graph._relabel_edge(self, value)
+		elif name in _EDGE_SLOTS:
 			object.__setattr__(self, name, value)
+		elif self._graph is not None:
+			self._graph._set_property(self, name, value)
 		else:
-			if name in self.__dict__:
-				object.__setattr__(self, name, value)
-			else:
-				self.properties[name] = value
+			self.properties[name] = value
 	
 	def __getattr__(self, name):
 		"""When python can't find the attribute it comes here"""
-		return self.properties[name]
+		if name in _EDGE_SLOTS or name.startswith('__'):
+			if name in _LAZY_SLOTS:
+				graph = getattr(self, '_graph', None)
+				if graph is not None and graph._snapshot is not None:
+					return graph._snapshot.load(self, name)
+			# a slot that hasn't been set yet, eg. while unpickling, or a
+			# special method lookup like copy's __deepcopy__
+			raise AttributeError(name)
+		try:
+			return self.properties[name]
+		except KeyError:
+			# so hasattr() and getattr() with a default work, eg. rpyc's
+			# probes for exposed_ names through a netref
+			raise AttributeError(name)
+	
+	def __getstate__(self):
+		return (self.id, self.label, self.start_node, self.end_node,
+				self.properties, self._graph)
+	
+	def __setstate__(self, state):
+		if isinstance(state, dict):
+			# pickled before edges had slots
+			state = (state['id'], state['label'], state['start_node'],
+					state['end_node'], state['properties'], state.get('_graph'))
+		for name, value in zip(Edge.__slots__, state):
+			object.__setattr__(self, name, value)
+
+_NODE_SLOTS = frozenset(Node.__slots__)
+_EDGE_SLOTS = frozenset(Edge.__slots__)
+# slots an element read from a snapshot can leave unset until they are used
+_LAZY_SLOTS = frozenset(('properties', '_edges'))
+
+class PropertyIndex(object):
+	"""
+	A hash index from the values of one property to the ids of the elements
+	that have that value. Ids are kept in insertion order.
+	
+	Instance variables:
+	key -- the property key that is indexed
+	unique -- if True no two elements may share a value for key
+	_ids -- a dict mapping a property value to a dict whose keys are ids
+	"""
+	def __init__(self, key, unique=False):
+		self.key = key
+		self.unique = unique
+		self._ids = {}
+	
+	def lookup(self, value):
+		"""
+		Returns the ids of the elements whose property key == value
+		
+		Keyword arguments:
+		value -- the property value to look up
+		"""
+		try:
+			ids = self._ids.get(value)
+		except TypeError:
+			raise GraphError('Cannot index unhashable value {0!r}'.format(value))
+		if ids is None:
+			return ()
+		return ids.keys()
+	
+	def check(self, id, value):
+		"""
+		Raises GraphError if adding id with value would break uniqueness
+		
+		Keyword arguments:
+		id -- the id of the element that would be added
+		value -- the property value of the element
+		"""
+		if self.unique:
+			ids = self.lookup(value)
+			if ids and id not in ids:
+				raise GraphError('Unique index on "{0}" already contains {1!r}'
+								.format(self.key, value))
+	
+	def add(self, id, value):
+		self.check(id, value)
+		self._ids.setdefault(value, {})[id] = None
+	
+	def remove(self, id, value):
+		ids = self._ids.get(value)
+		if ids is not None:
+			ids.pop(id, None)
+			if not ids:
+				del self._ids[value]
+	
+	def counts(self):
+		"""Returns a dict mapping every indexed value to its number of elements"""
+		return {value: len(ids) for value, ids in self._ids.items()}
+
+
+class Degree(object):
+	"""
+	The number of edges of a node with a label in a direction, which
+	Graph.aggregate() can aggregate or group by like a property, eg.
+		g.aggregate({'comments': ('avg', Degree('owns'))}, group_by='type')
+	
+	Instance variables:
+	label -- the label of the edges counted, or None for any
+	direction -- 'incoming', 'outgoing' or 'any'
+	"""
+	def __init__(self, label=None, direction='outgoing'):
+		if direction not in DIRECTIONS:
+			raise GraphError('"{0}" is not valid direction'.format(direction))
+		self.label = label
+		self.direction = direction
+	
+	def of(self, node):
+		"""Returns the degree of node"""
+		return sum(len(edges) for edges, _ in node._adjacency(self.label,
+															self.direction))
+	
+	def __repr__(self):
+		return 'Degree({0!r}, {1!r})'.format(self.label, self.direction)
+
+AGGREGATES = ('count', 'sum', 'min', 'max', 'avg')
+
+def _value_of(element, key):
+	"""Returns the property key, or Degree key, of element, or _MISSING"""
+	if type(key) is Degree:
+		return key.of(element)
+	return element.properties.get(key, _MISSING)
+
+
+class CompactAdjacency(object):
+	"""
+	A frozen copy of the adjacency of a graph packed into integer arrays, one
+	compressed sparse row (CSR) per label and direction. Built by
+	Graph.compact(), and read by BreadthFirstTraverser and
+	Node.adjacent_nodes() while the graph hasn't changed since.
+	
+	Nodes are numbered by row in the order of Graph._nodes. In a CSR
+	(offsets, targets) the edges of the node in row r are at positions
+	offsets[r] up to offsets[r + 1] of targets, which holds the row of the
+	node at the other end of each edge.
+	
+	Instance variables:
+	nodes -- a list of the graph's nodes, indexed by row
+	rows -- a dict mapping node ids to rows
+	csrs -- a dict mapping (label, direction) to a CSR, where direction is
+		OUTGOING or INCOMING. Label None holds the edges of all labels in the
+		order each node's _edges lists them
+	"""
+	def __init__(self, graph, previous=None, changed_ids=()):
+		"""
+		Packs the adjacency of graph.
+		
+		Keyword arguments:
+		graph -- the graph to pack
+		previous -- a CompactAdjacency of an earlier state of graph. The rows
+			of nodes not in changed_ids are copied from it. Default None
+		changed_ids -- the ids of the nodes whose adjacency may differ from
+			previous. Default ()
+		"""
+		self.nodes = list(graph._nodes.values())
+		self.rows = {node.id: row for row, node in enumerate(self.nodes)}
+		keys = [(None, OUTGOING), (None, INCOMING)]
+		for label in graph._labels:
+			keys.append((label, OUTGOING))
+			keys.append((label, INCOMING))
+		self.csrs = {key: (array('q', (0,)), array('q')) for key in keys}
+		# rows can only be copied if no node before them was removed
+		if previous is not None and all(id in self.rows for id in changed_ids):
+			copyable_rows = len(previous.nodes)
+		else:
+			copyable_rows = 0
+		row = 0
+		while row < len(self.nodes):
+			if row < copyable_rows and self.nodes[row].id not in changed_ids:
+				end = row + 1
+				while end < copyable_rows and self.nodes[end].id not in changed_ids:
+					end += 1
+				for key, csr in self.csrs.items():
+					_copy_rows(previous.csrs.get(key), csr, row, end)
+				row = end
+			else:
+				self._add_row(self.nodes[row])
+				row += 1
+	
+	def _add_row(self, node):
+		"""Appends the row of node, read from its adjacency lists"""
+		csrs = self.csrs
+		rows = self.rows
+		all_outgoing = csrs[(None, OUTGOING)][1]
+		all_incoming = csrs[(None, INCOMING)][1]
+		for label, lists in node._edges.items():
+			targets = [rows[edge.end_node.id] for edge in lists[OUTGOING]]
+			csrs[(label, OUTGOING)][1].extend(targets)
+			all_outgoing.extend(targets)
+			targets = [rows[edge.start_node.id] for edge in lists[INCOMING]]
+			csrs[(label, INCOMING)][1].extend(targets)
+			all_incoming.extend(targets)
+		for offsets, targets in csrs.values():
+			offsets.append(len(targets))
+	
+	def csr_list(self, label_directions, default_direction=OUTGOING):
+		"""
+		Returns the CSRs to read, in order, to find the nodes adjacent to a
+		node through label_directions, like _edge_lists() does for nodes
+		
+		Keyword arguments:
+		label_directions -- a dict mapping edge labels to 'incoming',
+			'outgoing' or 'any'. If empty every label in default_direction
+			is read
+		default_direction -- OUTGOING or INCOMING. Default OUTGOING
+		"""
+		if not label_directions:
+			return [self.csrs[(None, default_direction)]]
+		csrs = []
+		for label, direction in label_directions.items():
+			if direction == 'any':
+				directions = (OUTGOING, INCOMING)
+			else:
+				directions = (_DIRECTION_INDEXES[direction],)
+			for d in directions:
+				csr = self.csrs.get((label, d))
+				if csr is not None:
+					csrs.append(csr)
+		return csrs
+
+def _copy_rows(old_csr, csr, start, end):
+	"""Appends rows start up to end of old_csr, which may be None, to csr"""
+	offsets, targets = csr
+	if old_csr is None:
+		offsets.extend(itertools.repeat(len(targets), end - start))
+		return
+	old_offsets, old_targets = old_csr
+	first, last = old_offsets[start], old_offsets[end]
+	shift = len(targets) - first
+	targets.extend(old_targets[first:last])
+	offsets.extend(offset + shift for offset in old_offsets[start + 1:end + 1])
+
+def _compact_adjacency(node):
+	"""
+	Returns the CompactAdjacency of node's graph if it is up to date,
+	otherwise None
+	"""
+	graph = node._graph
+	if graph is None or graph._compacted is None or graph._changed_ids:
+		return None
+	return graph._compacted
+
+
+class ReadWriteLock(object):
+	"""
+	A lock many threads can hold for reading at once, or one thread for
+	writing. Waiting writers go before threads that haven't started reading
+	yet, so a steady stream of readers can't hold writes off forever. Both
+	are reentrant, and the thread writing may also read, but a thread that
+	only holds the lock for reading can't start writing, which would wait for
+	itself.
+	"""
+	def __init__(self):
+		self._condition = threading.Condition(threading.Lock())
+		# syntax: eg. _readers[thread id] == the number of reads it holds
+		self._readers = {}
+		self._writer = None
+		self._writes = 0
+		self._waiting_writers = 0
+	
+	def acquire_read(self):
+		me = threading.get_ident()
+		with self._condition:
+			if me not in self._readers and self._writer != me:
+				while self._writer is not None or self._waiting_writers:
+					self._condition.wait()
+			self._readers[me] = self._readers.get(me, 0) + 1
+	
+	def release_read(self):
+		me = threading.get_ident()
+		with self._condition:
+			count = self._readers[me] - 1
+			if count:
+				self._readers[me] = count
+			else:
+				del self._readers[me]
+				if not self._readers:
+					self._condition.notify_all()
 	
-	def __getstate__(self): return self.__dict__
-	def __setstate__(self, d): self.__dict__.update(d)
+	def acquire_write(self):
+		me = threading.get_ident()
+		with self._condition:
+			if self._writer == me:
+				self._writes += 1
+				return
+			if me in self._readers:
+				raise GraphError('Cannot write to a graph while reading it')
+			self._waiting_writers += 1
+			try:
+				while self._writer is not None or self._readers:
+					self._condition.wait()
+			finally:
+				self._waiting_writers -= 1
+			self._writer = me
+			self._writes = 1
 	
+	def release_write(self):
+		with self._condition:
+			self._writes -= 1
+			if not self._writes:
+				self._writer = None
+				self._condition.notify_all()
+	
+	@contextlib.contextmanager
+	def reading(self):
+		self.acquire_read()
+		try:
+			yield
+		finally:
+			self.release_read()
+	
+	@contextlib.contextmanager
+	def writing(self):
+		self.acquire_write()
+		try:
+			yield
+		finally:
+			self.release_write()
+
+def _reads(method):
+	"""Makes a Graph method hold the graph's lock for reading while it runs"""
+	@functools.wraps(method)
+	def reading(self, *args, **kwargs):
+		lock = self._lock
+		lock.acquire_read()
+		try:
+			return method(self, *args, **kwargs)
+		finally:
+			lock.release_read()
+	return reading
+
+def _writes(method):
+	"""Makes a Graph method hold the graph's lock for writing while it runs"""
+	@functools.wraps(method)
+	def writing(self, *args, **kwargs):
+		lock = self._lock
+		lock.acquire_write()
+		try:
+			return method(self, *args, **kwargs)
+		finally:
+			lock.release_write()
+	return writing
+
+def _reading(graph):
+	"""Returns a context holding graph's lock for reading, if graph isn't None"""
+	if graph is None:
+		return contextlib.nullcontext()
+	return graph._lock.reading()
+
 
 class Graph(object):
+	"""
+	A graph of Nodes joined by Edges. It can be shared between threads:
+	changes hold a ReadWriteLock for writing and methods that return lists
+	hold it for reading. Iterators, like those of iter_nodes() and
+	find_reachable_nodes_from(), are read after their method returns, so
+	threads using them while others make changes should hold the lock with
+	reading(), and threads making several changes that belong together with
+	writing().
+	"""
 	def __init__(self):
 		self._nextid = 0
 		self._nodes = {}
 		self._edges = {}
+		# syntax: eg. _indexes['node']['type'] == PropertyIndex for 'type'
+		self._indexes = {'node': {}, 'edge': {}}
+		# syntax: eg. _labels['knows'] == dict whose keys are 'knows' edge ids
+		self._labels = {}
+		# set by compact(), along with the ids of nodes whose adjacency has
+		# changed since
+		self._compacted = None
+		self._changed_ids = set()
+		# called with a description of every change, see add_listener()
+		self._listeners = []
+		# set when opened from a snapshot file, which then stands in for the
+		# elements not read from it yet. It has load(element, slot), and
+		# _nodes and _edges are mappings that read elements in on access
+		self._snapshot = None
+		self._lock = ReadWriteLock()
+	
+	def __getstate__(self):
+		# the packed adjacency is rebuilt by compact() rather than saved, and
+		# listeners and the lock belong to whoever opened the graph
+		d = dict(self.__dict__)
+		del d['_lock']
+		d['_compacted'] = None
+		d['_changed_ids'] = set()
+		d['_listeners'] = []
+		if self._snapshot is not None:
+			# the snapshot can't be pickled, so everything is read in from it
+			d['_nodes'] = dict(self._nodes)
+			d['_edges'] = dict(self._edges)
+			d['_snapshot'] = None
+		return d
+	
+	def __setstate__(self, d):
+		# graphs pickled before an attribute existed get its default value
+		self.__init__()
+		d.pop('_lock', None)
+		self.__dict__.update(d)
+		if '_labels' not in d:
+			for node in self._nodes.values():
+				node._graph = self
+			for edge in self._edges.values():
+				edge._graph = self
+				self._label_edge(edge)
+	
+	def reading(self):
+		"""
+		Returns a context manager holding the graph's lock for reading, eg.
+			with g.reading():
+				names = [node.name for node in g.iter_nodes(type='user')]
+		"""
+		return self._lock.reading()
+	
+	def writing(self):
+		"""
+		Returns a context manager holding the graph's lock for writing, so no
+		other thread sees the graph part way through several changes
+		"""
+		return self._lock.writing()
+	
+	@_writes
+	def add_listener(self, listener):
+		"""
+		Registers a function to be called after every change made through the
+		graph, eg. to log it. It is called as listener(operation, *args),
+		where args only hold ids, labels and property values:
+			('add_node', id, properties)
+			('add_edge', id, start_id, label, end_id, properties)
+			('add_nodes', first_id, [properties, ...])
+			('add_edges', first_id, [(start_id, label, end_id, properties), ...])
+			('remove_node', id)
+			('remove_edge', id)
+			('remove_nodes', [id, ...])
+			('remove_edges', [id, ...])
+			('set_property', element_type, id, key, value)
+			('relabel_edge', id, label)
+			('create_index', element_type, key, unique)
+			('drop_index', element_type, key)
+		Properties dicts are the elements' own, not copies. Changes made
+		straight to an element's properties dict aren't seen.
+		
+		Keyword arguments:
+		listener -- the function to call
+		"""
+		self._listeners.append(listener)
+	
+	@_writes
+	def remove_listener(self, listener):
+		"""Stops calling a function registered with add_listener()"""
+		self._listeners.remove(listener)
+	
+	def _notify(self, operation, *args):
+		for listener in self._listeners:
+			listener(operation, *args)
+	
+	def _elements(self, element_type):
+		if element_type == 'node':
+			return self._nodes
+		elif element_type == 'edge':
+			return self._edges
+		else:
+			raise GraphError('"{0}" is not a valid element type'
+							.format(element_type))
+	
+	@_writes
+	def create_index(self, element_type, key, unique=False):
+		"""
+		Creates a hash index on the property key of nodes or edges. Once
+		created node(), nodes(), edge() and edges() use it automatically for
+		queries that include key.
+		
+		Keyword arguments:
+		element_type -- 'node' or 'edge'
+		key -- the property key to index
+		unique -- if True, adding an element whose value for key is already
+			taken raises GraphError. Default False
+		"""
+		elements = self._elements(element_type)
+		if key in self._indexes[element_type]:
+			raise GraphError('{0} index on "{1}" already exists'
+							.format(element_type, key))
+		index = PropertyIndex(key, unique)
+		for element in elements.values():
+			if key in element.properties:
+				index.add(element.id, element.properties[key])
+		self._indexes[element_type][key] = index
+		if self._listeners:
+			self._notify('create_index', element_type, key, unique)
+		return index
+	
+	@_writes
+	def drop_index(self, element_type, key):
+		"""
+		Removes the index on the property key of nodes or edges
+		
+		Keyword arguments:
+		element_type -- 'node' or 'edge'
+		key -- the indexed property key
+		"""
+		self._elements(element_type)
+		if key not in self._indexes[element_type]:
+			raise GraphError('{0} index on "{1}" does not exist'
+							.format(element_type, key))
+		del self._indexes[element_type][key]
+		if self._listeners:
+			self._notify('drop_index', element_type, key)
+	
+	def _check_indexes(self, element_type, id, properties):
+		"""Raises GraphError if properties would break a unique index"""
+		for key, index in self._indexes[element_type].items():
+			if key in properties:
+				index.check(id, properties[key])
+	
+	def _index_element(self, element_type, element):
+		properties = element.properties
+		for key, index in self._indexes[element_type].items():
+			if key in properties:
+				index.add(element.id, properties[key])
 	
+	def _unindex_element(self, element_type, element):
+		properties = element.properties
+		for key, index in self._indexes[element_type].items():
+			if key in properties:
+				index.remove(element.id, properties[key])
+	
+	@_writes
+	def _set_property(self, element, name, value):
+		"""Sets a property of one of this graph's elements, updating indexes"""
+		element_type = 'node' if isinstance(element, Node) else 'edge'
+		index = self._indexes[element_type].get(name)
+		if index is not None:
+			index.check(element.id, value)
+			if name in element.properties:
+				index.remove(element.id, element.properties[name])
+			index.add(element.id, value)
+		element.properties[name] = value
+		if self._listeners:
+			self._notify('set_property', element_type, element.id, name, value)
+	
+	def _adjacency_changed(self, *ids):
+		"""Records that the adjacency of the nodes with ids has changed"""
+		if self._compacted is not None:
+			self._changed_ids.update(ids)
+	
+	@_writes
+	def compact(self, full=False):
+		"""
+		Packs the adjacency of the graph into integer arrays, which
+		find_reachable_nodes_from() and Node.adjacent_nodes() use until the
+		graph changes. Calling it again after changes folds them in, copying
+		the arrays of unchanged nodes instead of reading their edges again.
+		Returns the CompactAdjacency.
+		
+		Keyword arguments:
+		full -- if True, repack every node. Default False
+		"""
+		previous = None if full else self._compacted
+		self._compacted = CompactAdjacency(self, previous, self._changed_ids)
+		self._changed_ids = set()
+		return self._compacted
+	
+	def _label_edge(self, edge):
+		self._labels.setdefault(edge.label, {})[edge.id] = None
+	
+	def _unlabel_edge(self, edge):
+		ids = self._labels.get(edge.label)
+		if ids is not None:
+			ids.pop(edge.id, None)
+			if not ids:
+				del self._labels[edge.label]
+	
+	@_writes
+	def _relabel_edge(self, edge, label):
+		"""Changes the label of one of this graph's edges"""
+		old_label = edge.label
+		if label == old_label:
+			return
+		self._unlabel_edge(edge)
+		if type(label) is str:
+			label = sys.intern(label)
+		_unlink_edge(edge)
+		object.__setattr__(edge, 'label', label)
+		_append_edge(edge.start_node, edge, OUTGOING)
+		_append_edge(edge.end_node, edge, INCOMING)
+		self._label_edge(edge)
+		self._adjacency_changed(edge.start_node.id, edge.end_node.id)
+		if self._listeners:
+			self._notify('relabel_edge', edge.id, label)
+	
+	def _candidates(self, element_type, query, label=None):
+		"""
+		Returns the elements that could match query (and label, for edges),
+		using the most selective of the label index and the indexes query
+		can be pushed down to, or all elements if none of them apply
+		"""
+		elements = self._elements(element_type)
+		best_ids = None
+		if label is not None:
+			best_ids = self._labels.get(label, {}).keys()
+		if query is not None:
+			ids = query.ids(self._indexes[element_type])
+			if ids is not None and (best_ids is None or len(ids) < len(best_ids)):
+				best_ids = ids
+		if best_ids is None:
+			return elements.values()
+		return (elements[id] for id in best_ids)
+	
+	@_reads
 	def node(self, id=None, properties=None, **kwargs):
 		"""
 		Returns a node with id==id and all the properties in properties and
@@ -294,30 +1306,23 @@ class Graph(object):
 		
 		Keyword arguments:
 		id -- the id of the node to return
-		properties -- a dict containing properties of the node to return 
+		properties -- a dict containing properties of the node to return, or
+			a Predicate
 		kwargs -- a dict containing properties of the node to return
 		"""
-		if properties is None:
-			properties = {}
 		if id is None:
-			nodes = filter(self._nodes.values(), properties, **kwargs)
-			if not nodes:
-				return None
-			else:
-				return nodes[0]
+			return self.iter_nodes(properties, **kwargs).first()
 		else:
+			query = _query(properties, kwargs)
 			if id in self._nodes:
 				result_node = self._nodes[id]
-				properties.update(kwargs)
-				for key, value in properties.items():
-					if key not in result_node.properties:
-						return None
-					if result_node.properties[key] != value:
-						return None
+				if query is not None and not query.compile()(result_node.properties):
+					return None
 				return result_node
 			else:
 				return None
 	
+	@_reads
 	def nodes(self, properties=None, **kwargs):
 		"""
 		Returns a list containing nodes with all the properties in
@@ -326,12 +1331,20 @@ class Graph(object):
 		
 		Keyword arguments:
 		properties_dict -- a dict containing properties of the nodes to return
-		properties -- a dict containing properties of the nodes to return
+		properties -- a dict containing properties of the nodes to return, or
+			a Predicate
 		"""
-		if properties is None:
-			properties = {}
-		return filter(self._nodes.values(), properties, **kwargs)
+		return self.iter_nodes(properties, **kwargs).list()
+	
+	def iter_nodes(self, properties=None, **kwargs):
+		"""
+		Like nodes() but returns an ElementIterator that finds the nodes as it
+		is consumed
+		"""
+		query = _query(properties, kwargs)
+		return ElementIterator(self._candidates('node', query))._where(query)
 	
+	@_reads
 	def edge(self, id=None, label=None, properties=None, **kwargs):
 		"""
 		Returns the edge with id=id or returns an arbitrary edge with label=
@@ -341,27 +1354,15 @@ class Graph(object):
 		id -- the id of the edge to return
 		label -- the label of the edge to return
 		properties_dict -- a dict containing properties of the edge to return
-		properties -- a dict containing properties of the edge to return
+		properties -- a dict containing properties of the edge to return, or a
+			Predicate
 		"""
-		if properties is None:
-			properties = {}
 		if id is None:
-			# real sloppy but works
-			results = []
-			edges = filter(self._edges.values(), properties, **kwargs)
-			if label is None:
-				results = edges
-			else:
-				for edge in edges:
-					if edge.label == label:
-						results.append(edge)
-			if not results:
-				return None
-			else:
-				return results[0]
+			return self.iter_edges(label, properties, **kwargs).first()
 		else:
 			return self._edges[id]
 		
+	@_reads
 	def edges(self, label=None, properties=None, **kwargs):
 		"""
 		Returns a list of get_edges with label=label, and the properties of
@@ -370,19 +1371,155 @@ class Graph(object):
 		Keyword arguments:
 		label -- the label of the get_edges to return
 		properties_dict -- a dict containing properties of the get_edges to return
-		properties -- a dict containing properties of the get_edges to return
+		properties -- a dict containing properties of the get_edges to return, or
+			a Predicate
+		"""
+		return self.iter_edges(label, properties, **kwargs).list()
+	
+	def iter_edges(self, label=None, properties=None, **kwargs):
+		"""
+		Like edges() but returns an ElementIterator that finds the edges as it
+		is consumed
+		"""
+		query = _query(properties, kwargs)
+		edges = self._candidates('edge', query, label)
+		if label is not None:
+			edges = (edge for edge in edges if edge.label == label)
+		return ElementIterator(edges)._where(query)
+	
+	@_reads
+	def edge_count(self, label=None):
+		"""
+		Returns the number of edges labeled label, or the number of edges in
+		the graph if label is None. Does not look at the edges themselves.
+		
+		Keyword arguments:
+		label -- the label of the edges to count
 		"""
-		if properties is None:
-			properties = {}
 		if label is None:
-			return filter(self._edges.values(), properties, **kwargs)
+			return len(self._edges)
+		return len(self._labels.get(label, ()))
+	
+	@_reads
+	def edge_label_counts(self):
+		"""Returns a dict mapping every edge label to its number of edges"""
+		return {label: len(ids) for label, ids in self._labels.items()}
+	
+	@_reads
+	def aggregate(self, aggregates=None, group_by=None, element_type='node',
+				label=None, properties=None, **kwargs):
+		"""
+		Aggregates the properties of the nodes or edges matching a query in
+		one pass, eg.
+			g.aggregate({'replays': ('count', None)}, group_by='champion',
+						type='replay')
+			== {'Ahri': {'replays': 12}, 'Zed': {'replays': 3}}
+		Returns a dict mapping the names in aggregates to their values, or
+		with group_by, a dict mapping every value of group_by to such a dict
+		for the elements with that value. Elements without a value for a
+		property are left out of its aggregates, and grouped under None.
+		Counts with nothing else to do are read from the indexes.
+		
+		Keyword arguments:
+		aggregates -- a dict mapping names to (function, key), where function
+			is one of AGGREGATES and key is a property key or a Degree, or
+			None to count elements. Default {'count': ('count', None)}
+		group_by -- a property key or Degree to group by, or None. Default None
+		element_type -- 'node' or 'edge'. Default 'node'
+		label -- for edges, the label of the edges to aggregate, or None for
+			any. Default None
+		properties -- a dict containing properties of the elements to
+			aggregate, or a Predicate
+		kwargs -- a dict containing properties of the elements to aggregate
+		"""
+		if aggregates is None:
+			aggregates = {'count': ('count', None)}
+		for function, key in aggregates.values():
+			if function not in AGGREGATES:
+				raise GraphError('"{0}" is not an aggregate'.format(function))
+			if key is None and function != 'count':
+				raise GraphError('"{0}" needs a key'.format(function))
+		keys = [key for _, key in aggregates.values()] + [group_by]
+		if element_type == 'edge' and any(type(key) is Degree for key in keys):
+			raise GraphError('Only nodes have a Degree')
+		query = _query(properties, kwargs)
+		counts = self._counted(aggregates, group_by, element_type, label, query)
+		if counts is not None:
+			return counts
+		if element_type == 'node':
+			elements = self.iter_nodes(query)
 		else:
-			results = []
-			for edge in self._edges.values():
-				if label == edge.label:
-					results.append(edge)
-			return filter(results, properties, **kwargs)
+			elements = self.iter_edges(label, query)
+		specs = list(aggregates.items())
+		# syntax: group value: [[count, total, minimum, maximum] per spec]
+		groups = {}
+		for element in elements:
+			group = None
+			if group_by is not None:
+				group = _value_of(element, group_by)
+				if group is _MISSING:
+					group = None
+			states = groups.get(group)
+			if states is None:
+				states = groups[group] = [[0, 0, None, None] for _ in specs]
+			for state, (name, (function, key)) in zip(states, specs):
+				if key is None:
+					state[0] += 1
+					continue
+				value = _value_of(element, key)
+				if value is _MISSING:
+					continue
+				state[0] += 1
+				if function in ('sum', 'avg'):
+					state[1] += value
+				elif function == 'min':
+					if state[2] is None or value < state[2]:
+						state[2] = value
+				elif function == 'max':
+					if state[3] is None or value > state[3]:
+						state[3] = value
+		results = {}
+		for group, states in groups.items():
+			result = results[group] = {}
+			for state, (name, (function, key)) in zip(states, specs):
+				count, total, minimum, maximum = state
+				result[name] = {'count': count, 'sum': total, 'min': minimum,
+								'max': maximum,
+								'avg': total / count if count else None}[function]
+		if group_by is None:
+			return results.get(None, self._empty(aggregates))
+		return results
 	
+	def _empty(self, aggregates):
+		"""Returns the aggregates of no elements"""
+		return {name: 0 if function in ('count', 'sum') else None
+				for name, (function, _) in aggregates.items()}
+	
+	def _counted(self, aggregates, group_by, element_type, label, query):
+		"""
+		Returns what aggregate() would if it only counts elements and the
+		counts are kept already, by the label or property indexes, else None
+		"""
+		if query is not None or any(aggregate != ('count', None)
+									for aggregate in aggregates.values()):
+			return None
+		if group_by is None:
+			if element_type == 'edge' and label is not None:
+				count = len(self._labels.get(label, ()))
+			else:
+				count = len(self._elements(element_type))
+			return {name: count for name in aggregates}
+		index = self._indexes[element_type].get(group_by)
+		if index is None or element_type == 'edge' and label is not None:
+			return None
+		counts = index.counts()
+		missing = len(self._elements(element_type)) - sum(counts.values())
+		if missing:
+			counts[None] = counts.get(None, 0) + missing
+		return {value: {name: count for name in aggregates}
+				for value, count in counts.items()}
+	
+	@_writes
 	def add_node(self, properties=None, **kwargs):
 		"""
 		Adds a node to the graph, and returns it. Arguments properties and
@@ -397,10 +1534,17 @@ class Graph(object):
 		# may change method sig of Node since we can always combine arguments
 		# here
 		node = Node(self._nextid, properties, **kwargs)
+		self._check_indexes('node', node.id, node.properties)
+		self._index_element('node', node)
+		node._graph = self
 		self._nodes[self._nextid] = node
+		self._adjacency_changed(node.id)
 		self._nextid += 1
+		if self._listeners:
+			self._notify('add_node', node.id, node.properties)
 		return node
 	
+	@_writes
 	def remove_node(self, id):
 		"""
 		Removes node from the graph by id. See also, node.remove()
@@ -410,28 +1554,55 @@ class Graph(object):
 		"""
 		if id in self._nodes:
 			node = self._nodes[id]
-			edges = node.edges()
-			# ugly can maybe fix it up with sets
-			for edge in edges:
-				label = edge.label
-				del edge.start_node._edges[label]
-				del edge.end_node._edges[label]
-				del self._edges[edge.id]
+			self._remove_edges(self._node_edges([node]))
+			self._unindex_element('node', node)
 			del self._nodes[id]
+			self._adjacency_changed(id)
+			if self._listeners:
+				self._notify('remove_node', id)
 		else:
 			# return a real exception someday
 			print('Error: Cannot remove node since id does not exist')
 	
-	def remove_nodes(self, properties, **kwargs):
+	@_writes
+	def remove_nodes(self, properties=None, **kwargs):
 		"""
-		Remove all nodes with any of the properties in properties or kwargs
+		Removes every node matching properties and kwargs, which are a query
+		like nodes() takes, and all their edges, at once. Returns the number
+		of nodes removed.
 		
 		Keyword arguments:
-		properties -- a dict containing properties of nodes to be removed
+		properties -- a dict containing properties of nodes to be removed, or
+			a Predicate. With no properties or kwargs every node is removed
 		kwargs -- a dict containing properties of nodes to be removed
 		"""
-		raise NotImplementedError
+		nodes = self.iter_nodes(properties, **kwargs).list()
+		self._remove_nodes(nodes)
+		return len(nodes)
+	
+	@_writes
+	def _remove_nodes(self, nodes):
+		self._remove_edges(self._node_edges(nodes))
+		ids = []
+		for node in nodes:
+			self._unindex_element('node', node)
+			del self._nodes[node.id]
+			ids.append(node.id)
+		self._adjacency_changed(*ids)
+		if self._listeners and ids:
+			self._notify('remove_nodes', ids)
 	
+	def _node_edges(self, nodes):
+		"""Returns the edges of nodes, each once even if it joins two of them"""
+		edges = {}
+		for node in nodes:
+			for lists in node._edges.values():
+				for direction_edges in lists:
+					for edge in direction_edges:
+						edges[edge.id] = edge
+		return list(edges.values())
+	
+	@_writes
 	def add_edge(self, start_node, label, end_node, properties=None, **kwargs):
 		"""
 		Connect two nodes with an edge
@@ -445,11 +1616,140 @@ class Graph(object):
 		"""
 		if properties is None:
 			properties = {}
-		edge = Edge(self._nextid, start_node, label, end_node, properties, **kwargs)
+		properties.update(kwargs)
+		self._check_indexes('edge', self._nextid, properties)
+		edge = Edge(self._nextid, start_node, label, end_node, properties)
+		self._index_element('edge', edge)
+		self._label_edge(edge)
+		edge._graph = self
 		self._edges[self._nextid] = edge
+		self._adjacency_changed(start_node.id, end_node.id)
 		self._nextid += 1
+		if self._listeners:
+			self._notify('add_edge', edge.id, start_node.id, edge.label,
+						end_node.id, properties)
 		return edge
 	
+	def _check_batch_indexes(self, element_type, first_id, properties_list):
+		"""
+		Raises GraphError if adding elements with properties_list, numbered
+		from first_id, would break a unique index
+		"""
+		for key, index in self._indexes[element_type].items():
+			if not index.unique:
+				continue
+			values = set()
+			for id, properties in enumerate(properties_list, first_id):
+				if key in properties:
+					value = properties[key]
+					index.check(id, value)
+					if value in values:
+						raise GraphError('Unique index on "{0}" already contains '
+										'{1!r}'.format(key, value))
+					values.add(value)
+	
+	@_writes
+	def bulk_add_nodes(self, nodes, batch_size=10000):
+		"""
+		Adds many nodes and returns a list of their ids, in the order of
+		nodes. Works through nodes one batch at a time, reserving the ids of
+		a whole batch at once and updating indexes after each batch, so nodes
+		can be a generator reading from a file. If a batch would break a
+		unique index none of it is added, but earlier batches stay added.
+		Python's cyclic garbage collector is paused meanwhile, since it would
+		otherwise rescan the growing graph over and over.
+		
+		Keyword arguments:
+		nodes -- an iterable of dicts containing the properties of each node,
+			or None for no properties
+		batch_size -- the number of nodes per batch. Default 10000
+		"""
+		with _gc_paused():
+			return self._bulk_add_nodes(nodes, batch_size)
+	
+	def _bulk_add_nodes(self, nodes, batch_size):
+		ids = []
+		for batch in _batches(nodes, batch_size):
+			batch = [{} if properties is None else properties
+					for properties in batch]
+			first_id = self._nextid
+			self._check_batch_indexes('node', first_id, batch)
+			self._nextid += len(batch)
+			new_nodes = []
+			for id, properties in enumerate(batch, first_id):
+				node = Node(id, properties)
+				_set_slot(node, '_graph', self)
+				self._nodes[id] = node
+				new_nodes.append(node)
+			for node in new_nodes:
+				self._index_element('node', node)
+			batch_ids = range(first_id, self._nextid)
+			self._adjacency_changed(*batch_ids)
+			ids.extend(batch_ids)
+			if self._listeners:
+				self._notify('add_nodes', first_id, batch)
+		return ids
+	
+	@_writes
+	def bulk_add_edges(self, edges, batch_size=10000):
+		"""
+		Adds many edges and returns a list of their ids, in the order of
+		edges. Works in batches, and pauses the garbage collector, like
+		bulk_add_nodes(). If a batch refers to a node that doesn't exist or
+		would break a unique index none of it is added, but earlier batches
+		stay added.
+		
+		Keyword arguments:
+		edges -- an iterable of (start_id, label, end_id) or (start_id, label,
+			end_id, properties) tuples, where start_id and end_id are node ids
+			and properties is a dict or None
+		batch_size -- the number of edges per batch. Default 10000
+		"""
+		with _gc_paused():
+			return self._bulk_add_edges(edges, batch_size)
+	
+	def _bulk_add_edges(self, edges, batch_size):
+		ids = []
+		nodes = self._nodes
+		for batch in _batches(edges, batch_size):
+			records = []
+			for record in batch:
+				start_id, label, end_id = record[:3]
+				if len(record) > 3 and record[3] is not None:
+					properties = record[3]
+				else:
+					properties = {}
+				if start_id not in nodes or end_id not in nodes:
+					raise GraphError('Cannot add edge {0!r} since a node id does '
+									'not exist'.format(record[:3]))
+				records.append((nodes[start_id], label, nodes[end_id], properties))
+			first_id = self._nextid
+			self._check_batch_indexes('edge', first_id,
+									[record[3] for record in records])
+			self._nextid += len(records)
+			new_edges = []
+			for id, (start_node, label, end_node, properties) in enumerate(
+					records, first_id):
+				edge = Edge(id, start_node, label, end_node, properties)
+				_set_slot(edge, '_graph', self)
+				self._edges[id] = edge
+				new_edges.append(edge)
+			for edge in new_edges:
+				self._index_element('edge', edge)
+				self._label_edge(edge)
+			if self._compacted is not None:
+				for edge in new_edges:
+					self._changed_ids.add(edge.start_node.id)
+					self._changed_ids.add(edge.end_node.id)
+			ids.extend(range(first_id, self._nextid))
+			if self._listeners:
+				self._notify('add_edges', first_id,
+							[(start_node.id, label, end_node.id, properties)
+							for start_node, label, end_node, properties
+							in records])
+		return ids
+	
+	@_writes
 	def remove_edge(self, id):
 		"""
 		Remove an edge from the graph by id. See also, node.remove_edge(), and
@@ -459,22 +1759,124 @@ class Graph(object):
 		id -- id of the edge to remove
 		"""
 		edge = self._edges[id]
-		label = edge.label
-		del edge.start_node._edges[label]
-		del edge.end_node._edges[label]
-		del self._edges[id]
+		self._remove_edges([edge])
+		if self._listeners:
+			self._notify('remove_edge', id)
+	
+	@_writes
+	def remove_edges(self, ids=None, properties=None, **kwargs):
+		"""
+		Removes every edge with one of ids that matches properties and kwargs,
+		which are a query like edges() takes, at once. Returns the number of
+		edges removed.
 		
-	def remove_edges(self, ids, properties, **kwargs):
+		Keyword arguments:
+		ids -- list of ids of edges to remove, or None for any edge. Ids of
+			edges that don't exist are skipped
+		properties -- a dict containing the properties of edges to be removed,
+			or a Predicate
+		kwargs -- a dict containing properties of edges to be removed
+		"""
+		query = _query(properties, kwargs)
+		if ids is None:
+			edges = self.iter_edges(None, query).list()
+		else:
+			edges = [self._edges[id] for id in dict.fromkeys(ids)
+					if id in self._edges]
+			if query is not None:
+				match = query.compile()
+				edges = [edge for edge in edges if match(edge.properties)]
+		self._remove_edges(edges)
+		if self._listeners and edges:
+			self._notify('remove_edges', [edge.id for edge in edges])
+		return len(edges)
+	
+	def _remove_edges(self, edges):
+		"""Removes edges, which must be distinct, without telling listeners"""
+		changed = set()
+		for edge in edges:
+			_unlink_edge(edge)
+			self._unindex_element('edge', edge)
+			self._unlabel_edge(edge)
+			del self._edges[edge.id]
+			changed.add(edge.start_node.id)
+			changed.add(edge.end_node.id)
+		self._adjacency_changed(*changed)
+	
+	@_reads
+	def match(self, pattern, where=None, limit=None):
 		"""
-		Remove all get_edges from the graph with any of the properties in
-		properties or kwargs
+		Returns a list of dicts mapping the names in pattern to the nodes and
+		edges of a match, one for every match, eg.
+			g.match('(u {type: "user"})-[:follows]->(r)-[:owns]->(c)')
+		See graphquery.match()
 		
 		Keyword arguments:
-		ids -- list of ids of edges to remove
-		properties -- a dict containing the properties of nodes to be removed
-		kwargs -- a dict containing properties of nodes to be removed
+		pattern -- the pattern, see graphquery
+		where -- a dict mapping names in pattern to further conditions on what
+			they bind, dicts of properties or Predicates. Default None
+		limit -- the most matches to return, or None for all. Default None
 		"""
-		raise NotImplementedError
+		# graphquery imports this module
+		import graphquery
+		return graphquery.match(self, pattern, where, limit)
+	
+	def reachable_from_many(self, starts, processes=None, max_depth=None,
+							limit=None, **kwargs):
+		"""
+		Returns a dict mapping the id of every start node to a list of the ids
+		of the nodes reachable from it, in the order
+		find_reachable_nodes_from() would find them. The starts are split
+		between a pool of processes searching the packed adjacency of
+		compact(), which is brought up to date first if needed. Where the
+		platform can fork, the processes share the packed arrays with this one
+		instead of being sent a copy.
+		
+		Keyword arguments:
+		starts -- an iterable of nodes or node ids to search from
+		processes -- the number of processes, or None for one per CPU. With 1
+			the search runs in this process. Default None
+		max_depth -- the deepest level of each search. Default None
+		limit -- the most nodes to find from each start. Default None
+		kwargs -- a dict whose keys are edge labels and whose values are a
+			direction 'incoming', 'outgoing', 'any', like
+			find_reachable_nodes_from(). If empty every outgoing edge is followed
+		"""
+		_check_directions(kwargs)
+		if self._compacted is None or self._changed_ids:
+			self.compact()
+		with self.reading():
+			# a CompactAdjacency is never changed, so it can be read after the
+			# lock is let go
+			adjacency = self._compacted
+			start_ids = [start.id if isinstance(start, Node) else start
+						for start in starts]
+		for id in start_ids:
+			if id not in adjacency.rows:
+				raise GraphError('Node {0!r} does not exist'.format(id))
+		rows = [adjacency.rows[id] for id in start_ids]
+		shared = (array('q', (node.id for node in adjacency.nodes)),
+				adjacency.csr_list(kwargs))
+		if processes is None:
+			processes = os.cpu_count() or 1
+		processes = min(processes, len(rows))
+		if processes <= 1:
+			results = _reachable(shared[0], shared[1], rows, max_depth, limit)
+		else:
+			# a few chunks per process keeps them all busy to the end
+			size = -(-len(rows) // (processes * 4))
+			chunks = [rows[i:i + size] for i in range(0, len(rows), size)]
+			methods = multiprocessing.get_all_start_methods()
+			context = multiprocessing.get_context(
+				'fork' if 'fork' in methods else None)
+			with concurrent.futures.ProcessPoolExecutor(
+					processes, context, _share_adjacency, shared) as pool:
+				results = []
+				for chunk in pool.map(_reachable_ids, chunks,
+									itertools.repeat(max_depth),
+									itertools.repeat(limit)):
+					results.extend(chunk)
+		return dict(zip(start_ids, results))
 	
 	def find_reachable_nodes_from(self, start_node, **kwargs):
 		"""
@@ -484,32 +1886,298 @@ class Graph(object):
 		
 		Keyword arguments:
 		start_node -- the node to start the search from
-		kwargs -- a dict whose only keys are edge labels and whose
+		kwargs -- a dict whose keys are edge labels and whose
 		values are a direction 'incoming', 'outgoing', 'any'
 			eg. {'knows': 'incoming', 'hates':'any'}
+			The keys max_depth, limit and predicate are passed on to
+			BreadthFirstTraverser instead
 		"""
 		return BreadthFirstTraverser(start_node, **kwargs)
 	
+	@_reads
+	def shortest_path(self, start_node, end_node, **kwargs):
+		"""
+		Returns a list of the nodes on a shortest path from start_node to
+		end_node, both included, or None if there is no path. Searches from
+		both ends at once so only a fraction of the nodes a
+		find_reachable_nodes_from search would see are touched.
+		
+		Keyword arguments:
+		start_node -- the node the path starts at
+		end_node -- the node the path ends at
+		kwargs -- a dict whose keys are edge labels and whose values are a
+			direction 'incoming', 'outgoing', 'any', like
+			find_reachable_nodes_from. If empty every outgoing edge is followed
+		"""
+		_check_directions(kwargs)
+		if start_node is end_node:
+			return [start_node]
+		reverse_kwargs = _reverse_directions(kwargs)
+		# parents[node] is the node before it on the path from its side
+		forward_parents = {start_node: None}
+		backward_parents = {end_node: None}
+		forward_frontier = [start_node]
+		backward_frontier = [end_node]
+		while forward_frontier and backward_frontier:
+			# expand whichever side has less work to do
+			if len(forward_frontier) <= len(backward_frontier):
+				forward_frontier, meeting_node = _expand_frontier(
+					forward_frontier, forward_parents, backward_parents,
+					kwargs, 'outgoing')
+			else:
+				backward_frontier, meeting_node = _expand_frontier(
+					backward_frontier, backward_parents, forward_parents,
+					reverse_kwargs, 'incoming')
+			if meeting_node is not None:
+				path = _walk_parents(meeting_node, forward_parents)
+				path.reverse()
+				path.extend(_walk_parents(meeting_node, backward_parents)[1:])
+				return path
+		return None
+	
+	@_reads
+	def weighted_shortest_path(self, start_node, end_node, weight='weight',
+							heuristic=None, **kwargs):
+		"""
+		Returns a tuple (cost, path) where path is a list of the nodes on a
+		cheapest path from start_node to end_node, both included, and cost is
+		the sum of the weights of its edges. Returns None if there is no path.
+		Uses Dijkstra's algorithm, or A* if heuristic is given.
+		
+		Keyword arguments:
+		start_node -- the node the path starts at
+		end_node -- the node the path ends at
+		weight -- the edge property holding the edge's weight. Edges without
+			it weigh 1. Weights must not be negative. Default 'weight'
+		heuristic -- a function taking a node and end_node and returning a
+			lower bound on the cost between them. Default None
+		kwargs -- a dict whose keys are edge labels and whose values are a
+			direction 'incoming', 'outgoing', 'any', like
+			find_reachable_nodes_from. If empty every outgoing edge is followed
+		"""
+		_check_directions(kwargs)
+		costs = {start_node: 0}
+		parents = {start_node: None}
+		done = set()
+		# the counter breaks ties so nodes themselves are never compared
+		counter = itertools.count()
+		estimate = heuristic(start_node, end_node) if heuristic else 0
+		heap = [(estimate, next(counter), start_node)]
+		while heap:
+			_, _, node = heapq.heappop(heap)
+			if node in done:
+				continue
+			if node is end_node:
+				path = _walk_parents(node, parents)
+				path.reverse()
+				return costs[node], path
+			done.add(node)
+			cost = costs[node]
+			for edges, direction in _edge_lists(node, kwargs):
+				for edge in edges:
+					if direction == 'outgoing':
+						adjacent_node = edge.end_node
+					else:
+						adjacent_node = edge.start_node
+					if adjacent_node in done:
+						continue
+					edge_weight = edge.properties.get(weight, 1)
+					if edge_weight < 0:
+						raise GraphError('Edge {0} has negative weight {1!r}'
+										.format(edge.id, edge_weight))
+					new_cost = cost + edge_weight
+					if adjacent_node not in costs or new_cost < costs[adjacent_node]:
+						costs[adjacent_node] = new_cost
+						parents[adjacent_node] = node
+						if heuristic:
+							estimate = new_cost + heuristic(adjacent_node, end_node)
+						else:
+							estimate = new_cost
+						heapq.heappush(heap,
+									(estimate, next(counter), adjacent_node))
+		return None
+
+
+DIRECTIONS = ('incoming', 'outgoing', 'any')
+
+@contextlib.contextmanager
+def _gc_paused():
+	"""Turns off the cyclic garbage collector until the block exits"""
+	enabled = gc.isenabled()
+	gc.disable()
+	try:
+		yield
+	finally:
+		if enabled:
+			gc.enable()
+
+def _batches(iterable, size):
+	"""Yields lists of up to size consecutive items of iterable"""
+	iterator = iter(iterable)
+	while True:
+		batch = list(itertools.islice(iterator, size))
+		if not batch:
+			return
+		yield batch
+
+def _check_directions(label_directions):
+	for label, direction in label_directions.items():
+		if direction not in DIRECTIONS:
+			raise GraphError('"{0}" is not valid direction for label "{1}"'
+							.format(direction, label))
+
+def _reverse_directions(label_directions):
+	"""Returns label_directions with 'incoming' and 'outgoing' swapped"""
+	reverse = {'incoming': 'outgoing', 'outgoing': 'incoming', 'any': 'any'}
+	return {label: reverse[direction]
+			for label, direction in label_directions.items()}
+
+def _edge_lists(node, label_directions, default_direction='outgoing'):
+	"""
+	Yields (edges, direction) for every adjacency list of node selected by
+	label_directions, without copying the lists. If label_directions is empty
+	the default_direction lists of every label are selected.
+	
+	Keyword arguments:
+	node -- the node whose adjacency lists are yielded
+	label_directions -- a dict mapping edge labels to 'incoming', 'outgoing'
+		or 'any'
+	default_direction -- the direction used when label_directions is empty
+	"""
+	node_edges = node._edges
+	if not label_directions:
+		index = OUTGOING if default_direction == 'outgoing' else INCOMING
+		for lists in node_edges.values():
+			yield lists[index], default_direction
+		return
+	for label, direction in label_directions.items():
+		lists = node_edges.get(label)
+		if lists is None:
+			continue
+		if direction == 'any':
+			yield lists[OUTGOING], 'outgoing'
+			yield lists[INCOMING], 'incoming'
+		elif direction == 'outgoing':
+			yield lists[OUTGOING], direction
+		else:
+			yield lists[INCOMING], direction
+
+
+def _expand_frontier(frontier, parents, other_parents, label_directions,
+					default_direction):
+	"""
+	Expands one level of a bidirectional search. Returns the next frontier
+	and the node where the two searches meet on a shortest path, or None.
+	"""
+	next_frontier = []
+	meeting_node = None
+	best_length = None
+	for node in frontier:
+		for edges, direction in _edge_lists(node, label_directions,
+											default_direction):
+			for edge in edges:
+				if direction == 'outgoing':
+					adjacent_node = edge.end_node
+				else:
+					adjacent_node = edge.start_node
+				if adjacent_node in parents:
+					continue
+				parents[adjacent_node] = node
+				next_frontier.append(adjacent_node)
+				if adjacent_node in other_parents:
+					# every node on this level is equally far from its side,
+					# so compare the distances left on the other side
+					length = len(_walk_parents(adjacent_node, other_parents))
+					if best_length is None or length < best_length:
+						best_length = length
+						meeting_node = adjacent_node
+	return next_frontier, meeting_node
+
+def _walk_parents(node, parents):
+	"""Returns [node, parents[node], ...] up to the node with no parent"""
+	path = []
+	while node is not None:
+		path.append(node)
+		node = parents[node]
+	return path
+
+
+# the node ids and CSRs Graph.reachable_from_many() searches, set in each
+# process of its pool by the pool's initializer. Only pool processes use
+# them, threads of one process would overwrite each other's
+_shared_ids = None
+_shared_csrs = None
+
+def _share_adjacency(ids, csrs):
+	global _shared_ids, _shared_csrs
+	_shared_ids = ids
+	_shared_csrs = csrs
+
+def _reachable_ids(rows, max_depth, limit):
+	"""Returns _reachable() through the CSRs shared with a pool process"""
+	return _reachable(_shared_ids, _shared_csrs, rows, max_depth, limit)
+
+def _reachable(ids, csrs, rows, max_depth, limit):
+	"""
+	Returns a list of the ids of the nodes reachable from each of rows,
+	searching breadth first through csrs like BreadthFirstTraverser
+	"""
+	results = []
+	for start in rows:
+		seen = bytearray(len(ids))
+		seen[start] = 1
+		found = []
+		frontier = [start]
+		depth = 0
+		while frontier and (max_depth is None or depth < max_depth):
+			depth += 1
+			next_frontier = []
+			for row in frontier:
+				for offsets, targets in csrs:
+					for target in targets[offsets[row]:offsets[row + 1]]:
+						if not seen[target]:
+							seen[target] = 1
+							next_frontier.append(target)
+			found.extend(next_frontier)
+			if limit is not None and len(found) >= limit:
+				del found[limit:]
+				break
+			frontier = next_frontier
+		results.append([ids[row] for row in found])
+	return results
+
+
 class BreadthFirstTraverser(object):
 	"""
 	An iterator that returns nodes that can be found from start_node through
-	the edge labels/directions specified by kwargs to the constructor
+	the edge labels/directions specified by kwargs to the constructor. The
+	start node itself is not returned.
 	
 	Instance variables:
 	self.current_node -- the node that will be returned on the next iteration.
 		If there is no next node its value will be None
 	self.depth -- the depth of the node that will be returned on the next
 		iteration. If there is no next node its value will be -1
+	self.max_depth -- nodes deeper than this are not returned. None means no
+		limit
+	self.limit -- the most nodes that will be returned. None means no limit
+	self.predicate -- nodes for which predicate(node) is false are neither
+		returned nor searched through. None means every node passes
 	"""
-	def __init__(self, start_node, **kwargs):
+	def __init__(self, start_node, max_depth=None, limit=None, predicate=None,
+				**kwargs):
 		"""
 		Initializes the instance variables for the iterator.
 		
 		Keyword arguments:
 		start_node -- the node obj to start the search from
-		kwargs -- dictionary containing 2 keys 'incoming' and 'outgoing'.
-			The dictionary values for both keys are iterables containing\
-			Relation objects 
+		max_depth -- the deepest level of the search. Default None
+		limit -- the most nodes to return. Default None
+		predicate -- a function taking a node and returning whether the search
+			may go through it. Default None
+		kwargs -- dictionary whose keys are edge labels and whose values are
+			the direction to follow edges with that label in. If empty, every
+			outgoing edge is followed
 			
 			eg.
 			kwargs[edge_label] = edge_direction
@@ -517,60 +2185,84 @@ class BreadthFirstTraverser(object):
 			kwargs['hates'] = 'incoming'
 			kwargs['creator'] = 'outgoing'
 		"""
-		self._next = deque(((start_node, 0),))
-		self._visited = set()
+		_check_directions(kwargs)
+		adjacency = _compact_adjacency(start_node)
+		if adjacency is None:
+			self._next = deque(((start_node, 0),))
+			# every node that has been returned or is waiting in self._next
+			self._seen = set((start_node,))
+			self._nodes = None
+		else:
+			# search by row through the packed arrays instead of by node
+			row = adjacency.rows[start_node.id]
+			self._next = deque(((row, 0),))
+			self._seen = bytearray(len(adjacency.nodes))
+			self._seen[row] = 1
+			self._nodes = adjacency.nodes
+			self._csrs = adjacency.csr_list(kwargs)
+			self._expand = self._expand_row
+		self._count = 0
 		self.kwargs = kwargs
+		self.max_depth = max_depth
+		self.limit = limit
+		self.predicate = predicate
 		# peek at the node, and its depth that will be returned next
-		self.current_node, self.depth = self._next[0]
+		self.current_node, self.depth = start_node, 0
 		
 	def __iter__(self):
 		return self
 	
-	def __next__(self):
-		if not self._next:
-			raise StopIteration
-		
-		current_node, current_depth = self._next.popleft()
-		self._visited.add(current_node)
-		
-		# needs refactoring, also not efficient
-		if self.kwargs:
-			for label, direction in self.kwargs.items():
-				edges = current_node.edges(label, direction)
-				for edge in edges:
-					node = None
-					if edge.start_node == current_node:
-						node = edge.end_node
-					else:
-						node = edge.start_node
-					next_nodes = [n for n, _ in self._next]
-					if node not in self._visited and node not in next_nodes:
-						self._next.append((node, current_depth + 1))
-		else:
-			edges = current_node.edges(direction='outgoing')
+	def _expand(self, node, depth):
+		"""Queues the unseen nodes adjacent to node at depth"""
+		seen = self._seen
+		queue = self._next
+		predicate = self.predicate
+		for edges, direction in _edge_lists(node, self.kwargs):
 			for edge in edges:
-				node = None
-				if edge.start_node == current_node:
-					node = edge.end_node
+				if direction == 'outgoing':
+					adjacent_node = edge.end_node
 				else:
-					node = edge.start_node
-				next_nodes = [n for n, _ in self._next]
-				if node not in self._visited and node not in next_nodes:
-					self._next.append((node, current_depth + 1))
-		if self._next:
-			self.current_node, self.depth = self._next[0]
-		else:
-			self.current_node = None
-			self.depth = -1
-		if len(self._visited) == 1:
-			return self.__next__()
-		else:
+					adjacent_node = edge.start_node
+				if adjacent_node not in seen:
+					seen.add(adjacent_node)
+					if predicate is None or predicate(adjacent_node):
+						queue.append((adjacent_node, depth))
+	
+	def _expand_row(self, row, depth):
+		"""Queues the unseen rows adjacent to row at depth"""
+		seen = self._seen
+		queue = self._next
+		predicate = self.predicate
+		nodes = self._nodes
+		for offsets, targets in self._csrs:
+			for target in targets[offsets[row]:offsets[row + 1]]:
+				if not seen[target]:
+					seen[target] = 1
+					if predicate is None or predicate(nodes[target]):
+						queue.append((target, depth))
+	
+	def __next__(self):
+		queue = self._next
+		if self.limit is not None and self._count >= self.limit:
+			queue.clear()
+		while queue:
+			current_node, current_depth = queue.popleft()
+			if self.max_depth is None or current_depth < self.max_depth:
+				self._expand(current_node, current_depth + 1)
+			if current_depth == 0:
+				# the start node is searched from but not returned
+				continue
+			self._count += 1
+			if queue and (self.limit is None or self._count < self.limit):
+				self.current_node, self.depth = queue[0]
+				if self._nodes is not None:
+					self.current_node = self._nodes[self.current_node]
+			else:
+				self.current_node = None
+				self.depth = -1
+			if self._nodes is not None:
+				return self._nodes[current_node]
 			return current_node
-			
-			
-			
-		
-		
-		
-		
-		
\ No newline at end of file
+		self.current_node = None
+		self.depth = -1
+		raise StopIteration
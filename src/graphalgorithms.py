@@ -0,0 +1,231 @@
+"""
+Whole graph algorithms vectorized with NumPy. A Graph is exported once into
+integer index arrays, an ArrayGraph, and every algorithm runs on those
+arrays instead of walking Nodes and Edges. Results are dicts keyed by node id.
+
+Every function takes either a Graph, which is exported first, or an
+ArrayGraph, so one export can be shared by several algorithms:
+	arrays = export(g)
+	ranks = pagerank(arrays)
+	components = connected_components(arrays)
+"""
+
+import numpy as np
+from graph import Graph, GraphError, OUTGOING
+
+
+class ArrayGraph(object):
+	"""
+	The nodes and edges of a graph as integer arrays. Nodes are numbered by
+	index in the order of Graph._nodes.
+	
+	Instance variables:
+	node_ids -- int64 array, node_ids[i] is the id of the node with index i
+	sources -- int64 array of the index of the start node of every edge
+	targets -- int64 array of the index of the end node of every edge
+	label_codes -- int64 array of the label of every edge, as an index into
+		label_names
+	label_names -- a list of the edge labels
+	"""
+	def __init__(self, node_ids, sources, targets, label_codes, label_names):
+		self.node_ids = node_ids
+		self.sources = sources
+		self.targets = targets
+		self.label_codes = label_codes
+		self.label_names = label_names
+	
+	def __len__(self):
+		return len(self.node_ids)
+	
+	def edges(self, labels=None):
+		"""
+		Returns (sources, targets) of the edges with any of labels, or of all
+		edges if labels is None
+		
+		Keyword arguments:
+		labels -- an iterable of edge labels. Default None
+		"""
+		if labels is None:
+			return self.sources, self.targets
+		labels = set(labels)
+		codes = [code for code, label in enumerate(self.label_names)
+				if label in labels]
+		mask = np.isin(self.label_codes, codes)
+		return self.sources[mask], self.targets[mask]
+	
+	def by_id(self, values):
+		"""Returns a dict mapping node ids to the per node values array"""
+		return dict(zip(self.node_ids.tolist(), values.tolist()))
+
+
+def export(graph, labels=None):
+	"""
+	Returns an ArrayGraph of graph, read from the packed adjacency of
+	Graph.compact(), which is brought up to date first if needed.
+	
+	Keyword arguments:
+	graph -- the Graph to export
+	labels -- an iterable of the edge labels to export, or None for all of
+		them. Default None
+	"""
+	if graph._compacted is None or graph._changed_ids:
+		graph.compact()
+	adjacency = graph._compacted
+	count = len(adjacency.nodes)
+	node_ids = np.fromiter((node.id for node in adjacency.nodes),
+						dtype=np.int64, count=count)
+	label_names = [label for label, direction in adjacency.csrs
+				if label is not None and direction == OUTGOING
+				and (labels is None or label in labels)]
+	rows = np.arange(count, dtype=np.int64)
+	sources = [np.empty(0, dtype=np.int64)]
+	targets = [np.empty(0, dtype=np.int64)]
+	label_codes = [np.empty(0, dtype=np.int64)]
+	for code, label in enumerate(label_names):
+		offsets, target_rows = adjacency.csrs[(label, OUTGOING)]
+		offsets = np.frombuffer(offsets, dtype=np.int64)
+		sources.append(np.repeat(rows, np.diff(offsets)))
+		targets.append(np.frombuffer(target_rows, dtype=np.int64).copy())
+		label_codes.append(np.full(len(target_rows), code, dtype=np.int64))
+	return ArrayGraph(node_ids, np.concatenate(sources),
+					np.concatenate(targets), np.concatenate(label_codes),
+					label_names)
+
+def _arrays(graph, labels):
+	"""Returns (ArrayGraph, sources, targets) for graph and labels"""
+	if isinstance(graph, Graph):
+		arrays = export(graph, labels)
+		return (arrays,) + arrays.edges()
+	return (graph,) + graph.edges(labels)
+
+
+def degrees(graph, label=None, direction='outgoing'):
+	"""
+	Returns a dict mapping node ids to their number of edges
+	
+	Keyword arguments:
+	graph -- a Graph or ArrayGraph
+	label -- only count edges with this label. Default None
+	direction -- 'outgoing', 'incoming' or 'any'. Default 'outgoing'
+	"""
+	arrays, sources, targets = _arrays(graph, None if label is None else [label])
+	count = len(arrays)
+	if direction == 'outgoing':
+		result = np.bincount(sources, minlength=count)
+	elif direction == 'incoming':
+		result = np.bincount(targets, minlength=count)
+	elif direction == 'any':
+		result = (np.bincount(sources, minlength=count)
+				+ np.bincount(targets, minlength=count))
+	else:
+		raise GraphError('"{0}" is not valid direction'.format(direction))
+	return arrays.by_id(result)
+
+def pagerank(graph, labels=None, damping=0.85, tolerance=1e-6,
+			max_iterations=100):
+	"""
+	Returns a dict mapping node ids to their PageRank over outgoing edges.
+	The rank of nodes without outgoing edges is spread over every node.
+	
+	Keyword arguments:
+	graph -- a Graph or ArrayGraph
+	labels -- an iterable of the edge labels to follow, or None for all of
+		them. Default None
+	damping -- the probability of following an edge rather than jumping to a
+		random node. Default 0.85
+	tolerance -- stop once the ranks change by less than this in total.
+		Default 1e-6
+	max_iterations -- the most iterations to run. Default 100
+	"""
+	arrays, sources, targets = _arrays(graph, labels)
+	count = len(arrays)
+	if count == 0:
+		return {}
+	out_degrees = np.bincount(sources, minlength=count).astype(np.float64)
+	dangling = out_degrees == 0
+	# dividing by 1 where there are no edges to divide between is harmless
+	share = 1.0 / np.where(dangling, 1.0, out_degrees)
+	ranks = np.full(count, 1.0 / count)
+	for _ in range(max_iterations):
+		received = np.bincount(targets, weights=(ranks * share)[sources],
+							minlength=count)
+		new_ranks = ((1.0 - damping) / count
+					+ damping * (received + ranks[dangling].sum() / count))
+		change = np.abs(new_ranks - ranks).sum()
+		ranks = new_ranks
+		if change < tolerance:
+			break
+	return arrays.by_id(ranks)
+
+def connected_components(graph, labels=None):
+	"""
+	Returns a dict mapping node ids to the id of the first node of their
+	weakly connected component, so nodes share a value exactly when they are
+	connected ignoring edge direction.
+	
+	Keyword arguments:
+	graph -- a Graph or ArrayGraph
+	labels -- an iterable of the edge labels to follow, or None for all of
+		them. Default None
+	"""
+	arrays, sources, targets = _arrays(graph, labels)
+	components = np.arange(len(arrays), dtype=np.int64)
+	while True:
+		previous = components.copy()
+		# hook every edge's larger component onto its smaller one
+		smaller = np.minimum(components[sources], components[targets])
+		np.minimum.at(components, sources, smaller)
+		np.minimum.at(components, targets, smaller)
+		# then shortcut chains of components until they point at their root
+		while True:
+			jumped = components[components]
+			if np.array_equal(jumped, components):
+				break
+			components = jumped
+		if np.array_equal(components, previous):
+			break
+	return arrays.by_id(arrays.node_ids[components])
+
+def triangle_counts(graph, labels=None):
+	"""
+	Returns a dict mapping node ids to the number of triangles they are in,
+	ignoring edge direction, self loops and repeated edges.
+	
+	Keyword arguments:
+	graph -- a Graph or ArrayGraph
+	labels -- an iterable of the edge labels to follow, or None for all of
+		them. Default None
+	"""
+	arrays, sources, targets = _arrays(graph, labels)
+	count = len(arrays)
+	low = np.minimum(sources, targets)
+	high = np.maximum(sources, targets)
+	keys = np.unique((low * count + high)[low != high])
+	low, high = keys // count, keys % count
+	# point every edge from the lower to the higher degree node so each
+	# node only pairs up its few higher degree neighbours
+	node_degrees = np.bincount(low, minlength=count) + np.bincount(high, minlength=count)
+	order = np.lexsort((np.arange(count), node_degrees))
+	rank = np.empty(count, dtype=np.int64)
+	rank[order] = np.arange(count)
+	swap = rank[low] > rank[high]
+	first = np.where(swap, high, low)
+	second = np.where(swap, low, high)
+	by_first = np.lexsort((second, first))
+	first, second = first[by_first], second[by_first]
+	offsets = np.concatenate(([0], np.cumsum(np.bincount(first, minlength=count))))
+	# wedge (first[p], second[p], second[q]) for every q after p in the
+	# neighbours of first[p]
+	partners = offsets[first + 1] - np.arange(len(first)) - 1
+	wedge_p = np.repeat(np.arange(len(first)), partners)
+	starts = np.repeat(np.cumsum(partners) - partners, partners)
+	wedge_q = wedge_p + 1 + (np.arange(len(wedge_p)) - starts)
+	a, b, c = first[wedge_p], second[wedge_p], second[wedge_q]
+	closing = np.minimum(b, c) * count + np.maximum(b, c)
+	position = np.searchsorted(keys, closing)
+	position[position == len(keys)] = 0
+	closed = keys[position] == closing if len(keys) else np.zeros(0, dtype=bool)
+	triangles = (np.bincount(a[closed], minlength=count)
+				+ np.bincount(b[closed], minlength=count)
+				+ np.bincount(c[closed], minlength=count))
+	return arrays.by_id(triangles)
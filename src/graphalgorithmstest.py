@@ -0,0 +1,55 @@
+from graph import Graph
+import graphalgorithms
+import unittest
+
+class TestGraphAlgorithms(unittest.TestCase):
+	def setUp(self):
+		# two triangles a-b-c and b-c-d sharing b-c, plus e-f on their own
+		self.g = g = Graph()
+		self.a, self.b, self.c, self.d, self.e, self.f = [g.add_node()
+														for _ in range(6)]
+		g.add_edge(self.a, 'knows', self.b)
+		g.add_edge(self.b, 'knows', self.c)
+		g.add_edge(self.c, 'knows', self.a)
+		g.add_edge(self.c, 'likes', self.d)
+		g.add_edge(self.d, 'likes', self.b)
+		g.add_edge(self.b, 'likes', self.c)
+		g.add_edge(self.e, 'knows', self.f)
+	
+	def test_export(self):
+		arrays = graphalgorithms.export(self.g)
+		self.assertEqual(arrays.node_ids.tolist(), [0, 1, 2, 3, 4, 5])
+		self.assertEqual(len(arrays.sources), 7)
+		sources, targets = arrays.edges(['likes'])
+		self.assertEqual(sorted(zip(sources.tolist(), targets.tolist())),
+						[(1, 2), (2, 3), (3, 1)])
+	
+	def test_degrees(self):
+		self.assertEqual(graphalgorithms.degrees(self.g, 'likes'),
+						{0: 0, 1: 1, 2: 1, 3: 1, 4: 0, 5: 0})
+		self.assertEqual(graphalgorithms.degrees(self.g, direction='any')[self.b.id],
+						4)
+		self.assertEqual(graphalgorithms.degrees(self.g, 'knows',
+												'incoming')[self.f.id], 1)
+	
+	def test_pagerank(self):
+		ranks = graphalgorithms.pagerank(self.g)
+		self.assertAlmostEqual(sum(ranks.values()), 1.0)
+		self.assertTrue(ranks[self.f.id] > ranks[self.e.id])
+		self.assertTrue(ranks[self.c.id] > ranks[self.a.id])
+		self.assertEqual(graphalgorithms.pagerank(Graph()), {})
+	
+	def test_connected_components(self):
+		components = graphalgorithms.connected_components(self.g)
+		self.assertEqual(components, {0: 0, 1: 0, 2: 0, 3: 0, 4: 4, 5: 4})
+		components = graphalgorithms.connected_components(self.g, ['likes'])
+		self.assertEqual(components, {0: 0, 1: 1, 2: 1, 3: 1, 4: 4, 5: 5})
+	
+	def test_triangle_counts(self):
+		triangles = graphalgorithms.triangle_counts(self.g)
+		self.assertEqual(triangles, {0: 1, 1: 2, 2: 2, 3: 1, 4: 0, 5: 0})
+		triangles = graphalgorithms.triangle_counts(self.g, ['knows'])
+		self.assertEqual(triangles[self.b.id], 1)
+
+if __name__ == '__main__':
+	unittest.main()
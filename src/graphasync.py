@@ -0,0 +1,358 @@
+"""
+An asyncio server for graph databases and a matching async client, for when
+there are more clients than the rpyc server's thread per connection can take.
+graphdatabaseserver.py is still there for clients that want the Graph itself.
+	python graphasync.py 12346
+	
+	connection = await connect('localhost', 12346)
+	db = await connection.database('users.gdb')
+	users = await db.nodes({'type': 'user'}, limit=10)
+
+Clients send whole operations from graphoperations, not single elements, so
+every request and response is plain data. Each is a frame: its length as a
+4 byte unsigned int followed by that many bytes of pickle. Requests are
+	(request id, method, location, args, kwargs)
+and responses are
+	(request id, True, result) or (request id, False, exception)
+
+A client can send any number of requests without waiting for the responses,
+which come back as each request finishes, not necessarily in order, matched up
+by request id. One connection can use several databases, each request naming
+its own.
+"""
+
+import asyncio
+import os
+import pickle
+import struct
+import sys
+import graphoperations
+from graph import GraphError
+from graphstorage import open_database, close_database
+
+
+_FRAME_HEADER = struct.Struct('<I')
+
+
+def _frame(message):
+	"""Returns message pickled and framed"""
+	payload = pickle.dumps(message, pickle.HIGHEST_PROTOCOL)
+	return _FRAME_HEADER.pack(len(payload)) + payload
+
+async def _read_frame(reader):
+	"""
+	Returns the next message read from reader. Raises
+	asyncio.IncompleteReadError once the other end is closed.
+	"""
+	header = await reader.readexactly(_FRAME_HEADER.size)
+	payload = await reader.readexactly(_FRAME_HEADER.unpack(header)[0])
+	return pickle.loads(payload)
+
+
+async def _storage(opened, location):
+	"""Returns the GraphStorage at location, once it's open"""
+	if location not in opened:
+		raise GraphError('{0} was not opened on this connection'.format(location))
+	return await opened[location]
+
+def _snapshot_metrics(storage):
+	task = storage.last_snapshot
+	return None if task is None else task.metrics()
+
+# the requests a client can make on a database it opened, each run with the
+# database's GraphStorage and the request's arguments
+METHODS = {
+	'execute': lambda storage, operation, *args, **kwargs:
+		graphoperations.execute(storage.graph, operation, *args, **kwargs),
+	'execute_all': lambda storage, requests:
+		graphoperations.execute_all(storage.graph, requests),
+	'apply_batch': lambda storage, operations:
+		graphoperations.apply_batch(storage.graph, operations),
+	'save': lambda storage: storage.save(),
+	'snapshot': lambda storage, wait=False: storage.snapshot(wait).metrics(),
+	'snapshot_metrics': _snapshot_metrics,
+}
+
+
+class GraphServer(object):
+	"""
+	Serves graph databases to any number of connections from one event loop.
+	Requests are run on the loop's default executor, so a slow query holds up
+	neither the loop nor the other requests, and the Graph's lock keeps them
+	from getting in each other's way.
+	
+	Instance variables:
+	pipeline -- the most requests of one connection run at once, the rest
+		wait to be read
+	"""
+	def __init__(self, pipeline=64):
+		self.pipeline = pipeline
+	
+	async def start(self, host='localhost', port=12346):
+		"""Starts listening and returns the asyncio.Server"""
+		return await asyncio.start_server(self._serve, host, port)
+	
+	async def _serve(self, reader, writer):
+		# the databases this connection opened, by absolute location, as
+		# futures of their GraphStorage so requests can wait for one opening
+		opened = {}
+		running = set()
+		slots = asyncio.Semaphore(self.pipeline)
+		try:
+			while True:
+				try:
+					request = await _read_frame(reader)
+				except (asyncio.IncompleteReadError, ConnectionError):
+					break
+				await slots.acquire()
+				task = asyncio.ensure_future(self._respond(opened, request,
+														writer))
+				running.add(task)
+				task.add_done_callback(running.discard)
+				task.add_done_callback(lambda task: slots.release())
+		finally:
+			if running:
+				await asyncio.wait(running)
+			for location in list(opened):
+				await self._close(opened, location)
+			writer.close()
+	
+	async def _respond(self, opened, request, writer):
+		id, method, location, args, kwargs = request
+		try:
+			result = await self._run(opened, method, location, args, kwargs)
+			response = _frame((id, True, result))
+		except Exception as e:
+			response = _frame((id, False, e))
+		if not writer.is_closing():
+			writer.write(response)
+			await writer.drain()
+	
+	async def _run(self, opened, method, location, args, kwargs):
+		loop = asyncio.get_running_loop()
+		# every name of a database is the same one, as in open_database()
+		location = os.path.abspath(location)
+		if method == 'open':
+			if location not in opened:
+				opened[location] = loop.run_in_executor(None, open_database,
+														location)
+			opening = opened[location]
+			try:
+				await opening
+			except Exception:
+				if opened.get(location) is opening:
+					del opened[location]
+				raise
+			return None
+		if method == 'close':
+			await self._close(opened, location)
+			return None
+		if method not in METHODS:
+			raise GraphError('"{0}" is not a method'.format(method))
+		storage = await _storage(opened, location)
+		return await loop.run_in_executor(
+			None, lambda: METHODS[method](storage, *args, **kwargs))
+	
+	async def _close(self, opened, location):
+		opening = opened.pop(location, None)
+		if opening is None:
+			return
+		try:
+			# a close sent before the open finished waits for it
+			await opening
+		except Exception:
+			# it never opened, so there is nothing to close
+			return
+		await asyncio.get_running_loop().run_in_executor(
+			None, close_database, location)
+
+
+class AsyncConnection(object):
+	"""
+	A connection to a GraphServer, shared by every AsyncGraphDatabase it
+	opens. Requests are sent as soon as they are made, so awaiting several
+	at once, eg. with asyncio.gather(), pipelines them.
+	"""
+	def __init__(self, reader, writer):
+		self._reader = reader
+		self._writer = writer
+		self._next_id = 0
+		self._pending = {}
+		self._receiver = asyncio.ensure_future(self._receive())
+	
+	async def _receive(self):
+		try:
+			while True:
+				id, ok, result = await _read_frame(self._reader)
+				future = self._pending.pop(id, None)
+				if future is None or future.done():
+					continue
+				if ok:
+					future.set_result(result)
+				else:
+					future.set_exception(result)
+		except (asyncio.IncompleteReadError, ConnectionError):
+			pass
+		finally:
+			for future in self._pending.values():
+				if not future.done():
+					future.set_exception(GraphError('Connection closed'))
+			self._pending.clear()
+	
+	async def request(self, method, location, *args, **kwargs):
+		"""
+		Sends a request and returns its result, raising the exception the
+		server raised if it failed
+		
+		Keyword arguments:
+		method -- 'open', 'close' or a key of METHODS
+		location -- the database file on the server
+		args, kwargs -- the arguments of the method
+		"""
+		if self._receiver.done():
+			raise GraphError('Connection closed')
+		id = self._next_id
+		self._next_id += 1
+		future = asyncio.get_running_loop().create_future()
+		self._pending[id] = future
+		self._writer.write(_frame((id, method, location, args, kwargs)))
+		await self._writer.drain()
+		return await future
+	
+	async def database(self, location):
+		"""Opens the database at location and returns an AsyncGraphDatabase"""
+		await self.request('open', location)
+		return AsyncGraphDatabase(self, location)
+	
+	async def close(self):
+		"""Closes the connection, and with it its databases on the server"""
+		self._writer.close()
+		await self._receiver
+	
+	async def __aenter__(self):
+		return self
+	
+	async def __aexit__(self, *exc_info):
+		await self.close()
+
+async def connect(host, port):
+	"""Returns an AsyncConnection to the GraphServer at host and port"""
+	reader, writer = await asyncio.open_connection(host, port)
+	return AsyncConnection(reader, writer)
+
+
+class AsyncGraphDatabase(object):
+	"""
+	A database on a GraphServer, like GraphDatabase without the Graph itself:
+	every method is a coroutine
+	
+	Instance variables:
+	connection -- the AsyncConnection requests are sent over
+	location -- the database file on the server
+	"""
+	def __init__(self, connection, location):
+		self.connection = connection
+		self.location = location
+	
+	async def _request(self, method, *args, **kwargs):
+		return await self.connection.request(method, self.location, *args,
+											**kwargs)
+	
+	async def execute(self, operation, *args, **kwargs):
+		"""Runs a graphoperations operation on the server and returns its result"""
+		return await self._request('execute', operation, *args, **kwargs)
+	
+	async def execute_all(self, requests):
+		"""
+		Runs several operations in one request and returns a list of their
+		results
+		
+		Keyword arguments:
+		requests -- a list of (operation, args, kwargs) tuples
+		"""
+		return await self._request('execute_all', list(requests))
+	
+	async def apply_batch(self, operations):
+		"""
+		Makes a list of changes, all of them or none, and returns the real ids
+		of the temporary ids, see graphoperations.apply_batch()
+		"""
+		return await self._request('apply_batch', list(operations))
+	
+	async def save(self):
+		"""Forces the changes logged so far to disk"""
+		await self._request('save')
+	
+	async def snapshot(self, wait=False):
+		"""Starts a snapshot of the database and returns its metrics"""
+		return await self._request('snapshot', wait)
+	
+	async def snapshot_metrics(self):
+		"""Returns the metrics of the latest snapshot, or None"""
+		return await self._request('snapshot_metrics')
+	
+	async def close(self):
+		"""Stops using the database, the connection stays open"""
+		await self._request('close')
+	
+	# wrappers for the operations in graphoperations, see there for what
+	# they take and return
+	async def node(self, id):
+		return await self.execute('get_node', id)
+	
+	async def edge(self, id):
+		return await self.execute('get_edge', id)
+	
+	async def nodes(self, query=None, limit=None):
+		return await self.execute('find_nodes', query, limit)
+	
+	async def edges(self, label=None, query=None, limit=None):
+		return await self.execute('find_edges', label, query, limit)
+	
+	async def count_nodes(self, query=None):
+		return await self.execute('count_nodes', query)
+	
+	async def count_edges(self, label=None, query=None):
+		return await self.execute('count_edges', label, query)
+	
+	async def node_edges(self, id, label=None, direction='any', query=None,
+						limit=None):
+		return await self.execute('node_edges', id, label, direction, query,
+								limit)
+	
+	async def adjacent_nodes(self, id, label=None, direction='outgoing',
+							query=None, limit=None):
+		return await self.execute('adjacent_nodes', id, label, direction,
+								query, limit)
+	
+	async def traverse(self, start_id, directions=None, max_depth=None,
+					limit=None, where=None):
+		return await self.execute('traverse', start_id, directions, max_depth,
+								limit, where)
+	
+	async def shortest_path(self, start_id, end_id, directions=None):
+		return await self.execute('shortest_path', start_id, end_id,
+								directions)
+	
+	async def weighted_shortest_path(self, start_id, end_id, weight='weight',
+									directions=None):
+		return await self.execute('weighted_shortest_path', start_id, end_id,
+								weight, directions)
+	
+	async def match(self, pattern, where=None, limit=None):
+		return await self.execute('match', pattern, where, limit)
+	
+	async def aggregate(self, aggregates=None, group_by=None,
+						element_type='node', label=None, query=None):
+		return await self.execute('aggregate', aggregates, group_by,
+								element_type, label, query)
+
+
+async def serve(host='localhost', port=12346, pipeline=64):
+	"""Runs a GraphServer until cancelled"""
+	server = await GraphServer(pipeline).start(host, port)
+	async with server:
+		await server.serve_forever()
+
+if __name__ == '__main__':
+	asyncio.run(serve(port=int(sys.argv[1]) if len(sys.argv) > 1 else 12346))
\ No newline at end of file
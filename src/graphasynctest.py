@@ -0,0 +1,79 @@
+from graph import GraphError
+from graphasync import GraphServer, connect
+from graphstorage import open_databases
+import asyncio
+import os
+import shutil
+import tempfile
+import unittest
+
+class TestGraphAsync(unittest.TestCase):
+	def setUp(self):
+		self.directory = tempfile.mkdtemp()
+		self.location = os.path.join(self.directory, 'test.gdb')
+	
+	def tearDown(self):
+		shutil.rmtree(self.directory)
+	
+	def run_with_server(self, test):
+		async def run():
+			server = await GraphServer().start('localhost', 0)
+			port = server.sockets[0].getsockname()[1]
+			try:
+				await test(port)
+			finally:
+				server.close()
+				await server.wait_closed()
+		asyncio.run(run())
+	
+	def test_requests(self):
+		async def test(port):
+			async with await connect('localhost', port) as connection:
+				db = await connection.database(self.location)
+				ids = await db.apply_batch([('add_node', 'a', {'name': 'a'}),
+											('add_node', 'b', {'name': 'b'}),
+											('add_edge', 'e', 'a', 'knows', 'b', None)])
+				# pipelined, the answers come back to the right requests
+				results = await asyncio.gather(*[db.node(ids[key]) for key in 'abab'])
+				self.assertEqual([node['properties']['name'] for node in results],
+								['a', 'b', 'a', 'b'])
+				self.assertEqual([node['id'] for node in await db.traverse(ids['a'])],
+								[ids['b']])
+				with self.assertRaises(GraphError):
+					await db.execute('no_such_operation')
+				
+				# a second database on the same connection, and the first one
+				# shared with a second connection
+				other = await connection.database(os.path.join(self.directory, 'other.gdb'))
+				self.assertEqual(await other.count_nodes(), 0)
+				async with await connect('localhost', port) as second:
+					shared = await second.database(self.location)
+					self.assertEqual(await shared.count_nodes(), 2)
+					self.assertEqual(open_databases()[os.path.abspath(self.location)], 2)
+				await other.close()
+				with self.assertRaises(GraphError):
+					await other.count_nodes()
+				await db.save()
+			# closing the connection closes its databases
+			await asyncio.sleep(0.1)
+			self.assertEqual(open_databases(), {})
+		self.run_with_server(test)
+	
+	def test_open_close(self):
+		async def test(port):
+			async with await connect('localhost', port) as connection:
+				# the close is sent before the open has finished
+				await asyncio.gather(connection.request('open', self.location),
+									connection.request('close', self.location))
+				self.assertEqual(open_databases(), {})
+				# two names of the same database are opened once
+				other = os.path.join(self.directory, '.', 'test.gdb')
+				db = await connection.database(self.location)
+				await connection.database(other)
+				self.assertEqual(open_databases()[os.path.abspath(self.location)], 1)
+				await db.close()
+				self.assertEqual(open_databases(), {})
+		self.run_with_server(test)
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,212 @@
+"""
+Benchmarks for the graph module. Run as a script with the name of a
+benchmark, eg.
+	python graphbenchmark.py memory 100000
+"""
+
+import os
+import pickle
+import random
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from graph import Graph
+import graphstorage
+
+
+def memory(n=100000):
+	"""
+	Prints the bytes allocated per node and per edge for a graph of n nodes
+	joined in a ring by n edges, each element having two properties
+	
+	Keyword arguments:
+	n -- the number of nodes and of edges to create
+	"""
+	tracemalloc.start()
+	g = Graph()
+	before = tracemalloc.get_traced_memory()[0]
+	nodes = [g.add_node(type='user', number=i) for i in range(n)]
+	after_nodes = tracemalloc.get_traced_memory()[0]
+	for i in range(n):
+		g.add_edge(nodes[i], 'knows', nodes[(i + 1) % n], since=i, weight=1)
+	after_edges = tracemalloc.get_traced_memory()[0]
+	tracemalloc.stop()
+	print('bytes per node: {0:.1f}'.format((after_nodes - before) / n))
+	print('bytes per edge: {0:.1f}'.format((after_edges - after_nodes) / n))
+
+def bulk(n=200000):
+	"""
+	Prints how long it takes to add n nodes and n edges one at a time, and
+	with Graph.bulk_add_nodes() and Graph.bulk_add_edges()
+	
+	Keyword arguments:
+	n -- the number of nodes and of edges to create
+	"""
+	g = Graph()
+	start = time.time()
+	nodes = [g.add_node(number=i) for i in range(n)]
+	for i in range(n):
+		g.add_edge(nodes[i], 'knows', nodes[(i + 1) % n], since=i)
+	print('one at a time: {0:.2f}s'.format(time.time() - start))
+	g = Graph()
+	start = time.time()
+	ids = g.bulk_add_nodes({'number': i} for i in range(n))
+	g.bulk_add_edges((ids[i], 'knows', ids[(i + 1) % n], {'since': i})
+					for i in range(n))
+	print('bulk: {0:.2f}s'.format(time.time() - start))
+
+def startup(n=200000):
+	"""
+	Prints how long it takes to open a graph of n nodes joined in a binary
+	tree from a pickle and from a snapshot file, and to then read every node.
+	Not a ring like the others, which pickle would recurse all the way round.
+	
+	Keyword arguments:
+	n -- the number of nodes and of edges to create
+	"""
+	g = Graph()
+	ids = g.bulk_add_nodes({'number': i} for i in range(n))
+	g.bulk_add_edges((ids[i], 'parent', ids[(i - 1) // 2], {'since': i})
+					for i in range(1, n))
+	directory = tempfile.mkdtemp()
+	try:
+		path = os.path.join(directory, 'graph')
+		with open(path + '.pickle', 'wb') as f:
+			pickle.dump(g, f, pickle.HIGHEST_PROTOCOL)
+		graphstorage.write_snapshot(g, path, 0)
+		del g
+		start = time.time()
+		with open(path + '.pickle', 'rb') as f:
+			pickle.load(f)
+		print('pickle.load: {0:.2f}s'.format(time.time() - start))
+		start = time.time()
+		sequence, g = graphstorage.read_snapshot(path)
+		print('read_snapshot: {0:.3f}s'.format(time.time() - start))
+		start = time.time()
+		for node in g.nodes():
+			node.adjacent_nodes()
+		print('then reading every node: {0:.2f}s'.format(time.time() - start))
+		del g, sequence
+	finally:
+		shutil.rmtree(directory, ignore_errors=True)
+
+def reachable(n=20000, starts=200):
+	"""
+	Prints how long finding the nodes reachable from many start nodes takes
+	one after the other, and with Graph.reachable_from_many() in this process
+	and in a pool of one process per CPU
+	
+	Keyword arguments:
+	n -- the number of nodes, each with two edges to random nodes
+	starts -- the number of start nodes
+	"""
+	g = Graph()
+	rng = random.Random(0)
+	ids = g.bulk_add_nodes(None for _ in range(n))
+	g.bulk_add_edges((id, 'next', rng.choice(ids)) for id in ids for _ in range(2))
+	g.compact()
+	nodes = [g.node(id) for id in ids[:starts]]
+	start = time.time()
+	for node in nodes:
+		list(g.find_reachable_nodes_from(node))
+	print('find_reachable_nodes_from: {0:.2f}s'.format(time.time() - start))
+	for processes in sorted(set((1, os.cpu_count() or 1))):
+		start = time.time()
+		g.reachable_from_many(nodes, processes)
+		print('reachable_from_many, {0} processes: {1:.2f}s'.format(
+			processes, time.time() - start))
+
+def _problems(g):
+	"""
+	Returns a list of the ways g is inconsistent: ids given twice or lost,
+	and edges missing from, or left in, their nodes' adjacency lists
+	"""
+	problems = []
+	ids = list(g._nodes) + list(g._edges)
+	if len(set(ids)) != len(ids) or set(ids) != set(range(g._nextid)):
+		problems.append('{0} ids for {1} elements, _nextid is {2}'.format(
+			len(set(ids)), len(ids), g._nextid))
+	listed = 0
+	for node in g._nodes.values():
+		for label, (outgoing, incoming) in node._edges.items():
+			for edges, direction in ((outgoing, 'outgoing'), (incoming, 'incoming')):
+				for edge in edges:
+					listed += 1
+					end = edge.start_node if direction == 'outgoing' else edge.end_node
+					if g._edges.get(edge.id) is not edge or end is not node:
+						problems.append('edge {0} is wrongly {1} of node {2}'
+										.format(edge.id, direction, node.id))
+	if listed != 2 * len(g._edges):
+		problems.append('{0} adjacency entries for {1} edges'.format(
+			listed, len(g._edges)))
+	if sum(g.edge_label_counts().values()) != len(g._edges):
+		problems.append('label counts are off')
+	return problems
+
+def concurrency(clients=8, operations=2000):
+	"""
+	Runs clients threads against one graph at once, each making operations
+	random changes and reads, then prints the operations per second and
+	checks that no id was lost or given twice and no adjacency list torn
+	
+	Keyword arguments:
+	clients -- the number of threads
+	operations -- the number of operations per thread
+	"""
+	g = Graph()
+	seed = [g.add_node(number=i) for i in range(100)]
+	errors = []
+	
+	def client(number):
+		rng = random.Random(number)
+		nodes = list(seed)
+		try:
+			for _ in range(operations):
+				choice = rng.random()
+				if choice < 0.3:
+					nodes.append(g.add_node(client=number))
+				elif choice < 0.6:
+					g.add_edge(rng.choice(nodes), 'knows', rng.choice(nodes))
+				elif choice < 0.7:
+					rng.choice(nodes).visits = rng.random()
+				elif choice < 0.85:
+					rng.choice(nodes).adjacent_nodes('knows', 'any')
+				else:
+					with g.reading():
+						list(g.find_reachable_nodes_from(rng.choice(nodes),
+														limit=50, knows='any'))
+		except Exception as e:
+			errors.append(e)
+	
+	threads = [threading.Thread(target=client, args=(number,))
+			for number in range(clients)]
+	start = time.time()
+	for thread in threads:
+		thread.start()
+	for thread in threads:
+		thread.join()
+	seconds = time.time() - start
+	print('{0} operations per second'.format(int(clients * operations / seconds)))
+	for problem in [repr(e) for e in errors] + _problems(g):
+		print('problem: ' + problem)
+	if not errors and not _problems(g):
+		print('graph is consistent')
+	return g
+
+
+BENCHMARKS = {
+	'memory': memory,
+	'bulk': bulk,
+	'startup': startup,
+	'concurrency': concurrency,
+	'reachable': reachable,
+}
+
+if __name__ == '__main__':
+	name = sys.argv[1] if len(sys.argv) > 1 else 'memory'
+	start = time.time()
+	BENCHMARKS[name](*[int(arg) for arg in sys.argv[2:]])
+	print('{0} took {1:.2f}s'.format(name, time.time() - start))
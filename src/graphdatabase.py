@@ -1,10 +1,225 @@
 import rpyc
+from collections import OrderedDict
+from contextlib import contextmanager
 import pickle
-from graph import Graph
+import socket
+import threading
+import time
+from graph import Graph, GraphError
+
+
+class Batch(object):
+	"""
+	Collects changes to a remote graph and sends them in one request, see
+	GraphDatabase.batch(). New elements get temporary ids, negative numbers,
+	which can be used in later changes in the same batch. Once the batch is
+	committed ids maps them to the real ids.
+		with gd.batch() as b:
+			jack = b.add_node(name='jack')
+			b.add_edge(jack, 'knows', 12)
+		jack = b.ids[jack]
+	
+	Instance variables:
+	operations -- the changes collected so far, see
+		graphoperations.apply_batch()
+	ids -- a dict mapping temporary ids to real ids, None until committed
+	"""
+	def __init__(self, database):
+		self._database = database
+		self._next_temporary_id = -1
+		self.operations = []
+		self.ids = None
+	
+	def _temporary_id(self):
+		id = self._next_temporary_id
+		self._next_temporary_id -= 1
+		return id
+	
+	def add_node(self, properties=None, **kwargs):
+		"""Adds a node like Graph.add_node() and returns its temporary id"""
+		properties = dict(properties or {}, **kwargs)
+		id = self._temporary_id()
+		self.operations.append(('add_node', id, properties))
+		return id
+	
+	def add_edge(self, start, label, end, properties=None, **kwargs):
+		"""
+		Adds an edge like Graph.add_edge() and returns its temporary id
+		
+		Keyword arguments:
+		start -- the id or temporary id of the node the edge starts from
+		label -- the label of the edge
+		end -- the id or temporary id of the node the edge ends at
+		properties -- a dict containing properties of the edge
+		kwargs -- a dict containing properties of the edge
+		"""
+		properties = dict(properties or {}, **kwargs)
+		id = self._temporary_id()
+		self.operations.append(('add_edge', id, start, label, end, properties))
+		return id
+	
+	def set_property(self, id, key, value):
+		"""Sets a property of the element with id or temporary id"""
+		self.operations.append(('set_property', id, key, value))
+	
+	def commit(self):
+		"""
+		Sends the changes to the server, which makes all of them or, raising
+		GraphError, none of them. Returns ids.
+		"""
+		if self.ids is not None:
+			raise GraphError('Batch was already committed')
+		self.ids = self._database.apply_batch(self.operations)
+		return self.ids
+	
+	def __enter__(self):
+		return self
+	
+	def __exit__(self, exc_type, exc_value, traceback):
+		if exc_type is None:
+			self.commit()
+
+
+# returned by ReadCache.get() for reads that aren't cached
+_MISSING = object()
+
+class ReadCache(object):
+	"""
+	A least recently used cache of the results of reads from a server, which
+	the server keeps up to date by telling it which elements changed, see
+	GraphDatabase. Each result is kept until size newer ones push it out,
+	ttl seconds pass, or an element it depends on changes. Results are
+	shared by everyone reading them, so must not be changed.
+	
+	Instance variables:
+	size -- the most results kept
+	ttl -- the seconds a result is kept, or None to keep it until it is
+		pushed out or goes stale
+	hits -- the number of reads answered from the cache
+	misses -- the number of reads that weren't
+	generation -- counts the invalidations so far
+	"""
+	def __init__(self, size=10000, ttl=60):
+		self.size = size
+		self.ttl = ttl
+		self.hits = 0
+		self.misses = 0
+		self.generation = 0
+		# syntax: key: (result, expiry time or None, ids it depends on)
+		self._entries = OrderedDict()
+		# syntax: id: set of the keys of results depending on it
+		self._dependents = {}
+		# the keys of adjacency lists
+		self._adjacency = set()
+		self._lock = threading.Lock()
+	
+	def __len__(self):
+		return len(self._entries)
+	
+	def get(self, key):
+		"""Returns the result cached for key, or _MISSING"""
+		with self._lock:
+			entry = self._entries.get(key)
+			if entry is not None and entry[1] is not None and entry[1] < time.time():
+				self._drop(key)
+				entry = None
+			if entry is None:
+				self.misses += 1
+				return _MISSING
+			self._entries.move_to_end(key)
+			self.hits += 1
+			return entry[0]
+	
+	def put(self, key, result, ids, generation, adjacency=False):
+		"""
+		Caches result for key, unless something was invalidated since
+		generation, when the read result came from began, as result may be
+		stale already
+		
+		Keyword arguments:
+		key -- the key of the read
+		result -- the result of the read
+		ids -- the ids of the elements result depends on
+		generation -- the cache's generation before the read was sent
+		adjacency -- whether result is an adjacency list. Default False
+		"""
+		with self._lock:
+			if generation != self.generation:
+				return
+			if key in self._entries:
+				self._drop(key)
+			expiry = None if self.ttl is None else time.time() + self.ttl
+			ids = frozenset(ids)
+			self._entries[key] = (result, expiry, ids)
+			for id in ids:
+				self._dependents.setdefault(id, set()).add(key)
+			if adjacency:
+				self._adjacency.add(key)
+			while len(self._entries) > self.size:
+				self._drop(next(iter(self._entries)))
+	
+	def invalidate(self, ids, adjacency=False):
+		"""
+		Drops the results depending on any of ids, and every adjacency list
+		if adjacency
+		"""
+		# ids can be a netref, and reading it under the lock would serve the
+		# next invalidation in this thread, which would wait for the lock
+		ids = list(ids)
+		with self._lock:
+			self.generation += 1
+			keys = set()
+			for id in ids:
+				keys.update(self._dependents.get(id, ()))
+			if adjacency:
+				keys.update(self._adjacency)
+			for key in keys:
+				self._drop(key)
+	
+	def clear(self):
+		"""Drops every result"""
+		with self._lock:
+			self.generation += 1
+			self._entries.clear()
+			self._dependents.clear()
+			self._adjacency.clear()
+	
+	def _drop(self, key):
+		_, _, ids = self._entries.pop(key)
+		for id in ids:
+			dependents = self._dependents[id]
+			dependents.discard(key)
+			if not dependents:
+				del self._dependents[id]
+		self._adjacency.discard(key)
+
+
 class GraphDatabase(object):
-	def __init__(self, host, port, db_file_location):
+	"""
+	A connection to a database served by graphdatabaseserver.py.
+	
+	Given a ReadCache, node(), edge(), and node_edges() and adjacent_nodes()
+	without a query or limit, are answered from it when they can be, and the
+	server tells the cache which elements change. Invalidations arrive
+	asynchronously, so a read straight after a change, even one made on this
+	connection, can briefly see the result from before it.
+	
+	Instance variables:
+	location -- the database file on the server
+	graph -- the server's Graph
+	cache -- the ReadCache, or None
+	"""
+	def __init__(self, host, port, db_file_location, cache=None):
+		self.host = host
+		self.port = port
 		self.location = db_file_location
-		self.conn = rpyc.connect(host, port,
+		self.cache = cache
+		self._serving = None
+		self.connect()
+	
+	def connect(self):
+		"""Opens the connection to the server, again if it was lost"""
+		self.conn = rpyc.connect(self.host, self.port,
 									config = {
 											'allow_exposed_attrs': False,
 											'allow_pickle': True,
@@ -12,16 +227,324 @@ class GraphDatabase(object):
 											'allow_all_attrs': True,
 											'allow_getattr': True,
 											'allow_setattr': True,})
-		self.graph = self.conn.root.graph(db_file_location)
+		self.graph = self.conn.root.graph(self.location)
+		if self.cache is not None:
+			# changes were missed while there was no connection
+			self.cache.clear()
+			self._serving = rpyc.BgServingThread(self.conn)
+			self.conn.root.subscribe(self.cache.invalidate)
 	
+	def is_alive(self):
+		"""Returns whether the server still answers on the connection"""
+		if self.conn.closed:
+			return False
+		try:
+			self.conn.ping(timeout=5)
+		except Exception:
+			return False
+		return True
 	
 	def save(self):
 		self.conn.root.save()
+	
+	def close(self):
+		"""
+		Stops using the database, which the server closes once no connection
+		is using it, and closes the connection
+		"""
+		if not self.conn.closed:
+			try:
+				self.conn.root.close(self.location)
+			except EOFError:
+				pass
+		if self._serving is not None:
+			self._serving.stop()
+			self._serving = None
+		self.conn.close()
+	
+	def __enter__(self):
+		return self
+	
+	def __exit__(self, *exc_info):
+		self.close()
+	
+	def execute(self, operation, *args, **kwargs):
+		"""
+		Runs a graphoperations operation on the server and returns its result,
+		in one round trip
+		
+		Keyword arguments:
+		operation -- the name of the operation, eg. 'find_nodes'
+		args, kwargs -- the arguments of the operation, after the graph
+		"""
+		request = pickle.dumps((operation, args, kwargs), pickle.HIGHEST_PROTOCOL)
+		return pickle.loads(self.conn.root.execute(request))
+	
+	def execute_all(self, requests):
+		"""
+		Runs several operations in one round trip and returns a list of their
+		results
+		
+		Keyword arguments:
+		requests -- a list of (operation, args, kwargs) tuples
+		"""
+		requests = pickle.dumps(list(requests), pickle.HIGHEST_PROTOCOL)
+		return pickle.loads(self.conn.root.execute_all(requests))
+	
+	def batch(self):
+		"""
+		Returns a Batch, whose changes are sent in one request when it's
+		committed or its with block ends
+		"""
+		return Batch(self)
+	
+	def apply_batch(self, operations):
+		"""
+		Makes a list of changes in one request, all of them or none, and
+		returns the real ids of the temporary ids, see
+		graphoperations.apply_batch()
+		"""
+		operations = pickle.dumps(list(operations), pickle.HIGHEST_PROTOCOL)
+		return pickle.loads(self.conn.root.apply_batch(operations))
+	
+	# wrappers for the operations in graphoperations, see there for what
+	# they take and return
+	def _cached(self, depends_on, operation, *args):
+		"""
+		Returns the result of an operation from the cache, reading and caching
+		it if it isn't there
+		
+		Keyword arguments:
+		depends_on -- a function returning the ids of the elements a result
+			depends on
+		operation, args -- the operation and its arguments
+		"""
+		if self.cache is None:
+			return self.execute(operation, *args)
+		key = (self.location, operation,
+			pickle.dumps(args, pickle.HIGHEST_PROTOCOL))
+		result = self.cache.get(key)
+		if result is _MISSING:
+			generation = self.cache.generation
+			result = self.execute(operation, *args)
+			self.cache.put(key, result, depends_on(result), generation,
+						operation in ('node_edges', 'adjacent_nodes'))
+		return result
+	
+	def node(self, id):
+		return self._cached(lambda node: [id], 'get_node', id)
+	
+	def edge(self, id):
+		return self._cached(lambda edge: [id] if edge is None else
+							[id, edge['start'], edge['end']], 'get_edge', id)
+	
+	def nodes(self, query=None, limit=None):
+		return self.execute('find_nodes', query, limit)
+	
+	def edges(self, label=None, query=None, limit=None):
+		return self.execute('find_edges', label, query, limit)
+	
+	def count_nodes(self, query=None):
+		return self.execute('count_nodes', query)
+	
+	def count_edges(self, label=None, query=None):
+		return self.execute('count_edges', label, query)
+	
+	def node_edges(self, id, label=None, direction='any', query=None,
+				limit=None):
+		if query is not None or limit is not None:
+			# a change to an edge that wasn't returned can make it match,
+			# which invalidates nothing the result depends on
+			return self.execute('node_edges', id, label, direction, query,
+								limit)
+		return self._cached(lambda edges: [id] + [edge[key] for edge in edges
+												for key in ('id', 'start', 'end')],
+							'node_edges', id, label, direction, query, limit)
+	
+	def adjacent_nodes(self, id, label=None, direction='outgoing', query=None,
+					limit=None):
+		if query is not None or limit is not None:
+			return self.execute('adjacent_nodes', id, label, direction, query,
+								limit)
+		return self._cached(lambda nodes: [id] + [node['id'] for node in nodes],
+							'adjacent_nodes', id, label, direction, query, limit)
+	
+	def traverse(self, start_id, directions=None, max_depth=None, limit=None,
+				where=None):
+		return self.execute('traverse', start_id, directions, max_depth, limit,
+							where)
+	
+	def shortest_path(self, start_id, end_id, directions=None):
+		return self.execute('shortest_path', start_id, end_id, directions)
+	
+	def weighted_shortest_path(self, start_id, end_id, weight='weight',
+							directions=None):
+		return self.execute('weighted_shortest_path', start_id, end_id, weight,
+							directions)
+	
+	def match(self, pattern, where=None, limit=None):
+		return self.execute('match', pattern, where, limit)
+	
+	def aggregate(self, aggregates=None, group_by=None, element_type='node',
+				label=None, query=None):
+		return self.execute('aggregate', aggregates, group_by, element_type,
+							label, query)
+
+
+class ConnectionPool(object):
+	"""
+	A thread safe pool of GraphDatabase connections to one database, so each
+	request handler borrows a connection that is already open instead of
+	opening its own:
+		pool = ConnectionPool('localhost', 12345, 'users.gdb')
+		with pool.connection() as gd:
+			gd.nodes({'type': 'user'})
+	Connections are opened as they are needed, up to size, and closed once
+	they have been idle for idle_timeout. One that has been idle for
+	check_after is pinged before it is lent, and reconnected if the server
+	doesn't answer. One that loses its connection while borrowed is closed
+	rather than put back.
+	
+	Instance variables:
+	size -- the most connections open at once
+	idle_timeout -- seconds after which an idle connection is closed, or None
+	check_after -- seconds a connection can be idle before it is checked
+	timeout -- seconds to wait for a free connection before raising
+		GraphError, or None to wait for ever
+	cache -- a ReadCache shared by the connections, or None
+	"""
+	def __init__(self, host, port, db_file_location, size=10, idle_timeout=300,
+				check_after=30, timeout=None, cache=None):
+		self.host = host
+		self.port = port
+		self.location = db_file_location
+		self.cache = cache
+		self.size = size
+		self.idle_timeout = idle_timeout
+		self.check_after = check_after
+		self.timeout = timeout
+		# (connection, time it was put back), the most recently used last
+		self._idle = []
+		self._open = 0
+		self._closed = False
+		self._condition = threading.Condition()
+	
+	def _evict(self, now):
+		"""Takes the connections idle for too long out of the pool and returns them"""
+		if self.idle_timeout is None:
+			return []
+		stale = [gd for gd, since in self._idle if now - since > self.idle_timeout]
+		if stale:
+			self._idle = [(gd, since) for gd, since in self._idle
+						if now - since <= self.idle_timeout]
+			self._open -= len(stale)
+		return stale
+	
+	def acquire(self):
+		"""
+		Returns a connection, which must be given back with release(). Waits
+		for one if size are already lent.
+		"""
+		deadline = None if self.timeout is None else time.time() + self.timeout
+		with self._condition:
+			while True:
+				if self._closed:
+					raise GraphError('Connection pool is closed')
+				now = time.time()
+				stale = self._evict(now)
+				if self._idle:
+					gd, since = self._idle.pop()
+					break
+				if self._open < self.size:
+					gd, since = None, now
+					self._open += 1
+					break
+				if deadline is not None and now >= deadline:
+					raise GraphError('No connection free after {0} '
+									'seconds'.format(self.timeout))
+				self._condition.wait(None if deadline is None else deadline - now)
+		for old in stale:
+			self._close(old)
+		try:
+			if gd is None:
+				gd = GraphDatabase(self.host, self.port, self.location,
+								self.cache)
+			elif gd.conn.closed or (time.time() - since > self.check_after
+									and not gd.is_alive()):
+				self._close(gd)
+				gd.connect()
+		except Exception:
+			self._discard()
+			raise
+		return gd
+	
+	def release(self, gd, broken=False):
+		"""
+		Gives back a connection from acquire()
+		
+		Keyword arguments:
+		gd -- the GraphDatabase
+		broken -- close the connection instead of keeping it. Default False
+		"""
+		with self._condition:
+			if not (broken or self._closed):
+				self._idle.append((gd, time.time()))
+				self._condition.notify()
+				return
+		self._close(gd)
+		self._discard()
+	
+	def _discard(self):
+		"""Frees the place of a connection that was closed"""
+		with self._condition:
+			self._open -= 1
+			self._condition.notify()
+	
+	def _close(self, gd):
+		try:
+			gd.close()
+		except Exception:
+			pass
+	
+	@contextmanager
+	def connection(self):
+		"""
+		Lends a connection for the with block and takes it back afterwards,
+		closing it if it was lost
+		"""
+		gd = self.acquire()
+		try:
+			yield gd
+		except (EOFError, socket.error):
+			self.release(gd, broken=True)
+			raise
+		except BaseException:
+			self.release(gd)
+			raise
+		self.release(gd)
+	
+	def close(self):
+		"""Closes the idle connections, and the lent ones once they are back"""
+		with self._condition:
+			self._closed = True
+			idle = [gd for gd, _ in self._idle]
+			self._idle = []
+			self._open -= len(idle)
+			self._condition.notify_all()
+		for gd in idle:
+			self._close(gd)
+	
+	def __enter__(self):
+		return self
+	
+	def __exit__(self, *exc_info):
+		self.close()
 
 loc = 'C:/Users/Shenra/git/LoLReplaySite/LoLReplaySite/lolreplaysite/databases/lolreplaysite.gd'
 def db():
 	return GraphDatabase('localhost', 12345, loc)
 
-gd = db()
-g = gd.graph
-print(g)
\ No newline at end of file
+if __name__ == '__main__':
+	gd = db()
+	g = gd.graph
+	print(g)
\ No newline at end of file
@@ -1,7 +1,8 @@
 import rpyc
 from rpyc.utils.server import ThreadedServer
 import os, pickle
-from graph import Graph
+from graphstorage import open_database, close_database, open_databases
+import graphoperations
 
 class GraphDatabaseError(Exception):
 	"""All purpose exception class for GraphDatabase errors"""
@@ -11,29 +12,157 @@ class GraphDatabaseError(Exception):
 	def __str__(self):
 		return repr(self.error_message)
 
+def _invalidations(graph, operation, args):
+	"""
+	Returns (ids, adjacency) for a change described by a Graph listener,
+	where ids are the elements whose cached reads it makes stale and
+	adjacency is whether it makes every cached adjacency list stale, or None
+	if it changes nothing a client caches
+	"""
+	if operation == 'set_property':
+		return [args[1]], False
+	if operation == 'relabel_edge':
+		edge = graph._edges[args[0]]
+		return [edge.id, edge.start_node.id, edge.end_node.id], False
+	if operation == 'add_edge':
+		return [args[1], args[3]], False
+	if operation == 'add_edges':
+		return list(set(id for start_id, _, end_id, _ in args[1]
+						for id in (start_id, end_id))), False
+	if operation == 'remove_node':
+		return [args[0]], False
+	if operation == 'remove_nodes':
+		return args[0], False
+	if operation in ('remove_edge', 'remove_edges'):
+		# the edges are gone by now, so which nodes they joined isn't known
+		return args[0] if operation == 'remove_edges' else [args[0]], True
+	return None
+
 class GraphService(rpyc.Service):
+	def on_connect(self, conn):
+		# the databases this connection opened, by location, and the one its
+		# requests go to
+		self._opened = {}
+		self._location = None
+		self._storage = None
+		self._graph = None
+		# the listeners sending invalidations to the client, by location
+		self._subscriptions = {}
+	
+	def on_disconnect(self, conn):
+		for location in list(self._opened):
+			self.exposed_close(location)
+	
 	def exposed_graph(self, db_file_location):
-		self.location = db_file_location
-		if os.path.isfile(self.location):
-			with open(self.location, 'rb') as f:
-				self.graph = pickle.load(f)
-			if not isinstance(self.graph, Graph):
-				raise GraphDatabaseError('File is not a Graph.')
-		else:
-			self.graph = Graph()
-		return self.graph
+		"""
+		Returns the graph of the database at db_file_location, opening it if
+		no connection has yet, and sends this connection's later requests to
+		it. A connection can open several databases and switch between them.
+		"""
+		location = os.path.abspath(db_file_location)
+		if location not in self._opened:
+			self._opened[location] = open_database(location)
+		self._location = location
+		self._storage = self._opened[location]
+		self._graph = self._storage.graph
+		return self._graph
 	
-	def exposed_save(self):
-		with open(self.location, 'wb') as f:
-			pickle.dump(self.graph, f)
+	def exposed_close(self, db_file_location):
+		"""Stops this connection using the database at db_file_location"""
+		location = os.path.abspath(db_file_location)
+		if location not in self._opened:
+			return
+		self._unsubscribe(location)
+		del self._opened[location]
+		if location == self._location:
+			self._storage = None
+			self._graph = None
+		close_database(location)
+	
+	def exposed_subscribe(self, callback):
+		"""
+		Calls callback(ids, adjacency) whenever the graph changes in a way
+		that makes reads a client cached stale, see _invalidations(). The
+		callback is called asynchronously, so changes don't wait for the
+		client, which has to be serving its connection to receive it.
+		"""
+		location = self._location
+		graph = self._graph
+		self._unsubscribe(location)
+		callback = rpyc.async_(callback)
 		
+		def listener(operation, *args):
+			invalidation = _invalidations(graph, operation, args)
+			if invalidation is None:
+				return
+			ids, adjacency = invalidation
+			try:
+				# a tuple is sent by value, where a list would be a netref the
+				# client has to read back from here
+				callback(tuple(ids), adjacency)
+			except Exception:
+				# a lost client mustn't stop the change being made
+				pass
 		
+		graph.add_listener(listener)
+		self._subscriptions[location] = listener
+	
+	def _unsubscribe(self, location):
+		listener = self._subscriptions.pop(location, None)
+		if listener is not None:
+			self._opened[location].graph.remove_listener(listener)
+	
+	def exposed_databases(self):
+		"""Returns a dict mapping open locations to their number of connections"""
+		return open_databases()
+	
+	def exposed_execute(self, request):
+		"""
+		Runs a pickled (operation, args, kwargs) from graphoperations against
+		the graph and returns the pickled result, so a whole query takes one
+		round trip instead of one per element and attribute
+		"""
+		operation, args, kwargs = pickle.loads(request)
+		result = graphoperations.execute(self._graph, operation, *args, **kwargs)
+		return pickle.dumps(result, pickle.HIGHEST_PROTOCOL)
+	
+	def exposed_execute_all(self, requests):
+		"""Like exposed_execute() for a pickled list of requests"""
+		results = graphoperations.execute_all(self._graph, pickle.loads(requests))
+		return pickle.dumps(results, pickle.HIGHEST_PROTOCOL)
+	
+	def exposed_apply_batch(self, operations):
+		"""
+		Makes a pickled list of changes from graphoperations.apply_batch(),
+		all of them or none, and returns the pickled dict of the ids given to
+		the temporary ids
+		"""
+		ids = graphoperations.apply_batch(self._graph, pickle.loads(operations))
+		return pickle.dumps(ids, pickle.HIGHEST_PROTOCOL)
+	
+	def exposed_save(self):
+		"""Forces the changes logged so far to disk"""
+		self._storage.save()
+	
+	def exposed_snapshot(self, wait=False):
+		"""
+		Starts rewriting the whole graph to disk in the background, so the log
+		can be emptied, and returns the metrics of the snapshot
+		"""
+		return self._storage.snapshot(wait).metrics()
+	
+	def exposed_snapshot_metrics(self):
+		"""Returns the metrics of the latest snapshot, or None"""
+		task = self._storage.last_snapshot
+		return None if task is None else task.metrics()
+
+
 if __name__ == '__main__':
 	server = ThreadedServer(
 						GraphService,
 						port=12345,
 						protocol_config={
-										'allow_exposed_attrs': False,
+										'allow_exposed_attrs': True,
 										'allow_public_attrs': True,
 										'allow_all_attrs': True,
 										'allow_getattr': True,
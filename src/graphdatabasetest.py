@@ -1,14 +1,20 @@
 import os
+import shutil
+import time
 import unittest
-from graphdatabase import GraphDatabase
+from graph import GraphError
+from graphdatabase import GraphDatabase, ConnectionPool, ReadCache
 
 class TestGraphDatabase(unittest.TestCase):
 	def setUp(self):
 		self.location = 'test.gd'
-		if os.path.isfile(self.location):
-			os.remove(self.location)
+		if os.path.isdir(self.location):
+			shutil.rmtree(self.location)
 		self.gd = GraphDatabase('localhost', 12345, self.location)
 	
+	def tearDown(self):
+		self.gd.close()
+	
 	def test_gd(self):
 		g = self.gd.graph
 		a = g.add_node()
@@ -38,4 +44,82 @@ class TestGraphDatabase(unittest.TestCase):
 		replay = g.add_node(type='replay')
 		comment = g.add_node(type='comment', name='Jon Salamander', comment="Son, don't fuck around.")
 		g.add_edge(replay, 'owns', comment)
-		
\ No newline at end of file
+	
+	def test_execute(self):
+		g = self.gd.graph
+		a = g.add_node(name='a')
+		b = g.add_node(name='b')
+		g.add_edge(a, 'contains', b)
+		self.assertEqual(self.gd.node(a.id), {'id': a.id, 'properties': {'name': 'a'}})
+		self.assertEqual([node['id'] for node in self.gd.traverse(a.id)], [b.id])
+		self.assertEqual(self.gd.execute_all([('count_nodes', (), {}),
+											('count_edges', ('contains',), {})]),
+						[2, 1])
+	
+	def test_batch(self):
+		with self.gd.batch() as b:
+			a = b.add_node(name='a')
+			c = b.add_node()
+			b.add_edge(a, 'contains', c, weight=2)
+			b.set_property(c, 'name', 'c')
+		a, c = b.ids[a], b.ids[c]
+		self.assertEqual(self.gd.node(c)['properties'], {'name': 'c'})
+		self.assertEqual([node['id'] for node in self.gd.adjacent_nodes(a)], [c])
+	
+	def test_shared(self):
+		with GraphDatabase('localhost', 12345, self.location) as other:
+			a = self.gd.graph.add_node(name='a')
+			self.assertEqual(other.node(a.id)['properties'], {'name': 'a'})
+			self.assertEqual(self.gd.conn.root.databases()[os.path.abspath(self.location)], 2)
+		self.assertEqual(self.gd.conn.root.databases()[os.path.abspath(self.location)], 1)
+		location = 'test2.gd'
+		if os.path.isdir(location):
+			shutil.rmtree(location)
+		with GraphDatabase('localhost', 12345, location) as other:
+			self.assertEqual(other.count_nodes(), 0)
+		self.assertNotIn(os.path.abspath(location), self.gd.conn.root.databases())
+	
+	def test_pool(self):
+		with ConnectionPool('localhost', 12345, self.location, size=2, timeout=0.1) as pool:
+			with pool.connection() as first:
+				with pool.connection() as second:
+					self.assertIsNot(first, second)
+					self.assertRaises(GraphError, pool.acquire)
+			# the connection given back last is lent first
+			with pool.connection() as gd:
+				self.assertIs(gd, first)
+				gd.conn.close()
+			# a lost connection is reconnected before it's lent again
+			with pool.connection() as gd:
+				self.assertIs(gd, first)
+				self.assertEqual(gd.count_nodes(), 0)
+	
+	def test_cache(self):
+		cache = ReadCache(size=100, ttl=None)
+		with GraphDatabase('localhost', 12345, self.location, cache) as gd:
+			g = self.gd.graph
+			a = g.add_node(name='a')
+			b = g.add_node(name='b')
+			g.add_edge(a, 'knows', b)
+			# the invalidations of the changes arrive asynchronously, and a read
+			# they overtake isn't cached
+			time.sleep(0.2)
+			self.assertEqual(gd.node(a.id)['properties'], {'name': 'a'})
+			self.assertEqual(len(gd.adjacent_nodes(a.id)), 1)
+			self.assertEqual(gd.node(a.id)['properties'], {'name': 'a'})
+			self.assertEqual(cache.hits, 1)
+			# changes made on another connection reach the cache
+			a.name = 'jack'
+			c = g.add_node()
+			g.add_edge(a, 'knows', c)
+			time.sleep(0.2)
+			self.assertEqual(gd.node(a.id)['properties'], {'name': 'jack'})
+			self.assertEqual(len(gd.adjacent_nodes(a.id)), 2)
+			b.name = 'jill'
+			time.sleep(0.2)
+			self.assertEqual(gd.adjacent_nodes(a.id)[0]['properties'], {'name': 'jill'})
+			# c starts matching, though it wasn't in the result read before
+			self.assertEqual(gd.adjacent_nodes(a.id, query={'name': 'c'}), [])
+			c.name = 'c'
+			time.sleep(0.2)
+			self.assertEqual(len(gd.adjacent_nodes(a.id, query={'name': 'c'})), 1)
\ No newline at end of file
@@ -0,0 +1,295 @@
+"""
+Streaming export of a whole Graph to a file that doesn't depend on the graph
+module's classes, and import back into a Graph, for moving databases between
+servers or keeping a portable copy. Elements are written and read in chunks,
+so neither side holds more than a chunk in memory, eg.
+	export_graph(g, 'users.jsonl.gz')
+	g = Graph()
+	import_graph(g, 'users.jsonl.gz')
+
+There are two formats, picked by extension or by the format argument:
+	json (.jsonl, .ndjson) -- a JSON object per line: a header
+		{"format": "graph", "version": 1, "nextid": ..., "indexes": [...]}
+		then {"node": id, "properties": {...}} for every node, then
+		{"edge": id, "start": id, "label": label, "end": id, "properties":
+		{...}} for every edge
+	binary (.bin) -- EXPORT_MAGIC, the format version and the length of the
+		JSON header as uint32s and the header, then a record per node and edge,
+		see _NODE_RECORD and _EDGE_RECORD, with labels and properties as JSON.
+		All numbers are little endian
+Either can be compressed by adding .gz, .bz2 or .xz to the name. Labels and
+property values must be JSON values.
+
+Each chunk is compressed on its own and synced, and progress is kept beside
+the file in path + '.progress', so an export that was interrupted can be
+resumed. Imports keep every element's id, and skip the elements the graph
+already has when resumed.
+"""
+
+import bz2
+import gzip
+import json
+import lzma
+import os
+import struct
+from graph import GraphError, _batches
+
+
+EXPORT_FORMATS = ('json', 'binary')
+EXPORT_VERSION = 1
+EXPORT_MAGIC = b'EDDBEXPT'
+_BINARY_HEADER = struct.Struct('<8sII')
+# a node record is the kind 0, its id and the length of its properties
+_NODE_RECORD = struct.Struct('<BqI')
+# an edge record is the kind 1, its id, its start and end node ids, and the
+# lengths of its label and properties
+_EDGE_RECORD = struct.Struct('<BqqqII')
+_KINDS = ('node', 'edge')
+
+# compressors by extension, each of which reads files of several
+# concatenated streams back as one
+_COMPRESSIONS = {'.gz': (gzip.compress, gzip.open),
+				'.bz2': (bz2.compress, bz2.open),
+				'.xz': (lzma.compress, lzma.open)}
+_EXTENSIONS = {'.jsonl': 'json', '.ndjson': 'json', '.bin': 'binary'}
+
+
+def _file_type(path, format):
+	"""Returns (format, compression extension or None) for path"""
+	root, compression = os.path.splitext(path)
+	if compression not in _COMPRESSIONS:
+		root, compression = path, None
+	if format is None:
+		format = _EXTENSIONS.get(os.path.splitext(root)[1])
+		if format is None:
+			raise GraphError('Cannot tell the format of "{0}" from its '
+							'extension'.format(path))
+	if format not in EXPORT_FORMATS:
+		raise GraphError('"{0}" is not an export format'.format(format))
+	return format, compression
+
+def _json(value):
+	return json.dumps(value, ensure_ascii=False, separators=(',', ':'))
+
+def _header(graph):
+	return {'format': 'graph', 'version': EXPORT_VERSION,
+			'nextid': graph._nextid,
+			'indexes': [[element_type, key, index.unique]
+						for element_type in _KINDS
+						for key, index in graph._indexes[element_type].items()]}
+
+def _encode_header(header, format):
+	if format == 'json':
+		return (_json(header) + '\n').encode('utf-8')
+	data = _json(header).encode('utf-8')
+	return _BINARY_HEADER.pack(EXPORT_MAGIC, EXPORT_VERSION, len(data)) + data
+
+def _encode(kind, elements, format):
+	"""Returns the bytes of the records of a chunk of nodes or edges"""
+	if format == 'json':
+		if kind == 'node':
+			lines = [_json({'node': node.id, 'properties': node.properties})
+					for node in elements]
+		else:
+			lines = [_json({'edge': edge.id, 'start': edge.start_node.id,
+							'label': edge.label, 'end': edge.end_node.id,
+							'properties': edge.properties})
+					for edge in elements]
+		return ('\n'.join(lines) + '\n').encode('utf-8')
+	parts = []
+	for element in elements:
+		properties = b''
+		if element.properties:
+			properties = _json(element.properties).encode('utf-8')
+		if kind == 'node':
+			parts.append(_NODE_RECORD.pack(0, element.id, len(properties)))
+		else:
+			label = _json(element.label).encode('utf-8')
+			parts.append(_EDGE_RECORD.pack(1, element.id, element.start_node.id,
+										element.end_node.id, len(label),
+										len(properties)))
+			parts.append(label)
+		parts.append(properties)
+	return b''.join(parts)
+
+def _write_progress(path, progress):
+	temporary = path + '.tmp'
+	with open(temporary, 'w') as f:
+		json.dump(progress, f)
+		f.flush()
+		os.fsync(f.fileno())
+	os.replace(temporary, path)
+
+
+def export_graph(graph, path, format=None, chunk_size=10000, resume=False):
+	"""
+	Writes every node, then every edge, of graph to path, and returns
+	(nodes, edges), the number of each written. Holds the graph's read lock
+	throughout, so the file is of one state of the graph.
+	
+	Keyword arguments:
+	graph -- the Graph to export
+	path -- the file name, whose extension picks the format and compression
+	format -- 'json', 'binary' or None to go by the extension. Default None
+	chunk_size -- the number of elements per chunk. Default 10000
+	resume -- if True and an export to path was interrupted after finishing
+		a chunk, carry on after that chunk instead of starting again.
+		Default False
+	"""
+	format, compression = _file_type(path, format)
+	compress = (lambda data: data) if compression is None else (
+		_COMPRESSIONS[compression][0])
+	progress_path = path + '.progress'
+	with graph.reading():
+		if resume and os.path.exists(progress_path):
+			with open(progress_path) as f:
+				progress = json.load(f)
+			f = open(path, 'r+b')
+			f.truncate(progress['offset'])
+			f.seek(progress['offset'])
+		else:
+			f = open(path, 'wb')
+			f.write(compress(_encode_header(_header(graph), format)))
+			progress = {'offset': f.tell(), 'kind': 'node', 'last': None}
+		written = {'node': 0, 'edge': 0}
+		with f:
+			for kind in _KINDS[_KINDS.index(progress['kind']):]:
+				elements = graph._elements(kind).values()
+				last = progress['last'] if kind == progress['kind'] else None
+				if last is not None:
+					# elements are kept in the order of their ascending ids
+					elements = (element for element in elements
+								if element.id > last)
+				for chunk in _batches(elements, chunk_size):
+					f.write(compress(_encode(kind, chunk, format)))
+					f.flush()
+					os.fsync(f.fileno())
+					written[kind] += len(chunk)
+					progress = {'offset': f.tell(), 'kind': kind,
+								'last': chunk[-1].id}
+					_write_progress(progress_path, progress)
+		if os.path.exists(progress_path):
+			os.remove(progress_path)
+	return written['node'], written['edge']
+
+
+def _read_exactly(f, size, path):
+	data = f.read(size)
+	if len(data) != size:
+		raise GraphError('{0} ends part way through a record'.format(path))
+	return data
+
+def read_export(path, format=None):
+	"""
+	Yields the header dict of an exported file, then a dict for every node
+	and edge in it, like the lines of the json format
+	
+	Keyword arguments:
+	path -- the file name
+	format -- 'json', 'binary' or None to go by the extension. Default None
+	"""
+	format, compression = _file_type(path, format)
+	opener = open if compression is None else _COMPRESSIONS[compression][1]
+	with opener(path, 'rb') as f:
+		if format == 'json':
+			for number, line in enumerate(f, 1):
+				try:
+					record = json.loads(line)
+				except ValueError as e:
+					raise GraphError('Line {0} of {1} is not valid JSON: '
+									'{2}'.format(number, path, e))
+				if number == 1 and record.get('format') != 'graph':
+					raise GraphError('{0} is not a graph export'.format(path))
+				yield record
+			return
+		magic, version, length = _BINARY_HEADER.unpack(
+			_read_exactly(f, _BINARY_HEADER.size, path))
+		if magic != EXPORT_MAGIC:
+			raise GraphError('{0} is not a graph export'.format(path))
+		if version != EXPORT_VERSION:
+			raise GraphError('{0} is version {1} of the format, not {2}'.format(
+				path, version, EXPORT_VERSION))
+		yield json.loads(_read_exactly(f, length, path))
+		while True:
+			kind = f.read(1)
+			if not kind:
+				return
+			if kind == b'\x00':
+				_, id, length = _NODE_RECORD.unpack(
+					kind + _read_exactly(f, _NODE_RECORD.size - 1, path))
+				record = {'node': id}
+			else:
+				_, id, start, end, label_length, length = _EDGE_RECORD.unpack(
+					kind + _read_exactly(f, _EDGE_RECORD.size - 1, path))
+				label = json.loads(_read_exactly(f, label_length, path))
+				record = {'edge': id, 'start': start, 'label': label, 'end': end}
+			record['properties'] = (json.loads(_read_exactly(f, length, path))
+									if length else {})
+			yield record
+
+
+def import_graph(graph, path, format=None, batch_size=10000, resume=False):
+	"""
+	Adds the nodes and edges of an exported file to graph, with the ids they
+	had, and creates the indexes it lists. Returns (nodes, edges), the number
+	of each added.
+	
+	Keyword arguments:
+	graph -- the Graph to add to, whose ids mustn't overlap those in the file
+	path -- the file name
+	format -- 'json', 'binary' or None to go by the extension. Default None
+	batch_size -- the most elements added at once, see Graph.bulk_add_nodes().
+		Default 10000
+	resume -- if True skip the elements graph already has, eg. after an
+		import that was interrupted, instead of raising GraphError. Default
+		False
+	"""
+	records = read_export(path, format)
+	header = next(records)
+	for element_type, key, unique in header['indexes']:
+		if key not in graph._indexes[element_type]:
+			graph.create_index(element_type, key, unique)
+	added = {'node': 0, 'edge': 0}
+	# a run of elements with consecutive ids, added at once
+	run = []
+	run_kind = None
+	
+	def add_run():
+		with graph.writing():
+			for id, _ in run:
+				if id in graph._nodes or id in graph._edges:
+					raise GraphError('Id {0} is already taken'.format(id))
+			# nodes and edges share ids, so the edges' go back below the
+			# nodes' and the next id is put back afterwards
+			nextid = graph._nextid
+			graph._nextid = run[0][0]
+			items = [item for _, item in run]
+			try:
+				if run_kind == 'node':
+					graph.bulk_add_nodes(items, len(items))
+				else:
+					graph.bulk_add_edges(items, len(items))
+			finally:
+				graph._nextid = max(nextid, graph._nextid)
+		added[run_kind] += len(run)
+		del run[:]
+	
+	for record in records:
+		kind = 'node' if 'node' in record else 'edge'
+		id = record[kind]
+		if resume and id in graph._elements(kind):
+			continue
+		if run and (kind != run_kind or id != run[-1][0] + 1
+					or len(run) >= batch_size):
+			add_run()
+		run_kind = kind
+		if kind == 'node':
+			run.append((id, record['properties']))
+		else:
+			run.append((id, (record['start'], record['label'], record['end'],
+							record['properties'])))
+	if run:
+		add_run()
+	with graph.writing():
+		graph._nextid = max(graph._nextid, header['nextid'])
+	return added['node'], added['edge']
\ No newline at end of file
@@ -0,0 +1,130 @@
+from graph import Graph, GraphError
+from graphexport import export_graph, import_graph, read_export
+from graphstorage import GraphStorage
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+class TestGraphExport(unittest.TestCase):
+	def setUp(self):
+		self.directory = tempfile.mkdtemp()
+	
+	def tearDown(self):
+		shutil.rmtree(self.directory)
+	
+	def path(self, name):
+		return os.path.join(self.directory, name)
+	
+	def fill(self, g):
+		g.create_index('node', 'name', unique=True)
+		jack = g.add_node(name='jack', age=30)
+		jill = g.add_node(name='jill', tags=['a', 'b'])
+		hill = g.add_node(name='hill')
+		g.add_edge(jack, 'climbs', hill, times=1)
+		g.add_edge(jack, 'knows', jill)
+		g.bulk_add_nodes([{'name': 'pail'}, {'name': 'water'}])
+		g.bulk_add_edges([(jill.id, 'fetches', 5, {'full': True})])
+		g.remove_node(hill.id)
+		g.add_node(name='crown')
+		g.remove_node(g.add_node().id)
+	
+	def assertSameGraph(self, a, b):
+		self.assertEqual(a._nextid, b._nextid)
+		self.assertEqual({id: node.properties for id, node in a._nodes.items()},
+						{id: node.properties for id, node in b._nodes.items()})
+		self.assertEqual({id: (edge.start_node.id, edge.label, edge.end_node.id,
+							edge.properties) for id, edge in a._edges.items()},
+						{id: (edge.start_node.id, edge.label, edge.end_node.id,
+							edge.properties) for id, edge in b._edges.items()})
+		self.assertEqual(sorted(a._indexes['node']), sorted(b._indexes['node']))
+	
+	def test_round_trip(self):
+		g = Graph()
+		self.fill(g)
+		for name in ('g.jsonl', 'g.ndjson.gz', 'g.bin', 'g.bin.xz', 'g.jsonl.bz2'):
+			self.assertEqual(export_graph(g, self.path(name), chunk_size=2),
+							(5, 2))
+			self.assertFalse(os.path.exists(self.path(name + '.progress')))
+			copy = Graph()
+			self.assertEqual(import_graph(copy, self.path(name), batch_size=2),
+							(5, 2))
+			self.assertSameGraph(copy, g)
+			self.assertTrue(copy._indexes['node']['name'].unique)
+			self.assertEqual(copy.node(name='water').id, 6)
+		
+		with open(self.path('g.jsonl')) as f:
+			lines = [json.loads(line) for line in f]
+		self.assertEqual(lines[0]['indexes'], [['node', 'name', True]])
+		self.assertEqual(lines[1], {'node': 0,
+									'properties': {'name': 'jack', 'age': 30}})
+		self.assertEqual(lines[-1], {'edge': 7, 'start': 1, 'label': 'fetches',
+									'end': 5, 'properties': {'full': True}})
+		self.assertEqual(list(read_export(self.path('g.bin')))[1:], lines[1:])
+	
+	def test_errors(self):
+		g = Graph()
+		self.fill(g)
+		self.assertRaises(GraphError, export_graph, g, self.path('g.txt'))
+		self.assertRaises(GraphError, export_graph, g, self.path('g'), 'xml')
+		export_graph(g, self.path('g.bin'))
+		with open(self.path('g.bin'), 'r+b') as f:
+			f.truncate(os.path.getsize(self.path('g.bin')) - 3)
+		self.assertRaises(GraphError, import_graph, Graph(), self.path('g.bin'))
+		# the ids are taken
+		export_graph(g, self.path('g.jsonl'))
+		self.assertRaises(GraphError, import_graph, g, self.path('g.jsonl'))
+	
+	def test_resume(self):
+		g = Graph()
+		self.fill(g)
+		path = self.path('g.jsonl.gz')
+		export_graph(g, path, chunk_size=2)
+		expected = list(read_export(path))
+		# a set isn't a JSON value, so the export stops at the second chunk
+		# of nodes, after finishing the first
+		g.node(5).properties['broken'] = set()
+		self.assertRaises(TypeError, export_graph, g, path, chunk_size=2)
+		with open(path + '.progress') as f:
+			self.assertEqual(json.load(f)['last'], 1)
+		with open(path, 'ab') as f:
+			f.write(b'part of a chunk')
+		del g.node(5).properties['broken']
+		self.assertEqual(export_graph(g, path, chunk_size=2, resume=True),
+						(3, 2))
+		self.assertFalse(os.path.exists(path + '.progress'))
+		self.assertEqual(list(read_export(path)), expected)
+		# with nothing to resume it starts again
+		self.assertEqual(export_graph(g, path, resume=True), (5, 2))
+		self.assertEqual(list(read_export(path)), expected)
+	
+	def test_import_resume(self):
+		g = Graph()
+		self.fill(g)
+		path = self.path('g.bin')
+		export_graph(g, path)
+		copy = Graph()
+		copy.bulk_add_nodes([{'name': 'jack', 'age': 30},
+							{'name': 'jill', 'tags': ['a', 'b']}])
+		self.assertRaises(GraphError, import_graph, copy, path)
+		self.assertEqual(import_graph(copy, path, resume=True), (3, 2))
+		self.assertSameGraph(copy, g)
+	
+	def test_import_storage(self):
+		g = Graph()
+		self.fill(g)
+		path = self.path('g.jsonl')
+		export_graph(g, path)
+		location = self.path('g.gdb')
+		with GraphStorage(location) as storage:
+			# the nodes' ids are below those the edges' are
+			import_graph(storage.graph, path)
+		with GraphStorage(location) as storage:
+			self.assertEqual(storage.graph._nextid, 9)
+			queen = storage.graph.add_node(name='queen')
+			self.assertEqual(queen.id, 9)
+			self.assertEqual(storage.graph.node(name='crown').id, 8)
+
+if __name__ == '__main__':
+	unittest.main()
\ No newline at end of file
@@ -0,0 +1,139 @@
+"""
+Streaming import of nodes and edges from CSV and JSON lines files into a
+Graph, through Graph.bulk_add_nodes() and Graph.bulk_add_edges(). Records are
+read one at a time so files bigger than memory can be loaded, eg.
+	g = Graph()
+	ids = load_nodes(g, read_records('users.csv'))
+	load_edges(g, read_records('follows.jsonl'), ids)
+
+Files name nodes by their own keys, which needn't be the ids the graph gives
+them. load_nodes() returns a dict from those keys to graph ids, and
+load_edges() uses it to find the endpoints of each edge.
+"""
+
+import csv
+import json
+from graph import GraphError
+
+
+def read_csv(path, types=None, **kwargs):
+	"""
+	Yields a dict for every row of a CSV file with a header row. Values are
+	strings unless converted by types, and empty values are left out.
+	
+	Keyword arguments:
+	path -- the file name
+	types -- a dict mapping column names to a function converting their
+		values, eg. {'age': int}. Default None
+	kwargs -- passed on to csv.DictReader, eg. delimiter='\t'
+	"""
+	types = types or {}
+	with open(path, newline='', encoding='utf-8') as f:
+		for row in csv.DictReader(f, **kwargs):
+			record = {}
+			for key, value in row.items():
+				if value is None or value == '':
+					continue
+				if key in types:
+					value = types[key](value)
+				record[key] = value
+			yield record
+
+def read_json_lines(path):
+	"""
+	Yields the object on every line of a JSON lines file, skipping blank lines
+	
+	Keyword arguments:
+	path -- the file name
+	"""
+	with open(path, encoding='utf-8') as f:
+		for number, line in enumerate(f, 1):
+			if not line.strip():
+				continue
+			try:
+				record = json.loads(line)
+			except ValueError as e:
+				raise GraphError('Line {0} of {1} is not valid JSON: '
+								'{2}'.format(number, path, e))
+			if not isinstance(record, dict):
+				raise GraphError('Line {0} of {1} is not a JSON '
+								'object'.format(number, path))
+			yield record
+
+def read_records(path, **kwargs):
+	"""
+	Yields the records of a .csv, .jsonl or .ndjson file, picked by extension
+	
+	Keyword arguments:
+	path -- the file name
+	kwargs -- passed on to read_csv() for CSV files
+	"""
+	if path.endswith('.csv'):
+		return read_csv(path, **kwargs)
+	if path.endswith(('.jsonl', '.ndjson')):
+		return read_json_lines(path)
+	raise GraphError('Cannot tell the format of "{0}" from its '
+					'extension'.format(path))
+
+
+def load_nodes(graph, records, key='id', batch_size=10000):
+	"""
+	Adds a node for every record and returns a dict mapping the key of each
+	record to the id of its node. The key is kept as a node property.
+	
+	Keyword arguments:
+	graph -- the Graph to add nodes to
+	records -- an iterable of dicts of node properties
+	key -- the property naming each node in the file. Default 'id'
+	batch_size -- passed on to Graph.bulk_add_nodes(). Default 10000
+	"""
+	keys = []
+	
+	def properties():
+		for record in records:
+			if key not in record:
+				raise GraphError('Node record {0!r} has no "{1}"'.format(
+					record, key))
+			keys.append(record[key])
+			yield record
+	
+	ids = graph.bulk_add_nodes(properties(), batch_size)
+	return dict(zip(keys, ids))
+
+def load_edges(graph, records, ids=None, start='start', label='label',
+			end='end', batch_size=10000):
+	"""
+	Adds an edge for every record and returns a list of the edge ids. The
+	start, label and end fields are taken out of each record and the rest
+	become edge properties.
+	
+	Keyword arguments:
+	graph -- the Graph to add edges to
+	records -- an iterable of dicts
+	ids -- a dict mapping the keys in the start and end fields to node ids,
+		as returned by load_nodes(), or None if they already are node ids.
+		Default None
+	start -- the field holding the start node. Default 'start'
+	label -- the field holding the edge label. Default 'label'
+	end -- the field holding the end node. Default 'end'
+	batch_size -- passed on to Graph.bulk_add_edges(). Default 10000
+	"""
+	def edges():
+		for record in records:
+			properties = dict(record)
+			try:
+				start_key = properties.pop(start)
+				edge_label = properties.pop(label)
+				end_key = properties.pop(end)
+			except KeyError as e:
+				raise GraphError('Edge record {0!r} has no "{1}"'.format(
+					record, e.args[0]))
+			if ids is not None:
+				if start_key not in ids or end_key not in ids:
+					raise GraphError('Edge record {0!r} refers to a node that '
+									'was not loaded'.format(record))
+				start_key = ids[start_key]
+				end_key = ids[end_key]
+			yield start_key, edge_label, end_key, properties
+	
+	return graph.bulk_add_edges(edges(), batch_size)
\ No newline at end of file
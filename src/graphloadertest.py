@@ -0,0 +1,58 @@
+from graph import Graph, GraphError
+from graphloader import read_csv, read_json_lines, read_records, load_nodes, load_edges
+import os
+import tempfile
+import unittest
+
+class TestGraphLoader(unittest.TestCase):
+	def setUp(self):
+		self.directory = tempfile.mkdtemp()
+	
+	def tearDown(self):
+		for name in os.listdir(self.directory):
+			os.remove(os.path.join(self.directory, name))
+		os.rmdir(self.directory)
+	
+	def write(self, name, text):
+		path = os.path.join(self.directory, name)
+		with open(path, 'w', encoding='utf-8') as f:
+			f.write(text)
+		return path
+	
+	def test_read_csv(self):
+		path = self.write('users.csv', 'id,name,age\nu1,jack,30\nu2,jill,\n')
+		self.assertEqual(list(read_csv(path, types={'age': int})),
+						[{'id': 'u1', 'name': 'jack', 'age': 30},
+						{'id': 'u2', 'name': 'jill'}])
+		self.assertEqual(list(read_records(path))[0]['age'], '30')
+	
+	def test_read_json_lines(self):
+		path = self.write('users.jsonl', '{"id": 1}\n\n{"id": 2, "tags": ["a"]}\n')
+		self.assertEqual(list(read_records(path)), [{'id': 1}, {'id': 2, 'tags': ['a']}])
+		path = self.write('bad.jsonl', '{"id": 1}\n[1, 2]\n')
+		self.assertRaises(GraphError, list, read_json_lines(path))
+		self.assertRaises(GraphError, read_records, 'users.txt')
+	
+	def test_load(self):
+		g = Graph()
+		g.add_node()
+		nodes = self.write('users.csv', 'id,name\nu1,jack\nu2,jill\n')
+		edges = self.write('follows.jsonl', '{"start": "u1", "label": "follows", '
+						'"end": "u2", "since": 2001}\n')
+		ids = load_nodes(g, read_records(nodes))
+		self.assertEqual(ids, {'u1': 1, 'u2': 2})
+		self.assertEqual(g.node(1).name, 'jack')
+		self.assertEqual(load_edges(g, read_records(edges), ids), [3])
+		edge = g.edge(3)
+		self.assertEqual((edge.start_node.id, edge.label, edge.end_node.id),
+						(1, 'follows', 2))
+		self.assertEqual(edge.properties, {'since': 2001})
+		
+		self.assertEqual(load_edges(g, [{'start': 2, 'label': 'follows', 'end': 1}]), [4])
+		self.assertRaises(GraphError, load_edges, g, [{'start': 'u1', 'end': 'u2'}], ids)
+		self.assertRaises(GraphError, load_edges, g,
+						[{'start': 'u1', 'label': 'follows', 'end': 'u3'}], ids)
+		self.assertRaises(GraphError, load_nodes, g, [{'name': 'nobody'}])
+
+if __name__ == '__main__':
+	unittest.main()
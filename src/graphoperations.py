@@ -0,0 +1,380 @@
+"""
+Whole queries and traversals run against a Graph in one call, taking and
+returning only plain data: ids, labels, dicts of properties and Predicates.
+Servers run them on the client's behalf so a query costs one round trip
+however many elements it touches, and their results can be pickled and sent
+back as they are.
+
+Nodes are returned as dicts {'id': id, 'properties': {...}} and edges as
+dicts {'id': id, 'label': label, 'start': node id, 'end': node id,
+'properties': {...}}. Queries are None, a dict of properties to match, or a
+Predicate.
+
+Operations are named in OPERATIONS and run with execute(), eg.
+	execute(g, 'find_nodes', {'type': 'user'}, limit=10)
+
+Changes are made in batches by apply_batch(), which adds every element and
+sets every property in a batch or, if any of them can't be, none of them.
+"""
+
+from graph import GraphError, Node, _query
+import graphquery
+
+
+def node_data(node):
+	"""Returns node as a dict of plain data"""
+	return {'id': node.id, 'properties': dict(node.properties)}
+
+def edge_data(edge):
+	"""Returns edge as a dict of plain data"""
+	return {'id': edge.id, 'label': edge.label, 'start': edge.start_node.id,
+			'end': edge.end_node.id, 'properties': dict(edge.properties)}
+
+def _get_node(graph, id):
+	"""Returns the node with id, raising GraphError if there isn't one"""
+	if id not in graph._nodes:
+		raise GraphError('Node {0!r} does not exist'.format(id))
+	return graph._nodes[id]
+
+def _limited(elements, limit):
+	if limit is not None:
+		elements = elements.limit(limit)
+	return elements
+
+
+def get_node(graph, id):
+	"""Returns the node with id, or None"""
+	node = graph._nodes.get(id)
+	return None if node is None else node_data(node)
+
+def get_edge(graph, id):
+	"""Returns the edge with id, or None"""
+	edge = graph._edges.get(id)
+	return None if edge is None else edge_data(edge)
+
+def find_nodes(graph, query=None, limit=None):
+	"""
+	Returns a list of the nodes matching query
+	
+	Keyword arguments:
+	graph -- the Graph to search
+	query -- None, a dict of properties or a Predicate. Default None
+	limit -- the most nodes to return, or None for all. Default None
+	"""
+	return [node_data(node)
+			for node in _limited(graph.iter_nodes(query), limit)]
+
+def find_edges(graph, label=None, query=None, limit=None):
+	"""
+	Returns a list of the edges with label matching query
+	
+	Keyword arguments:
+	graph -- the Graph to search
+	label -- the label of the edges, or None for any. Default None
+	query -- None, a dict of properties or a Predicate. Default None
+	limit -- the most edges to return, or None for all. Default None
+	"""
+	return [edge_data(edge)
+			for edge in _limited(graph.iter_edges(label, query), limit)]
+
+def count_nodes(graph, query=None):
+	"""Returns the number of nodes matching query"""
+	if query is None:
+		return len(graph._nodes)
+	return graph.iter_nodes(query).count()
+
+def count_edges(graph, label=None, query=None):
+	"""Returns the number of edges with label matching query"""
+	if query is None:
+		return graph.edge_count(label)
+	return graph.iter_edges(label, query).count()
+
+def node_edges(graph, id, label=None, direction='any', query=None, limit=None):
+	"""
+	Returns a list of the edges of the node with id
+	
+	Keyword arguments:
+	graph -- the Graph to search
+	id -- the id of the node
+	label -- the label of the edges, or None for any. Default None
+	direction -- 'incoming', 'outgoing' or 'any'. Default 'any'
+	query -- None, a dict of properties or a Predicate. Default None
+	limit -- the most edges to return, or None for all. Default None
+	"""
+	edges = _get_node(graph, id).iter_edges(label, direction, query)
+	return [edge_data(edge) for edge in _limited(edges, limit)]
+
+def adjacent_nodes(graph, id, label=None, direction='outgoing', query=None,
+				limit=None):
+	"""
+	Returns a list of the nodes adjacent to the node with id, like
+	Node.adjacent_nodes()
+	
+	Keyword arguments:
+	graph -- the Graph to search
+	id -- the id of the node
+	label -- the label of the edges to follow, or None for any. Default None
+	direction -- 'incoming', 'outgoing' or 'any'. Default 'outgoing'
+	query -- None, a dict of properties or a Predicate the adjacent nodes
+		must match. Default None
+	limit -- the most nodes to return, or None for all. Default None
+	"""
+	nodes = _get_node(graph, id).iter_adjacent_nodes(label, direction, query)
+	return [node_data(node) for node in _limited(nodes, limit)]
+
+def traverse(graph, start_id, directions=None, max_depth=None, limit=None,
+			where=None):
+	"""
+	Returns a list of the nodes a breadth first search from the node with
+	start_id finds, in the order found, each with a 'depth' key added
+	
+	Keyword arguments:
+	graph -- the Graph to search
+	start_id -- the id of the node to search from, which isn't returned
+	directions -- a dict whose keys are edge labels and whose values are the
+		direction to follow them in, like Graph.find_reachable_nodes_from(),
+		or None to follow every outgoing edge. Default None
+	max_depth -- the deepest level of the search. Default None
+	limit -- the most nodes to return. Default None
+	where -- None, a dict of properties or a Predicate nodes must match to
+		be returned or searched through. Default None
+	"""
+	predicate = None
+	query = _query(where, {})
+	if query is not None:
+		match = query.compile()
+		predicate = lambda node: match(node.properties)
+	traverser = graph.find_reachable_nodes_from(
+		_get_node(graph, start_id), max_depth=max_depth, limit=limit,
+		predicate=predicate, **(directions or {}))
+	result = []
+	# the first node found is next to the start node, and after each one the
+	# traverser peeks at the depth of the one after
+	depth = 1
+	for node in traverser:
+		data = node_data(node)
+		data['depth'] = depth
+		result.append(data)
+		depth = traverser.depth
+	return result
+
+def shortest_path(graph, start_id, end_id, directions=None):
+	"""
+	Returns a list of the nodes on a shortest path between the nodes with
+	start_id and end_id, or None if there is no path
+	
+	Keyword arguments:
+	graph -- the Graph to search
+	start_id -- the id of the node the path starts at
+	end_id -- the id of the node the path ends at
+	directions -- a dict of edge labels and directions to follow, like
+		traverse(). Default None
+	"""
+	path = graph.shortest_path(_get_node(graph, start_id),
+							_get_node(graph, end_id), **(directions or {}))
+	return None if path is None else [node_data(node) for node in path]
+
+def weighted_shortest_path(graph, start_id, end_id, weight='weight',
+						directions=None):
+	"""
+	Returns {'cost': cost, 'path': [nodes]} for a cheapest path between the
+	nodes with start_id and end_id, or None if there is no path
+	
+	Keyword arguments:
+	graph -- the Graph to search
+	start_id -- the id of the node the path starts at
+	end_id -- the id of the node the path ends at
+	weight -- the edge property holding the edge's weight. Default 'weight'
+	directions -- a dict of edge labels and directions to follow, like
+		traverse(). Default None
+	"""
+	result = graph.weighted_shortest_path(
+		_get_node(graph, start_id), _get_node(graph, end_id), weight,
+		**(directions or {}))
+	if result is None:
+		return None
+	cost, path = result
+	return {'cost': cost, 'path': [node_data(node) for node in path]}
+
+def aggregate(graph, aggregates=None, group_by=None, element_type='node',
+			label=None, query=None):
+	"""
+	Returns the aggregates of the nodes or edges matching query, see
+	Graph.aggregate()
+	
+	Keyword arguments:
+	graph -- the Graph to search
+	aggregates -- a dict mapping names to (function, key). Default None, a
+		count
+	group_by -- a property key or Degree to group by, or None. Default None
+	element_type -- 'node' or 'edge'. Default 'node'
+	label -- the label of the edges, or None for any. Default None
+	query -- None, a dict of properties or a Predicate. Default None
+	"""
+	return graph.aggregate(aggregates, group_by, element_type, label, query)
+
+def match(graph, pattern, where=None, limit=None):
+	"""
+	Returns a list of dicts mapping the names in pattern to the data of the
+	nodes and edges of a match, see graphquery.match()
+	
+	Keyword arguments:
+	graph -- the Graph to search
+	pattern -- the pattern, see graphquery
+	where -- a dict mapping names in pattern to dicts of properties or
+		Predicates. Default None
+	limit -- the most matches to return, or None for all. Default None
+	"""
+	return [dict((name, node_data(element) if isinstance(element, Node)
+				else edge_data(element))
+				for name, element in row.items())
+			for row in graphquery.match(graph, pattern, where, limit)]
+
+def _check_batch(graph, operations):
+	"""
+	Raises GraphError unless apply_batch() can make every change in
+	operations. Returns (nodes, edges, updates), where nodes and edges are
+	lists of (temporary id, change) for the elements to add, with the
+	properties set on them later in the batch folded in, and updates lists
+	the (id, key, value) changes to existing elements.
+	"""
+	new = {}
+	nodes = []
+	edges = []
+	updates = []
+	for change in operations:
+		kind = change[0]
+		if kind == 'add_node':
+			temporary_id, properties = change[1:]
+			change = ['node', dict(properties or {})]
+			nodes.append((temporary_id, change))
+		elif kind == 'add_edge':
+			temporary_id, start, label, end, properties = change[1:]
+			for id in (start, end):
+				if not (id in new and new[id][0] == 'node' or id in graph._nodes):
+					raise GraphError('Node {0!r} does not exist'.format(id))
+			change = ['edge', dict(properties or {}), start, label, end]
+			edges.append((temporary_id, change))
+		elif kind == 'set_property':
+			id, key, value = change[1:]
+			if id in new:
+				new[id][1][key] = value
+			elif id in graph._nodes or id in graph._edges:
+				updates.append((id, key, value))
+			else:
+				raise GraphError('Element {0!r} does not exist'.format(id))
+			continue
+		else:
+			raise GraphError('"{0}" is not a batch operation'.format(kind))
+		if temporary_id in new or temporary_id in graph._nodes or (
+				temporary_id in graph._edges):
+			raise GraphError('Temporary id {0!r} is already taken'.format(
+				temporary_id))
+		new[temporary_id] = change
+	# every value the batch gives an indexed key must be free, counting
+	# values given to other elements earlier in the batch as taken. New
+	# elements have no id yet, so are told apart by their temporary id
+	values = [(change[0], ('new', temporary_id), None, key, value)
+			for temporary_id, change in nodes + edges
+			for key, value in change[1].items()]
+	values.extend(('node' if id in graph._nodes else 'edge', id, id, key, value)
+				for id, key, value in updates)
+	claimed = {}
+	for element_type, owner, id, key, value in values:
+		index = graph._indexes[element_type].get(key)
+		if index is None:
+			continue
+		# also raises for values that can't be indexed
+		index.lookup(value)
+		index.check(id, value)
+		if index.unique and claimed.setdefault(
+				(element_type, key, value), owner) != owner:
+			raise GraphError('Unique index on "{0}" already contains '
+							'{1!r}'.format(key, value))
+	return nodes, edges, updates
+
+def apply_batch(graph, operations):
+	"""
+	Makes every change in operations, or none of them if any can't be made,
+	and returns a dict mapping the temporary ids of the elements added to
+	their ids in graph. Every change is checked before the first is made.
+	New nodes and edges are added with Graph.bulk_add_nodes() and
+	Graph.bulk_add_edges().
+	
+	Keyword arguments:
+	graph -- the Graph to change
+	operations -- a list of changes, each one of
+		('add_node', temporary_id, properties)
+		('add_edge', temporary_id, start, label, end, properties)
+		('set_property', id, key, value)
+		where start, end and id are ids in graph or temporary ids from earlier
+		in the list, temporary ids are any values that aren't ids in graph,
+		and properties is a dict or None
+	"""
+	with graph.writing():
+		return _apply_batch(graph, operations)
+
+def _apply_batch(graph, operations):
+	nodes, edges, updates = _check_batch(graph, operations)
+	ids = {}
+	if nodes:
+		added = graph.bulk_add_nodes([change[1] for _, change in nodes],
+									len(nodes))
+		ids.update(zip([temporary_id for temporary_id, _ in nodes], added))
+	if edges:
+		added = graph.bulk_add_edges(
+			[(ids.get(start, start), label, ids.get(end, end), properties)
+			for _, (_, properties, start, label, end) in edges], len(edges))
+		ids.update(zip([temporary_id for temporary_id, _ in edges], added))
+	for id, key, value in updates:
+		element = graph._nodes[id] if id in graph._nodes else graph._edges[id]
+		graph._set_property(element, key, value)
+	return ids
+
+OPERATIONS = {
+	'get_node': get_node,
+	'get_edge': get_edge,
+	'find_nodes': find_nodes,
+	'find_edges': find_edges,
+	'count_nodes': count_nodes,
+	'count_edges': count_edges,
+	'node_edges': node_edges,
+	'adjacent_nodes': adjacent_nodes,
+	'traverse': traverse,
+	'shortest_path': shortest_path,
+	'weighted_shortest_path': weighted_shortest_path,
+	'match': match,
+	'aggregate': aggregate,
+	'apply_batch': apply_batch,
+}
+
+# the operations that change the graph, the rest only read it
+CHANGES = frozenset(('apply_batch',))
+
+def execute(graph, operation, *args, **kwargs):
+	"""
+	Runs the operation named operation against graph and returns its result.
+	Holds the graph's lock for the whole operation, so other threads can't
+	change the graph part way through.
+	
+	Keyword arguments:
+	graph -- the Graph
+	operation -- a key of OPERATIONS
+	args, kwargs -- the arguments of the operation, after graph
+	"""
+	if operation not in OPERATIONS:
+		raise GraphError('"{0}" is not an operation'.format(operation))
+	lock = graph.writing() if operation in CHANGES else graph.reading()
+	with lock:
+		return OPERATIONS[operation](graph, *args, **kwargs)
+
+def execute_all(graph, requests):
+	"""
+	Runs several operations in order and returns a list of their results
+	
+	Keyword arguments:
+	graph -- the Graph
+	requests -- an iterable of (operation, args, kwargs) tuples
+	"""
+	return [execute(graph, operation, *args, **kwargs)
+			for operation, args, kwargs in requests]
\ No newline at end of file
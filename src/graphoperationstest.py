@@ -0,0 +1,121 @@
+from graph import Graph, GraphError, Range
+import graphoperations
+import pickle
+import unittest
+
+class TestGraphOperations(unittest.TestCase):
+	def setUp(self):
+		self.g = g = Graph()
+		self.jack = g.add_node(name='jack', age=30)
+		self.jill = g.add_node(name='jill', age=28)
+		self.hill = g.add_node(name='hill')
+		self.knows = g.add_edge(self.jack, 'knows', self.jill, since=2001)
+		g.add_edge(self.jack, 'climbs', self.hill, weight=5)
+		g.add_edge(self.jill, 'climbs', self.hill, weight=1)
+	
+	def execute(self, operation, *args, **kwargs):
+		result = graphoperations.execute(self.g, operation, *args, **kwargs)
+		# results are sent back pickled
+		return pickle.loads(pickle.dumps(result))
+	
+	def test_elements(self):
+		self.assertEqual(self.execute('get_node', 0),
+						{'id': 0, 'properties': {'name': 'jack', 'age': 30}})
+		self.assertEqual(self.execute('get_node', 99), None)
+		self.assertEqual(self.execute('get_edge', self.knows.id),
+						{'id': 3, 'label': 'knows', 'start': 0, 'end': 1,
+						'properties': {'since': 2001}})
+		self.assertEqual([node['id'] for node in self.execute('find_nodes')], [0, 1, 2])
+		self.assertEqual([node['id'] for node in self.execute(
+						'find_nodes', Range('age', 29))], [0])
+		self.assertEqual(len(self.execute('find_nodes', limit=2)), 2)
+		self.assertEqual([edge['id'] for edge in self.execute('find_edges', 'climbs')],
+						[4, 5])
+		self.assertEqual(self.execute('count_nodes', {'name': 'jill'}), 1)
+		self.assertEqual(self.execute('count_edges'), 3)
+		self.assertEqual(self.execute('count_edges', 'climbs', {'weight': 1}), 1)
+		self.assertEqual([edge['id'] for edge in self.execute(
+						'node_edges', 2, direction='incoming')], [4, 5])
+		self.assertEqual([node['id'] for node in self.execute(
+						'adjacent_nodes', 0, query={'name': 'hill'})], [2])
+		self.assertRaises(GraphError, self.execute, 'node_edges', 99)
+		self.assertRaises(GraphError, self.execute, 'remove_node', 0)
+	
+	def test_paths(self):
+		self.assertEqual([(node['id'], node['depth']) for node in self.execute(
+						'traverse', 0)], [(1, 1), (2, 1)])
+		self.assertEqual([(node['id'], node['depth']) for node in self.execute(
+						'traverse', 1, {'knows': 'any', 'climbs': 'any'})],
+						[(0, 1), (2, 1)])
+		top = self.g.add_node(name='top')
+		self.g.add_edge(self.hill, 'climbs', top)
+		self.assertEqual([(node['id'], node['depth']) for node in self.execute(
+						'traverse', 1, {'climbs': 'outgoing'})], [(2, 1), (top.id, 2)])
+		self.assertEqual([node['id'] for node in self.execute(
+						'traverse', 2, {'climbs': 'incoming'}, where={'name': 'jill'})],
+						[1])
+		self.assertEqual(len(self.execute('traverse', 0, limit=1)), 1)
+		self.assertEqual([node['id'] for node in self.execute('shortest_path', 0, 2)],
+						[0, 2])
+		self.assertEqual(self.execute('shortest_path', 2, 0), None)
+		result = self.execute('weighted_shortest_path', 0, 2)
+		self.assertEqual(result['cost'], 2)
+		self.assertEqual([node['id'] for node in result['path']], [0, 1, 2])
+		self.assertEqual(graphoperations.execute_all(self.g, [
+						('count_nodes', (), {}), ('get_node', (2,), {})]),
+						[4, {'id': 2, 'properties': {'name': 'hill'}}])
+	
+	def test_match(self):
+		rows = self.execute('match', '(a)-[k:knows]->(b)-[:climbs]->(c)',
+							{'c': {'name': 'hill'}})
+		self.assertEqual(len(rows), 1)
+		self.assertEqual(rows[0]['a'], {'id': 0, 'properties': {'name': 'jack', 'age': 30}})
+		self.assertEqual((rows[0]['k']['start'], rows[0]['k']['label']), (0, 'knows'))
+	
+	def test_aggregate(self):
+		self.assertEqual(self.execute('aggregate', {'oldest': ('max', 'age')}),
+						{'oldest': 30})
+		self.assertEqual(self.execute('aggregate', {'weight': ('sum', 'weight')},
+									element_type='edge', label='climbs',
+									query=Range('weight', 2, None)),
+						{'weight': 5})
+	
+	def test_apply_batch(self):
+		g = self.g
+		g.create_index('node', 'name', unique=True)
+		ids = graphoperations.apply_batch(g, [
+			('add_node', -1, {'name': 'pail'}),
+			('add_node', -2, None),
+			('add_edge', -3, -1, 'holds', -2, {'litres': 2}),
+			('add_edge', -4, 1, 'fetches', -1, None),
+			('set_property', -2, 'name', 'water'),
+			('set_property', -3, 'litres', 3),
+			('set_property', 0, 'age', 31)])
+		self.assertEqual(ids, {-1: 6, -2: 7, -3: 8, -4: 9})
+		self.assertEqual(g.node(name='water').id, 7)
+		self.assertEqual(g.edge(8).properties, {'litres': 3})
+		self.assertEqual(g.edge(9).start_node, self.jill)
+		self.assertEqual(self.jack.age, 31)
+		
+		# nothing is changed unless everything can be
+		bad_batches = [
+			[('add_node', -1, {'name': 'crown'}), ('add_node', -2, {'name': 'crown'})],
+			[('add_node', -1, {'name': 'crown'}), ('set_property', 0, 'name', 'crown')],
+			[('add_node', -1, {}), ('set_property', -1, 'name', 'jill')],
+			[('add_node', -1, {'name': 'crown'}), ('add_edge', -2, -1, 'on', 99, {})],
+			[('add_node', -1, {}), ('add_edge', -2, -1, 'on', -3, {})],
+			[('add_node', -1, {}), ('set_property', 99, 'name', 'crown')],
+			[('add_node', -1, {}), ('add_node', -1, {})],
+			[('add_node', 0, {})],
+			[('add_node', -1, {}), ('remove_node', 0)],
+		]
+		for batch in bad_batches:
+			self.assertRaises(GraphError, graphoperations.apply_batch, g, batch)
+		self.assertEqual(len(g.nodes()), 5)
+		self.assertEqual(g.node(name='crown'), None)
+		self.assertEqual(graphoperations.apply_batch(g, []), {})
+		# an element keeps its own value
+		graphoperations.apply_batch(g, [('set_property', 1, 'name', 'jill')])
+
+if __name__ == '__main__':
+	unittest.main()
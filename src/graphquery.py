@@ -0,0 +1,406 @@
+"""
+Pattern matching queries over a Graph. A pattern is a chain of nodes and the
+edges between them, written like
+	(u {type: "user"})-[:follows]->(r)-[:owns]->(c {type: "comment"})
+and matching it returns every way of binding the named nodes and edges to
+elements of the graph, as dicts:
+	for row in match(g, '(u {name: "jack"})-[:follows]->(r)-[:owns]->(c)'):
+		print(row['r'], row['c'])
+
+Nodes are (name {key: value, ...}), where the name and properties are both
+optional. Edges are -[name:label {key: value, ...}]->, <-[...]- or -[...]-
+for either direction, where everything in the brackets is optional, and
+-->, <-- and -- are edges with any label. Values are strings in single or
+double quotes, numbers, true, false or null. A name used twice must bind
+the same node both times, and no edge is used twice in one match.
+
+match() plans the query before running it: it starts from the node pattern
+that, going by the property indexes and the average number of edges per
+label, leaves the least work, and grows the matches out from there one edge
+at a time, reading the edges of each node only once however many matches
+reach it.
+"""
+
+from ast import literal_eval
+import re
+from graph import GraphError, _query
+
+
+_TOKEN = re.compile(r'''\s*(?:
+	(?P<string>"(?:[^"\\]|\\.)*"|'(?:[^'\\]|\\.)*')
+	|(?P<number>-?\d+(?:\.\d*)?(?:[eE][-+]?\d+)?)
+	|(?P<name>[A-Za-z_][A-Za-z0-9_]*)
+	|(?P<arrow><-|->|-)
+	|(?P<symbol>[()\[\]{}:,])
+	)''', re.VERBOSE)
+
+_NAMES = {'true': True, 'false': False, 'null': None}
+
+# the fraction of nodes an unindexed property query is guessed to match
+_UNINDEXED_SELECTIVITY = 0.1
+
+
+class NodePattern(object):
+	"""
+	A node in a pattern
+	
+	Instance variables:
+	name -- the name the matching node is bound to, or None
+	properties -- a dict of the properties the node must have
+	query -- the Predicate the node must match, set when the pattern is
+		planned
+	"""
+	def __init__(self, name, properties):
+		self.name = name
+		self.properties = properties
+		self.query = None
+
+
+class EdgePattern(object):
+	"""
+	An edge in a pattern, between the node patterns before and after it
+	
+	Instance variables:
+	name -- the name the matching edge is bound to, or None
+	label -- the label the edge must have, or None for any
+	direction -- 'outgoing' if the edge points from the node before it to the
+		one after, 'incoming' if the other way, or 'any'
+	properties -- a dict of the properties the edge must have
+	query -- the Predicate the edge must match, set when the pattern is
+		planned
+	"""
+	def __init__(self, name, label, direction, properties):
+		self.name = name
+		self.label = label
+		self.direction = direction
+		self.properties = properties
+		self.query = None
+
+
+def _tokens(pattern):
+	"""Returns a list of the (kind, text) tokens of pattern"""
+	tokens = []
+	position = 0
+	pattern = pattern.strip()
+	while position < len(pattern):
+		found = _TOKEN.match(pattern, position)
+		if found is None or found.end() == position:
+			raise GraphError('Cannot read pattern at "{0}"'.format(
+				pattern[position:position + 20]))
+		tokens.append((found.lastgroup, found.group(found.lastgroup)))
+		position = found.end()
+	return tokens
+
+
+class _Parser(object):
+	def __init__(self, pattern):
+		self.tokens = _tokens(pattern)
+		self.position = 0
+	
+	def peek(self):
+		if self.position < len(self.tokens):
+			return self.tokens[self.position][1]
+		return None
+	
+	def token(self):
+		"""Returns the (kind, text) of the next token, which must be there"""
+		if self.position >= len(self.tokens):
+			raise GraphError('Pattern ends early')
+		return self.tokens[self.position]
+	
+	def take(self, kind=None, text=None):
+		token_kind, token_text = self.token()
+		if kind is not None and token_kind != kind or (
+				text is not None and token_text != text):
+			raise GraphError('Expected {0} in pattern, not "{1}"'.format(
+				text or kind, token_text))
+		self.position += 1
+		return token_text
+	
+	def parse(self):
+		"""Returns ([NodePattern], [EdgePattern]) for the pattern"""
+		nodes = [self.node()]
+		edges = []
+		while self.peek() is not None:
+			edges.append(self.edge())
+			nodes.append(self.node())
+		return nodes, edges
+	
+	def node(self):
+		self.take('symbol', '(')
+		name = None
+		if self.token()[0] == 'name':
+			name = self.take('name')
+		properties = self.properties()
+		self.take('symbol', ')')
+		return NodePattern(name, properties)
+	
+	def edge(self):
+		start = self.take('arrow')
+		name = label = None
+		properties = {}
+		if self.peek() == '[':
+			self.take()
+			if self.token()[0] == 'name':
+				name = self.take('name')
+			if self.peek() == ':':
+				self.take()
+				label = self.label()
+			properties = self.properties()
+			self.take('symbol', ']')
+		end = self.take('arrow')
+		directions = {('-', '->'): 'outgoing', ('<-', '-'): 'incoming',
+					('-', '-'): 'any'}
+		if (start, end) not in directions:
+			raise GraphError('Edge "{0}...{1}" in pattern has no '
+							'direction'.format(start, end))
+		return EdgePattern(name, label, directions[(start, end)], properties)
+	
+	def label(self):
+		kind, text = self.token()
+		self.position += 1
+		if kind == 'string':
+			return literal_eval(text)
+		if kind == 'name':
+			return text
+		raise GraphError('"{0}" is not a label'.format(text))
+	
+	def properties(self):
+		properties = {}
+		if self.peek() != '{':
+			return properties
+		self.take()
+		while self.peek() != '}':
+			if properties:
+				self.take('symbol', ',')
+			key = self.label()
+			self.take('symbol', ':')
+			properties[key] = self.value()
+		self.take('symbol', '}')
+		return properties
+	
+	def value(self):
+		kind, text = self.token()
+		self.position += 1
+		if kind in ('string', 'number'):
+			return literal_eval(text)
+		if kind == 'name' and text in _NAMES:
+			return _NAMES[text]
+		raise GraphError('"{0}" is not a value'.format(text))
+
+def parse(pattern):
+	"""
+	Returns ([NodePattern], [EdgePattern]) for pattern, where edge i joins
+	nodes i and i + 1
+	"""
+	return _Parser(pattern).parse()
+
+
+class Plan(object):
+	"""
+	How match() runs a pattern
+	
+	Instance variables:
+	start -- the index of the node pattern matches are grown from
+	steps -- the edge patterns followed, in order, as (edge index, from node
+		index, to node index)
+	cost -- the estimated number of elements read
+	"""
+	def __init__(self, start, steps, cost):
+		self.start = start
+		self.steps = steps
+		self.cost = cost
+	
+	def __repr__(self):
+		return 'Plan(start={0}, steps={1}, cost={2:.0f})'.format(
+			self.start, self.steps, self.cost)
+
+
+class _Query(object):
+	"""A parsed pattern and what the graph's statistics say about it"""
+	def __init__(self, graph, pattern, where):
+		where = where or {}
+		self.graph = graph
+		self.nodes, self.edges = parse(pattern)
+		names = set(pattern.name for pattern in self.nodes + self.edges
+					if pattern.name is not None)
+		for name in where:
+			if name not in names:
+				raise GraphError('"{0}" is not named in the pattern'.format(name))
+		for pattern in self.nodes + self.edges:
+			pattern.query = _query(where.get(pattern.name),
+								pattern.properties)
+		node_count = max(len(graph._nodes), 1)
+		# the ids of the only nodes that can match each node pattern, or None
+		self.candidate_ids = []
+		self.estimates = []
+		for pattern in self.nodes:
+			ids = None
+			if pattern.query is not None:
+				ids = pattern.query.ids(graph._indexes['node'])
+			self.candidate_ids.append(None if ids is None else set(ids))
+			if ids is not None:
+				self.estimates.append(len(ids))
+			elif pattern.query is not None:
+				self.estimates.append(node_count * _UNINDEXED_SELECTIVITY)
+			else:
+				self.estimates.append(node_count)
+		label_counts = graph.edge_label_counts()
+		edge_count = sum(label_counts.values())
+		self.degrees = []
+		for pattern in self.edges:
+			count = edge_count if pattern.label is None else label_counts.get(
+				pattern.label, 0)
+			degree = count / float(node_count)
+			if pattern.direction == 'any':
+				degree *= 2
+			if pattern.query is not None:
+				degree *= _UNINDEXED_SELECTIVITY
+			self.degrees.append(degree)
+		self.node_count = node_count
+	
+	def plan(self, start):
+		"""Returns the cheapest Plan growing matches from node start"""
+		if self.candidate_ids[start] is not None or self.nodes[start].query is None:
+			cost = self.estimates[start]
+		else:
+			# a full scan to find them
+			cost = self.node_count
+		rows = self.estimates[start]
+		low = high = start
+		steps = []
+		while low > 0 or high < len(self.nodes) - 1:
+			# follow whichever edge next to the matched part is cheaper
+			options = []
+			if low > 0:
+				options.append((rows * self.degrees[low - 1], low - 1, low,
+								low - 1))
+			if high < len(self.nodes) - 1:
+				options.append((rows * self.degrees[high], high, high,
+								high + 1))
+			reads, edge, source, target = min(options)
+			cost += reads
+			rows = reads * self.estimates[target] / self.node_count
+			steps.append((edge, source, target))
+			low = min(low, target)
+			high = max(high, target)
+		return Plan(start, steps, cost)
+	
+	def best_plan(self):
+		return min((self.plan(start) for start in range(len(self.nodes))),
+				key=lambda plan: plan.cost)
+	
+	def run(self, plan, limit):
+		"""
+		Returns the matches as lists holding the node matching node pattern i
+		at 2 * i and the edge matching edge pattern i at 2 * i + 1
+		"""
+		size = len(self.nodes) + len(self.edges)
+		start = self.nodes[plan.start]
+		rows = []
+		for node in self.graph.iter_nodes(start.query):
+			row = [None] * size
+			row[plan.start * 2] = node
+			rows.append(row)
+		for number, (edge, source, target) in enumerate(plan.steps):
+			last = number == len(plan.steps) - 1
+			rows = self.extend(rows, edge, source, target,
+							limit if last else None)
+		if limit is not None:
+			rows = rows[:limit]
+		return rows
+	
+	def extend(self, rows, edge_index, source, target, limit):
+		"""
+		Returns the rows made by following edge pattern edge_index from node
+		pattern source to target in each row
+		"""
+		pattern = self.edges[edge_index]
+		direction = pattern.direction
+		if target < source and direction != 'any':
+			direction = 'incoming' if direction == 'outgoing' else 'outgoing'
+		edge_match = None if pattern.query is None else pattern.query.compile()
+		target_pattern = self.nodes[target]
+		candidates = self.candidate_ids[target]
+		node_match = None
+		if target_pattern.query is not None:
+			node_match = target_pattern.query.compile()
+		# a name used before must bind the node bound then
+		bound = [index * 2 for index, node in enumerate(self.nodes)
+				if index != target and node.name is not None
+				and node.name == target_pattern.name]
+		# the (edge, node) pairs reachable from each node, read once
+		reachable = {}
+		
+		def pairs(node):
+			result = []
+			seen = set()
+			for edges, edge_direction in node._adjacency(pattern.label, direction):
+				for edge in edges:
+					if edge.id in seen:
+						continue
+					seen.add(edge.id)
+					if edge_match is not None and not edge_match(edge.properties):
+						continue
+					other = (edge.end_node if edge_direction == 'outgoing'
+							else edge.start_node)
+					# a hash join against the indexed candidates, else a check
+					if candidates is not None and other.id not in candidates:
+						continue
+					if node_match is not None and not node_match(other.properties):
+						continue
+					result.append((edge, other))
+			return result
+		
+		result = []
+		for row in rows:
+			node = row[source * 2]
+			if node.id not in reachable:
+				reachable[node.id] = pairs(node)
+			for edge, other in reachable[node.id]:
+				if any(row[slot] is edge for slot in range(1, len(row), 2)):
+					continue
+				if any(row[slot] is not None and row[slot] is not other
+						for slot in bound):
+					continue
+				extended = list(row)
+				extended[edge_index * 2 + 1] = edge
+				extended[target * 2] = other
+				result.append(extended)
+				if limit is not None and len(result) >= limit:
+					return result
+		return result
+	
+	def bindings(self, row):
+		"""Returns a dict of the named elements of a row"""
+		result = {}
+		for index, pattern in enumerate(self.nodes):
+			if pattern.name is not None:
+				result[pattern.name] = row[index * 2]
+		for index, pattern in enumerate(self.edges):
+			if pattern.name is not None:
+				result[pattern.name] = row[index * 2 + 1]
+		return result
+
+
+def plan(graph, pattern, where=None):
+	"""Returns the Plan match() would run pattern with"""
+	with graph.reading():
+		return _Query(graph, pattern, where).best_plan()
+
+def match(graph, pattern, where=None, limit=None):
+	"""
+	Returns a list of dicts mapping the names in pattern to the nodes and
+	edges of a match, one for every match
+	
+	Keyword arguments:
+	graph -- the Graph to search
+	pattern -- the pattern, see the module documentation
+	where -- a dict mapping names in pattern to further conditions on what
+		they bind, dicts of properties or Predicates. Default None
+	limit -- the most matches to return, or None for all. Default None
+	"""
+	with graph.reading():
+		query = _Query(graph, pattern, where)
+		rows = query.run(query.best_plan(), limit)
+		return [query.bindings(row) for row in rows]
\ No newline at end of file
@@ -0,0 +1,79 @@
+from graph import Graph, GraphError, Range
+from graphquery import match, parse, plan
+import unittest
+
+class TestGraphQuery(unittest.TestCase):
+	def setUp(self):
+		g = self.g = Graph()
+		g.create_index('node', 'name', unique=True)
+		self.jack = g.add_node(type='user', name='jack')
+		self.jill = g.add_node(type='user', name='jill')
+		self.replays = [g.add_node(type='replay', name='replay{0}'.format(i))
+						for i in range(3)]
+		self.comments = [g.add_node(type='comment', name='comment{0}'.format(i),
+									likes=i) for i in range(6)]
+		g.add_edge(self.jack, 'follows', self.replays[0])
+		g.add_edge(self.jack, 'follows', self.replays[1])
+		g.add_edge(self.jill, 'follows', self.replays[1], since=2012)
+		g.add_edge(self.jack, 'knows', self.jill)
+		g.add_edge(self.jill, 'knows', self.jack)
+		for i, comment in enumerate(self.comments):
+			g.add_edge(self.replays[i % 3], 'owns', comment)
+	
+	def test_parse(self):
+		nodes, edges = parse('(u {type: "user", age: 3.5})<-[e:"owned by"]-({ok: true})')
+		self.assertEqual([node.name for node in nodes], ['u', None])
+		self.assertEqual(nodes[0].properties, {'type': 'user', 'age': 3.5})
+		self.assertEqual((edges[0].name, edges[0].label, edges[0].direction),
+						('e', 'owned by', 'incoming'))
+		nodes, edges = parse('(a)--(b)-->(c)<--(d)')
+		self.assertEqual([edge.direction for edge in edges],
+						['any', 'outgoing', 'incoming'])
+		self.assertEqual([edge.label for edge in edges], [None] * 3)
+		for pattern in ['(a', '(a)-[:x]', '(a)<-[:x]->(b)', '(a {b: c})', '(a)(b)']:
+			self.assertRaises(GraphError, parse, pattern)
+		# patterns cut short anywhere
+		for pattern in ['(', '(a)-', '(a)-[', '(a)-[:', '(a)-[e', '(a {', '(a {b:',
+						'(a {b: 1,', '(a)-[:x]-']:
+			self.assertRaisesRegex(GraphError, 'ends early', parse, pattern)
+	
+	def test_match(self):
+		rows = self.g.match('(u {name: "jack"})-[:follows]->(r)-[:owns]->(c)')
+		self.assertEqual(sorted(row['c'].name for row in rows),
+						['comment0', 'comment1', 'comment3', 'comment4'])
+		self.assertIs(rows[0]['u'], self.jack)
+		# the same, written from the other end
+		rows = match(self.g, '(c)<-[:owns]-(r)<-[:follows]-({name: "jack"})')
+		self.assertEqual(len(rows), 4)
+		self.assertEqual(set(rows[0]), {'c', 'r'})
+		rows = match(self.g, '(u)-[f:follows {since: 2012}]->(r)',
+					where={'r': {'type': 'replay'}})
+		self.assertEqual([(row['u'], row['r']) for row in rows],
+						[(self.jill, self.replays[1])])
+		self.assertEqual(rows[0]['f'].since, 2012)
+		rows = match(self.g, '(r)-[:owns]->(c)', where={'c': Range('likes', 4, None)})
+		self.assertEqual(sorted(row['c'].likes for row in rows), [4, 5])
+		self.assertEqual(len(match(self.g, '(r)-[:owns]->(c)', limit=2)), 2)
+		self.assertRaises(GraphError, match, self.g, '(a)', where={'b': {}})
+	
+	def test_match_names(self):
+		# jack and jill know each other, a name twice binds the same node
+		rows = match(self.g, '(a)-[:knows]->(b)-[:knows]->(a)')
+		self.assertEqual(sorted((row['a'].name, row['b'].name) for row in rows),
+						[('jack', 'jill'), ('jill', 'jack')])
+		# no edge twice, so going back to jack takes the other knows edge
+		rows = match(self.g, '(a {name: "jack"})-[x:knows]-(b)-[y:knows]-(c)')
+		self.assertEqual([row['c'] for row in rows], [self.jack, self.jack])
+		self.assertTrue(all(row['x'] is not row['y'] for row in rows))
+		rows = match(self.g, '(a {name: "jack"})-[x:knows]-(b)')
+		self.assertEqual(len(rows), 2)
+	
+	def test_plan(self):
+		# starts from the node the unique index finds
+		self.assertEqual(plan(self.g, '(c)<-[:owns]-(r)<-[:follows]-({name: "jack"})').start, 2)
+		self.assertEqual(plan(self.g, '({name: "jack"})-[:follows]->(r)-[:owns]->(c)').start, 0)
+		found = plan(self.g, '(c {type: "comment"})<-[:owns]-(r {name: "replay1"})')
+		self.assertEqual((found.start, found.steps), (1, [(0, 1, 0)]))
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,822 @@
+"""
+Durable storage for a Graph: an append-only write-ahead log of every change
+plus occasional snapshots of the whole graph, kept together in a directory.
+Saving only has to flush what was appended since the last save, and opening
+the directory loads the latest snapshot then replays the log written after it.
+	storage = GraphStorage('users.gdb')
+	g = storage.graph
+	g.add_node(name='jack')
+	storage.save()
+	storage.close()
+
+Only changes made through the Graph are logged, see Graph.add_listener().
+"""
+
+from array import array
+import bisect
+from collections.abc import MutableMapping
+import mmap
+import os
+import pickle
+import struct
+import sys
+import threading
+import time
+import traceback
+import zlib
+from graph import (Graph, Node, Edge, GraphError, OUTGOING, INCOMING,
+				_append_edge, _set_slot)
+
+
+SNAPSHOT_PREFIX = 'snapshot-'
+LOG_PREFIX = 'log-'
+
+# every log record is its length and crc32 followed by that many bytes of
+# pickled (sequence number, operation, args)
+_RECORD_HEADER = struct.Struct('<II')
+
+SYNC_POLICIES = ('always', 'batch', 'interval')
+SNAPSHOT_METHODS = ('fork', 'thread')
+
+# A snapshot file is a header followed by sections, each starting on a multiple
+# of 8 bytes. The header is SNAPSHOT_MAGIC, the format version, the number of
+# sections and an (offset, length) pair per section. All numbers are int64
+# arrays in the byte order of the machine that wrote them, named in the meta.
+#	meta -- pickled dict of sequence, nextid, labels, indexes and byteorder
+#	node ids -- every node id, ascending. A node's index here is its row
+#	node properties -- row + 1 offsets into the blob, row i's pickled
+#		properties are blob[offsets[i]:offsets[i + 1]], empty for none
+#	edge ids -- every edge id, ascending
+#	edge ends -- (start node id, end node id, label number) per edge row
+#	edge properties -- offsets into the blob like node properties
+#	blob -- the pickled properties
+#	adjacency offsets -- row + 1 offsets into adjacency
+#	adjacency -- edge row * 2 + OUTGOING or INCOMING for every edge of every
+#		node, in the order of the node's _edges
+#	label offsets -- label number + 1 offsets into label edges
+#	label edges -- the ids of the edges with each label, in Graph._labels order
+SNAPSHOT_MAGIC = b'EDDBSNAP'
+SNAPSHOT_VERSION = 1
+_SNAPSHOT_HEADER = struct.Struct('<8sII')
+_SECTION = struct.Struct('<qq')
+(_META, _NODE_IDS, _NODE_PROPERTIES, _EDGE_IDS, _EDGE_ENDS, _EDGE_PROPERTIES,
+	_BLOB, _ADJACENCY_OFFSETS, _ADJACENCY, _LABEL_OFFSETS, _LABEL_EDGES) = range(11)
+_SECTION_COUNT = 11
+
+
+def _fsync_directory(path):
+	"""Makes renames and new files in the directory path durable"""
+	if hasattr(os, 'O_DIRECTORY'):
+		fd = os.open(path, os.O_RDONLY | os.O_DIRECTORY)
+		try:
+			os.fsync(fd)
+		finally:
+			os.close(fd)
+
+def _pickled_properties(properties, blob, offsets):
+	if properties:
+		blob.append(pickle.dumps(properties, pickle.HIGHEST_PROTOCOL))
+		offsets.append(offsets[-1] + len(blob[-1]))
+	else:
+		offsets.append(offsets[-1])
+
+def write_snapshot(graph, path, sequence):
+	"""
+	Writes graph to path in the snapshot format, by way of a temporary file,
+	so path holds either the old snapshot or the new one even if writing is
+	interrupted
+	
+	Keyword arguments:
+	graph -- the Graph to write
+	path -- the file name
+	sequence -- the number of the last log record graph includes
+	"""
+	_write_sections(path, _snapshot_sections(graph, sequence))
+
+def _snapshot_sections(graph, sequence):
+	"""
+	Returns the sections of a snapshot of graph as arrays and bytes, which
+	don't change along with the graph
+	"""
+	node_ids = array('q', sorted(graph._nodes))
+	edge_ids = array('q', sorted(graph._edges))
+	edge_rows = {id: row for row, id in enumerate(edge_ids)}
+	labels = list(graph._labels)
+	label_numbers = {label: number for number, label in enumerate(labels)}
+	blob = []
+	node_offsets = array('q', [0])
+	adjacency_offsets = array('q', [0])
+	adjacency = array('q')
+	for id in node_ids:
+		node = graph._nodes[id]
+		_pickled_properties(node.properties, blob, node_offsets)
+		for outgoing, incoming in node._edges.values():
+			adjacency.extend([edge_rows[edge.id] * 2 + OUTGOING
+							for edge in outgoing])
+			adjacency.extend([edge_rows[edge.id] * 2 + INCOMING
+							for edge in incoming])
+		adjacency_offsets.append(len(adjacency))
+	edge_ends = array('q')
+	edge_offsets = array('q', [node_offsets[-1]])
+	for id in edge_ids:
+		edge = graph._edges[id]
+		if edge.label not in label_numbers:
+			label_numbers[edge.label] = len(labels)
+			labels.append(edge.label)
+		edge_ends.extend((edge.start_node.id, edge.end_node.id,
+						label_numbers[edge.label]))
+		_pickled_properties(edge.properties, blob, edge_offsets)
+	label_offsets = array('q', [0])
+	label_edges = array('q')
+	for label in labels:
+		label_edges.extend(graph._labels.get(label, ()))
+		label_offsets.append(len(label_edges))
+	meta = pickle.dumps({'sequence': sequence, 'nextid': graph._nextid,
+						'labels': labels, 'indexes': graph._indexes,
+						'byteorder': sys.byteorder}, pickle.HIGHEST_PROTOCOL)
+	return [meta, node_ids, node_offsets, edge_ids, edge_ends, edge_offsets,
+			b''.join(blob), adjacency_offsets, adjacency, label_offsets,
+			label_edges]
+
+def _write_sections(path, sections):
+	"""Writes the sections of a snapshot to path, see write_snapshot()"""
+	temporary = path + '.tmp'
+	with open(temporary, 'wb') as f:
+		offset = _SNAPSHOT_HEADER.size + _SECTION.size * _SECTION_COUNT
+		table = []
+		for section in sections:
+			offset += -offset % 8
+			length = len(section) * getattr(section, 'itemsize', 1)
+			table.append(_SECTION.pack(offset, length))
+			offset += length
+		f.write(_SNAPSHOT_HEADER.pack(SNAPSHOT_MAGIC, SNAPSHOT_VERSION,
+									_SECTION_COUNT))
+		f.write(b''.join(table))
+		for section in sections:
+			f.write(b'\0' * (-f.tell() % 8))
+			f.write(section)
+		f.flush()
+		os.fsync(f.fileno())
+	os.replace(temporary, path)
+	_fsync_directory(os.path.dirname(os.path.abspath(path)))
+
+def read_snapshot(path):
+	"""
+	Returns (sequence, graph) from a file written by write_snapshot(). The file
+	is memory mapped and nodes and edges are only read from it when first used,
+	so this takes about as long for any size of graph.
+	"""
+	reader = SnapshotReader(path)
+	return reader.sequence, reader.graph()
+
+
+class SnapshotReader(object):
+	"""
+	A memory mapped snapshot file, which reads in the elements of the graph it
+	holds as they are needed. The file stays mapped as long as the graph does.
+	Reading in is locked, so threads reading the graph at once each get the
+	same element.
+	
+	Instance variables:
+	path -- the file name
+	sequence -- the number of the last log record the graph includes
+	"""
+	def __init__(self, path):
+		self.path = path
+		with open(path, 'rb') as f:
+			self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+		view = memoryview(self._map)
+		if len(view) < _SNAPSHOT_HEADER.size:
+			raise GraphError('{0} is not a Graph snapshot'.format(path))
+		magic, version, count = _SNAPSHOT_HEADER.unpack_from(view)
+		if magic != SNAPSHOT_MAGIC:
+			raise GraphError('{0} is not a Graph snapshot'.format(path))
+		if version != SNAPSHOT_VERSION or count != _SECTION_COUNT:
+			raise GraphError('{0} is a version {1} snapshot, only version {2} '
+							'can be read'.format(path, version, SNAPSHOT_VERSION))
+		sections = []
+		for number in range(count):
+			offset, length = _SECTION.unpack_from(
+				view, _SNAPSHOT_HEADER.size + number * _SECTION.size)
+			if offset + length > len(view):
+				raise GraphError('{0} is cut short'.format(path))
+			sections.append(view[offset:offset + length])
+		meta = pickle.loads(sections[_META])
+		if meta['byteorder'] != sys.byteorder:
+			raise GraphError('{0} was written on a {1} endian machine'.format(
+				path, meta['byteorder']))
+		meta['labels'] = [sys.intern(label) if type(label) is str else label
+						for label in meta['labels']]
+		self._meta = meta
+		self.sequence = meta['sequence']
+		self._blob = sections[_BLOB]
+		(self._node_ids, self._node_offsets, self._edge_ids, self._edge_ends,
+			self._edge_offsets, self._adjacency_offsets, self._adjacency,
+			self._label_offsets, self._label_edges) = [
+				sections[number].cast('q') for number in (
+					_NODE_IDS, _NODE_PROPERTIES, _EDGE_IDS, _EDGE_ENDS,
+					_EDGE_PROPERTIES, _ADJACENCY_OFFSETS, _ADJACENCY,
+					_LABEL_OFFSETS, _LABEL_EDGES)]
+		self._graph = None
+		self._lock = threading.RLock()
+	
+	def graph(self):
+		"""
+		Returns the Graph in the snapshot. Only the label lists and indexes are
+		read in now, which are built from arrays and pickled dicts.
+		"""
+		graph = Graph()
+		graph._nextid = self._meta['nextid']
+		graph._indexes = self._meta['indexes']
+		offsets = self._label_offsets
+		graph._labels = {label: dict.fromkeys(self._label_edges[
+							offsets[number]:offsets[number + 1]])
+						for number, label in enumerate(self._meta['labels'])}
+		graph._nodes = SnapshotElements(self._node_ids, self._read_node,
+										self._lock)
+		graph._edges = SnapshotElements(self._edge_ids, self._read_edge,
+										self._lock)
+		graph._snapshot = self
+		self._graph = graph
+		return graph
+	
+	def _read_node(self, row):
+		node = Node.__new__(Node)
+		_set_slot(node, 'id', self._node_ids[row])
+		_set_slot(node, '_graph', self._graph)
+		return node
+	
+	def _read_edge(self, row):
+		start_id, end_id, label = self._edge_ends[row * 3:row * 3 + 3]
+		edge = Edge.__new__(Edge)
+		_set_slot(edge, 'id', self._edge_ids[row])
+		_set_slot(edge, 'label', self._meta['labels'][label])
+		_set_slot(edge, 'start_node', self._graph._nodes[start_id])
+		_set_slot(edge, 'end_node', self._graph._nodes[end_id])
+		_set_slot(edge, '_graph', self._graph)
+		return edge
+	
+	def load(self, element, slot):
+		"""
+		Reads in the properties or _edges of an element of the graph, which
+		were left unset when it was read, and returns them
+		"""
+		with self._lock:
+			try:
+				# another thread may have read it in while this one waited.
+				# The slot is read past __getattr__, which would come back here
+				return getattr(type(element), slot).__get__(element)
+			except AttributeError:
+				return self._load(element, slot)
+	
+	def _load(self, element, slot):
+		if isinstance(element, Node):
+			row = _row(self._node_ids, element.id)
+			offsets = self._node_offsets
+		else:
+			row = _row(self._edge_ids, element.id)
+			offsets = self._edge_offsets
+		if slot == 'properties':
+			start, end = offsets[row], offsets[row + 1]
+			value = pickle.loads(self._blob[start:end]) if end > start else {}
+			_set_slot(element, 'properties', value)
+		else:
+			value = {}
+			_set_slot(element, '_edges', value)
+			edges = self._graph._edges
+			for entry in self._adjacency[self._adjacency_offsets[row]:
+										self._adjacency_offsets[row + 1]]:
+				edge = edges[self._edge_ids[entry >> 1]]
+				_append_edge(element, edge, entry & 1)
+		return value
+
+
+def _row(ids, id):
+	"""Returns the index of id in the ascending array ids, or None"""
+	if type(id) is not int:
+		return None
+	row = bisect.bisect_left(ids, id)
+	if row < len(ids) and ids[row] == id:
+		return row
+	return None
+
+
+class SnapshotElements(MutableMapping):
+	"""
+	Stands in for Graph._nodes or Graph._edges of a graph opened from a
+	snapshot, mapping ids to elements. Elements in the snapshot are read in
+	the first time they are looked up, and elements added later are kept like
+	in a dict. Iterates in id order like the dict it replaces.
+	"""
+	def __init__(self, ids, read, lock):
+		"""
+		Keyword arguments:
+		ids -- the ascending ids of the elements in the snapshot
+		read -- a function returning the element in a row of ids
+		lock -- held while reading in an element
+		"""
+		self._ids = ids
+		self._read = read
+		self._lock = lock
+		# syntax: eg. _read_in[id] == the element read in for id
+		self._read_in = {}
+		self._removed = set()
+		self._added = {}
+	
+	def __getitem__(self, id):
+		element = self._read_in.get(id)
+		if element is not None:
+			return element
+		if id in self._added:
+			return self._added[id]
+		row = _row(self._ids, id)
+		if row is None or id in self._removed:
+			raise KeyError(id)
+		with self._lock:
+			element = self._read_in.get(id)
+			if element is None:
+				element = self._read_in[id] = self._read(row)
+		return element
+	
+	def __setitem__(self, id, element):
+		if _row(self._ids, id) is not None and id not in self._removed:
+			self._read_in[id] = element
+		else:
+			self._removed.discard(id)
+			self._added[id] = element
+	
+	def __delitem__(self, id):
+		if id in self._added:
+			del self._added[id]
+		elif id in self:
+			self._read_in.pop(id, None)
+			self._removed.add(id)
+		else:
+			raise KeyError(id)
+	
+	def __contains__(self, id):
+		if id in self._added:
+			return True
+		return _row(self._ids, id) is not None and id not in self._removed
+	
+	def __iter__(self):
+		removed = self._removed
+		for id in self._ids:
+			if id not in removed:
+				yield id
+		yield from list(self._added)
+	
+	def __len__(self):
+		return len(self._ids) - len(self._removed) + len(self._added)
+
+
+def read_log(path):
+	"""
+	Returns (records, end) for the log file path, where records is a list of
+	(sequence, operation, args) and end is the offset just past the last
+	whole record. Anything after end was cut short by a crash.
+	"""
+	records = []
+	end = 0
+	with open(path, 'rb') as f:
+		data = f.read()
+	while end + _RECORD_HEADER.size <= len(data):
+		length, crc = _RECORD_HEADER.unpack_from(data, end)
+		start = end + _RECORD_HEADER.size
+		payload = data[start:start + length]
+		if len(payload) < length or zlib.crc32(payload) != crc:
+			break
+		records.append(pickle.loads(payload))
+		end = start + length
+	return records, end
+
+def replay(graph, operation, args):
+	"""
+	Applies a change described by a Graph listener to graph, giving new
+	elements the same ids they had when the change was logged
+	"""
+	if operation in ('add_node', 'add_edge', 'add_nodes', 'add_edges'):
+		# elements can be logged with ids below ones already in use, see
+		# graphexport.import_graph(), so the next id is never put back down
+		nextid = graph._nextid
+		graph._nextid = args[0]
+		if operation == 'add_node':
+			graph.add_node(args[1])
+		elif operation == 'add_edge':
+			start_id, label, end_id, properties = args[1:]
+			graph.add_edge(graph._nodes[start_id], label, graph._nodes[end_id],
+						properties)
+		elif operation == 'add_nodes':
+			graph.bulk_add_nodes(args[1], len(args[1]))
+		else:
+			graph.bulk_add_edges(args[1], len(args[1]))
+		graph._nextid = max(nextid, graph._nextid)
+	elif operation == 'remove_node':
+		graph.remove_node(args[0])
+	elif operation == 'remove_edge':
+		graph.remove_edge(args[0])
+	elif operation == 'remove_nodes':
+		graph._remove_nodes([graph._nodes[id] for id in args[0]])
+	elif operation == 'remove_edges':
+		graph.remove_edges(args[0])
+	elif operation == 'set_property':
+		element_type, id, key, value = args
+		graph._set_property(graph._elements(element_type)[id], key, value)
+	elif operation == 'relabel_edge':
+		id, label = args
+		graph._relabel_edge(graph._edges[id], label)
+	elif operation == 'create_index':
+		graph.create_index(*args)
+	elif operation == 'drop_index':
+		graph.drop_index(*args)
+	else:
+		raise GraphError('"{0}" is not a logged operation'.format(operation))
+
+
+class SnapshotTask(object):
+	"""
+	A snapshot being written in the background by GraphStorage.snapshot(),
+	and once it's done how it went.
+	
+	Instance variables:
+	sequence -- the number of the last log record the snapshot includes
+	path -- the snapshot file
+	method -- 'fork' or 'thread'
+	started -- the time.time() writing started
+	duration -- the seconds it took, or None while running
+	size -- the size of the finished file in bytes, or None
+	error -- a description of what went wrong, or None
+	"""
+	def __init__(self, sequence, path, method):
+		self.sequence = sequence
+		self.path = path
+		self.method = method
+		self.started = time.time()
+		self.duration = None
+		self.size = None
+		self.error = None
+		self._done = threading.Event()
+	
+	def done(self):
+		"""Returns True once the snapshot has been written or has failed"""
+		return self._done.is_set()
+	
+	def wait(self, timeout=None):
+		"""Waits for the snapshot to be done, returns False on timeout"""
+		return self._done.wait(timeout)
+	
+	def bytes_written(self):
+		"""Returns the number of bytes written so far"""
+		if self.size is not None:
+			return self.size
+		try:
+			return os.path.getsize(self.path + '.tmp')
+		except OSError:
+			return 0
+	
+	def metrics(self):
+		"""Returns the instance variables as a dict, eg. to send to a client"""
+		return {'sequence': self.sequence, 'method': self.method,
+				'started': self.started, 'duration': self.duration,
+				'bytes_written': self.bytes_written(), 'size': self.size,
+				'error': self.error, 'done': self.done()}
+	
+	def _finish(self, error=None):
+		self.duration = time.time() - self.started
+		self.error = error
+		if error is None:
+			self.size = os.path.getsize(self.path)
+		self._done.set()
+
+
+class GraphStorage(object):
+	"""
+	A Graph kept in a directory as a snapshot and a write-ahead log. The
+	snapshot is memory mapped, so opening is quick whatever the size of the
+	graph, and the log is replayed on top of it. Every change to graph is
+	appended to the log as it happens. How often the log is forced to disk is
+	up to the sync policy:
+		'always' -- after every change, nothing is lost in a crash
+		'batch' -- after every batch_size changes
+		'interval' -- every interval seconds, from a background thread
+	save() forces it whatever the policy.
+	
+	The log is split into segments, files named by the number of their first
+	record. Taking a snapshot starts a new segment, and once the snapshot is
+	written the segments before it are removed.
+	
+	Instance variables:
+	location -- the directory
+	graph -- the Graph
+	sequence -- the number of the last change logged
+	last_snapshot -- the SnapshotTask of the latest snapshot, or None
+	"""
+	def __init__(self, location, sync='batch', batch_size=100, interval=1.0,
+				snapshot_every=None, snapshot_method=None):
+		"""
+		Opens the graph stored in the directory location, creating it if it
+		doesn't exist. A file at location is taken to be a pickled Graph, as
+		saved before there was a log, and is moved to location + '.old' and
+		replaced by a directory holding it as the first snapshot.
+		
+		Keyword arguments:
+		location -- the directory
+		sync -- 'always', 'batch' or 'interval'. Default 'batch'
+		batch_size -- the number of changes between syncs for 'batch'.
+			Default 100
+		interval -- the seconds between syncs for 'interval'. Default 1.0
+		snapshot_every -- start a snapshot in the background after this many
+			changes, or never if None. Default None
+		snapshot_method -- how snapshots are written in the background.
+			'fork' writes from a child process, which sees the graph as it was
+			when forked. 'thread' packs the graph into arrays first, holding up
+			changes meanwhile, then writes them from a thread. Default 'fork'
+			where os.fork() exists, otherwise 'thread'
+		"""
+		if sync not in SYNC_POLICIES:
+			raise GraphError('"{0}" is not a valid sync policy'.format(sync))
+		if snapshot_method is None:
+			snapshot_method = 'fork' if hasattr(os, 'fork') else 'thread'
+		if snapshot_method not in SNAPSHOT_METHODS:
+			raise GraphError('"{0}" is not a valid snapshot method'.format(
+				snapshot_method))
+		self.location = location
+		self.sync = sync
+		self.batch_size = batch_size
+		self.interval = interval
+		self.snapshot_every = snapshot_every
+		self.snapshot_method = snapshot_method
+		self.last_snapshot = None
+		self._lock = threading.RLock()
+		self._unsynced = 0
+		self._since_snapshot = 0
+		self._log = None
+		self._closed = threading.Event()
+		self._open()
+		self.graph.add_listener(self._append)
+		if sync == 'interval':
+			self._syncer = threading.Thread(target=self._sync_periodically,
+											daemon=True)
+			self._syncer.start()
+	
+	def _open(self):
+		if os.path.isfile(self.location):
+			self._import_pickle()
+		os.makedirs(self.location, exist_ok=True)
+		snapshots = self._paths(SNAPSHOT_PREFIX)
+		if snapshots:
+			self.sequence, self.graph = read_snapshot(snapshots[-1])
+		else:
+			self.sequence, self.graph = 0, Graph()
+		self._snapshot_sequence = self.sequence
+		segments = self._paths(LOG_PREFIX)
+		for path in segments:
+			records, end = read_log(path)
+			for sequence, operation, args in records:
+				# records from before the snapshot are left over when a crash
+				# came before the segments holding them were removed
+				if sequence > self.sequence:
+					replay(self.graph, operation, args)
+					self.sequence = sequence
+					self._since_snapshot += 1
+			if end < os.path.getsize(path):
+				with open(path, 'r+b') as f:
+					f.truncate(end)
+		if segments:
+			self._log = open(segments[-1], 'ab')
+		else:
+			self._start_segment()
+	
+	def _import_pickle(self):
+		with open(self.location, 'rb') as f:
+			graph = pickle.load(f)
+		if not isinstance(graph, Graph):
+			raise GraphError('{0} is not a Graph'.format(self.location))
+		old = self.location + '.old'
+		os.replace(self.location, old)
+		os.makedirs(self.location)
+		write_snapshot(graph, self._path(SNAPSHOT_PREFIX, 0), 0)
+	
+	def _path(self, prefix, sequence):
+		# snapshots are numbered so a new one never replaces a file that is
+		# mapped, which Windows doesn't allow
+		return os.path.join(self.location,
+							'{0}{1:020d}'.format(prefix, sequence))
+	
+	def _paths(self, prefix):
+		"""Returns the paths of the snapshots or log segments, oldest first"""
+		return [os.path.join(self.location, name)
+				for name in sorted(os.listdir(self.location))
+				if name.startswith(prefix) and name[-1].isdigit()]
+	
+	def _start_segment(self):
+		"""Closes the log segment being written, if any, and starts the next"""
+		if self._log is not None:
+			self._sync()
+			self._log.close()
+		self._log = open(self._path(LOG_PREFIX, self.sequence + 1), 'ab')
+		_fsync_directory(self.location)
+	
+	def _append(self, operation, *args):
+		"""The Graph listener, logs a change"""
+		with self._lock:
+			if self._log is None:
+				raise GraphError('Storage for {0} is closed'.format(self.location))
+			payload = pickle.dumps((self.sequence + 1, operation, args),
+								pickle.HIGHEST_PROTOCOL)
+			self._log.write(_RECORD_HEADER.pack(len(payload), zlib.crc32(payload)))
+			self._log.write(payload)
+			self.sequence += 1
+			self._unsynced += 1
+			self._since_snapshot += 1
+			if (self.sync == 'always'
+					or self.sync == 'batch' and self._unsynced >= self.batch_size):
+				self._sync()
+			if (self.snapshot_every is not None
+					and self._since_snapshot >= self.snapshot_every):
+				self.snapshot(wait=False)
+	
+	def _sync(self):
+		self._log.flush()
+		os.fsync(self._log.fileno())
+		self._unsynced = 0
+	
+	def _sync_periodically(self):
+		while not self._closed.wait(self.interval):
+			with self._lock:
+				if self._log is not None and self._unsynced:
+					self._sync()
+	
+	def save(self):
+		"""Forces every change logged so far to disk"""
+		with self._lock:
+			if self._log is not None and self._unsynced:
+				self._sync()
+	
+	def snapshot(self, wait=True):
+		"""
+		Writes the whole graph to a new snapshot file in the background, see
+		snapshot_method, and returns its SnapshotTask. Changes can carry on
+		meanwhile, they go to a new log segment. Once the snapshot is written
+		older snapshots and log segments are removed, so opening the storage
+		has less to replay. If a snapshot is already being written that one
+		is returned instead.
+		
+		Keyword arguments:
+		wait -- if True, return once the snapshot is done. Default True
+		"""
+		# the graph's lock comes first, like for changes, which are logged
+		# while it's held, and keeps changes out until the snapshot has its
+		# own copy of the graph
+		with self.graph.reading(), self._lock:
+			task = self.last_snapshot
+			if task is None or task.done():
+				if self._log is None:
+					raise GraphError('Storage for {0} is closed'.format(
+						self.location))
+				task = self._start_snapshot()
+		if wait:
+			task.wait()
+		return task
+	
+	def _start_snapshot(self):
+		self._start_segment()
+		self._since_snapshot = 0
+		task = SnapshotTask(self.sequence,
+							self._path(SNAPSHOT_PREFIX, self.sequence),
+							self.snapshot_method)
+		snapshots = self._paths(SNAPSHOT_PREFIX)
+		if snapshots and self.sequence == self._snapshot_sequence:
+			# nothing changed since the last one
+			task.path = snapshots[-1]
+			task.method = None
+			self._snapshot_written(task)
+		elif task.method == 'fork':
+			pid = self._fork()
+			if pid == 0:
+				# the child writes the graph as it is now and leaves without
+				# running any of the parent's cleanup
+				status = 0
+				try:
+					write_snapshot(self.graph, task.path, task.sequence)
+				except BaseException:
+					traceback.print_exc()
+					status = 1
+				finally:
+					os._exit(status)
+			threading.Thread(target=self._wait_for_child, args=(task, pid),
+							daemon=True).start()
+		else:
+			sections = _snapshot_sections(self.graph, task.sequence)
+			threading.Thread(target=self._write_in_thread,
+							args=(task, sections), daemon=True).start()
+		# only once it's running, close() waits for it
+		self.last_snapshot = task
+		return task
+	
+	def _fork(self):
+		"""
+		Returns os.fork(), forking while no other thread is reading in part of
+		a memory mapped graph: the child would get the reader's lock held by
+		a thread it doesn't have, and wait for it forever
+		"""
+		reader = self.graph._snapshot
+		if reader is None:
+			return os.fork()
+		with reader._lock:
+			return os.fork()
+	
+	def _wait_for_child(self, task, pid):
+		status = os.waitpid(pid, 0)[1]
+		if status == 0:
+			self._snapshot_written(task)
+		else:
+			task._finish('snapshot process exited with status {0}'.format(
+				status))
+	
+	def _write_in_thread(self, task, sections):
+		try:
+			_write_sections(task.path, sections)
+		except Exception as e:
+			task._finish(repr(e))
+		else:
+			self._snapshot_written(task)
+	
+	def _snapshot_written(self, task):
+		"""Removes the snapshots and log segments task made unnecessary"""
+		with self._lock:
+			self._snapshot_sequence = task.sequence
+			for path in self._paths(SNAPSHOT_PREFIX):
+				if path < task.path:
+					try:
+						os.remove(path)
+					except OSError:
+						# still mapped on Windows, the next snapshot will
+						# remove it
+						pass
+			for path in self._paths(LOG_PREFIX):
+				if path <= self._path(LOG_PREFIX, task.sequence):
+					os.remove(path)
+		task._finish()
+	
+	def close(self):
+		"""Waits for any snapshot, saves, and stops logging changes"""
+		if self.last_snapshot is not None:
+			self.last_snapshot.wait()
+		with self._lock:
+			if self._log is None:
+				return
+			self.save()
+			self.graph.remove_listener(self._append)
+			self._log.close()
+			self._log = None
+		self._closed.set()
+	
+	def __enter__(self):
+		return self
+	
+	def __exit__(self, *exc_info):
+		self.close()
+
+
+# servers give every connection its own handler, so the databases they serve
+# are kept here to be shared between them: each location is loaded once
+# however many connections use it, and closed once the last of them is done
+# with it.
+# syntax: eg. _databases['/path/to/db.gd'] == [GraphStorage, connections]
+_databases = {}
+_databases_lock = threading.Lock()
+
+def open_database(location):
+	"""
+	Returns the GraphStorage for location, loading it the first time, and
+	counts one more connection using it. Every call is matched by a call to
+	close_database().
+	"""
+	location = os.path.abspath(location)
+	with _databases_lock:
+		if location not in _databases:
+			_databases[location] = [GraphStorage(location), 0]
+		_databases[location][1] += 1
+		return _databases[location][0]
+
+def close_database(location):
+	"""
+	Counts one less connection using the database at location, and closes it
+	once none are
+	"""
+	location = os.path.abspath(location)
+	with _databases_lock:
+		if location not in _databases:
+			raise GraphError('{0} is not open'.format(location))
+		_databases[location][1] -= 1
+		if _databases[location][1] > 0:
+			return
+		storage = _databases.pop(location)[0]
+	storage.close()
+
+def open_databases():
+	"""Returns a dict mapping open locations to their number of connections"""
+	with _databases_lock:
+		return dict((location, connections)
+					for location, (_, connections) in _databases.items())
\ No newline at end of file
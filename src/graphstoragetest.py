@@ -0,0 +1,244 @@
+from graph import Graph, GraphError
+from graphstorage import GraphStorage, read_snapshot, write_snapshot
+import os
+import pickle
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+
+class TestGraphStorage(unittest.TestCase):
+	def setUp(self):
+		self.directory = tempfile.mkdtemp()
+		self.location = os.path.join(self.directory, 'test.gdb')
+	
+	def tearDown(self):
+		shutil.rmtree(self.directory)
+	
+	def files(self):
+		return sorted(os.listdir(self.location))
+	
+	def fill(self, g):
+		g.create_index('node', 'name', unique=True)
+		jack = g.add_node(name='jack')
+		jill = g.add_node(name='jill')
+		hill = g.add_node(name='hill')
+		g.add_edge(jack, 'climbs', hill, times=1)
+		fell = g.add_edge(jack, 'knows', jill)
+		fell.label = 'loves'
+		jack.age = 30
+		g.bulk_add_nodes([{'name': 'pail'}, {'name': 'water'}])
+		g.bulk_add_edges([(jill.id, 'fetches', 5)])
+		g.remove_node(hill.id)
+		g.add_node(name='crown')
+	
+	def assertSameGraph(self, a, b):
+		self.assertEqual(a._nextid, b._nextid)
+		self.assertEqual({id: node.properties for id, node in a._nodes.items()},
+						{id: node.properties for id, node in b._nodes.items()})
+		self.assertEqual({id: (edge.start_node.id, edge.label, edge.end_node.id,
+							edge.properties) for id, edge in a._edges.items()},
+						{id: (edge.start_node.id, edge.label, edge.end_node.id,
+							edge.properties) for id, edge in b._edges.items()})
+		self.assertEqual(a.edge_label_counts(), b.edge_label_counts())
+	
+	def test_replay(self):
+		expected = Graph()
+		self.fill(expected)
+		storage = GraphStorage(self.location, sync='always')
+		self.fill(storage.graph)
+		self.assertEqual(storage.sequence, 12)
+		# closing without a snapshot leaves everything in the log
+		storage.close()
+		self.assertEqual(self.files(), ['log-00000000000000000001'])
+		
+		storage = GraphStorage(self.location)
+		self.assertSameGraph(storage.graph, expected)
+		self.assertEqual(storage.graph.node(name='jill').id, 1)
+		self.assertRaises(GraphError, storage.graph.add_node, name='jack')
+		self.assertEqual(storage.graph.node(0).age, 30)
+		storage.close()
+	
+	def test_snapshot(self):
+		expected = Graph()
+		self.fill(expected)
+		with GraphStorage(self.location, snapshot_every=5) as storage:
+			self.fill(storage.graph)
+		# taken after 5 changes, and after 10 unless the first was still going
+		self.assertIn(self.files()[-1], ['snapshot-00000000000000000005',
+										'snapshot-00000000000000000010'])
+		with GraphStorage(self.location) as storage:
+			self.assertSameGraph(storage.graph, expected)
+			task = storage.snapshot()
+			self.assertEqual(task.sequence, 12)
+			self.assertIsNone(task.error)
+			self.assertEqual(task.size, os.path.getsize(task.path))
+			self.assertEqual(self.files(), ['log-00000000000000000013',
+											'snapshot-00000000000000000012'])
+			self.assertEqual(storage.snapshot().path, task.path)
+			storage.graph.add_node(name='queen')
+		with GraphStorage(self.location) as storage:
+			self.assertEqual(storage.graph.node(name='queen').id, expected._nextid)
+	
+	def test_snapshot_empty(self):
+		# nothing has changed, but there is no snapshot to fall back on yet
+		with GraphStorage(self.location) as storage:
+			task = storage.snapshot()
+			self.assertIsNone(task.error)
+			self.assertIs(storage.last_snapshot, task)
+		self.assertEqual(self.files(), ['log-00000000000000000001',
+										'snapshot-00000000000000000000'])
+		with GraphStorage(self.location) as storage:
+			self.assertEqual(len(storage.graph.nodes()), 0)
+	
+	def test_remove(self):
+		expected = Graph()
+		self.fill(expected)
+		with GraphStorage(self.location) as storage:
+			self.fill(storage.graph)
+			storage.snapshot()
+		storage = GraphStorage(self.location)
+		# the second graph's adjacency is read in from the snapshot
+		for g in (expected, storage.graph):
+			g.add_edge(g.node(name='jill'), 'knows', g.node(name='jill'))
+			g.remove_edges(None, times=1)
+			g.remove_nodes(name='water')
+			g.remove_node(g.node(name='jill').id)
+		storage.close()
+		with GraphStorage(self.location) as storage:
+			self.assertSameGraph(storage.graph, expected)
+	
+	def test_torn_log(self):
+		with GraphStorage(self.location, sync='always') as storage:
+			storage.graph.add_node(name='jack')
+			storage.graph.add_node(name='jill')
+		log = os.path.join(self.location, self.files()[0])
+		size = os.path.getsize(log)
+		with open(log, 'r+b') as f:
+			f.truncate(size - 3)
+		with GraphStorage(self.location) as storage:
+			self.assertEqual(len(storage.graph.nodes()), 1)
+			storage.graph.add_node(name='hill')
+		with GraphStorage(self.location) as storage:
+			self.assertEqual([node.name for node in storage.graph.nodes()],
+							['jack', 'hill'])
+	
+	def check_background_snapshot(self, method):
+		expected = Graph()
+		self.fill(expected)
+		storage = GraphStorage(self.location, snapshot_method=method)
+		self.fill(storage.graph)
+		task = storage.snapshot(wait=False)
+		self.assertEqual(task.method, method)
+		# changes carry on while the snapshot is written, into a new segment
+		storage.graph.add_node(name='queen')
+		expected.add_node(name='queen')
+		self.assertTrue(task.wait(10))
+		metrics = task.metrics()
+		self.assertEqual(metrics['sequence'], 12)
+		self.assertIsNone(metrics['error'])
+		self.assertTrue(metrics['done'])
+		self.assertTrue(0 < metrics['size'] == metrics['bytes_written'])
+		self.assertTrue(0 <= metrics['duration'])
+		self.assertEqual(self.files(), ['log-00000000000000000013',
+										'snapshot-00000000000000000012'])
+		storage.close()
+		
+		with GraphStorage(self.location) as storage:
+			self.assertSameGraph(storage.graph, expected)
+			self.assertEqual(storage.sequence, 13)
+	
+	@unittest.skipUnless(hasattr(os, 'fork'), 'needs os.fork()')
+	def test_snapshot_fork(self):
+		self.check_background_snapshot('fork')
+	
+	@unittest.skipUnless(hasattr(os, 'fork'), 'needs os.fork()')
+	def test_snapshot_fork_reading_in(self):
+		with GraphStorage(self.location) as storage:
+			self.fill(storage.graph)
+			storage.snapshot()
+		storage = GraphStorage(self.location, snapshot_method='fork')
+		storage.graph.add_node(name='queen')
+		reader = storage.graph._snapshot
+		held = threading.Event()
+		def read_in():
+			# like a thread part way through reading in an element
+			with reader._lock:
+				held.set()
+				time.sleep(0.2)
+		thread = threading.Thread(target=read_in)
+		thread.start()
+		held.wait()
+		task = storage.snapshot(wait=False)
+		self.assertTrue(task.wait(10))
+		self.assertIsNone(task.error)
+		thread.join()
+		storage.close()
+		with GraphStorage(self.location) as storage:
+			self.assertEqual(storage.graph.node(name='queen').id, 9)
+	
+	def test_snapshot_thread(self):
+		self.check_background_snapshot('thread')
+	
+	def test_snapshot_format(self):
+		g = Graph()
+		self.fill(g)
+		g.add_edge(g.node(8), 'climbs', g.node(8))
+		path = os.path.join(self.directory, 'snapshot')
+		write_snapshot(g, path, 7)
+		sequence, loaded = read_snapshot(path)
+		self.assertEqual(sequence, 7)
+		# nothing is read in until it's used
+		self.assertEqual(len(loaded._nodes._read_in), 0)
+		self.assertEqual(len(loaded._nodes), len(g._nodes))
+		self.assertEqual(list(loaded._edges), list(g._edges))
+		jack = loaded.node(0)
+		self.assertEqual(len(loaded._nodes._read_in), 1)
+		self.assertEqual([(label, [edge.id for edge in outgoing],
+							[edge.id for edge in incoming])
+						for label, (outgoing, incoming) in jack._edges.items()],
+						[(label, [edge.id for edge in outgoing],
+							[edge.id for edge in incoming])
+						for label, (outgoing, incoming) in g.node(0)._edges.items()])
+		self.assertSameGraph(loaded, g)
+		self.assertIs(loaded.node(name='jill'), loaded.node(1))
+		self.assertEqual(loaded.shortest_path(jack, loaded.node(5)),
+						[jack, loaded.node(1), loaded.node(5)])
+		
+		# changes after reading
+		jill = loaded.node(1)
+		loaded.add_edge(jill, 'knows', loaded.node(6))
+		self.assertEqual(len(jill.edges('knows', 'outgoing')), 1)
+		self.assertRaises(GraphError, setattr, jill, 'name', 'jack')
+		jill.name = 'gill'
+		self.assertEqual(loaded.node(name='gill'), jill)
+		loaded.remove_node(jack.id)
+		self.assertNotIn(jack.id, loaded._nodes)
+		self.assertEqual(loaded.node(jack.id), None)
+		queen = loaded.add_node(name='queen')
+		self.assertEqual(queen.id, g._nextid + 1)
+		self.assertEqual(list(loaded._nodes)[-1], queen.id)
+		
+		copy = pickle.loads(pickle.dumps(loaded))
+		self.assertIsNone(copy._snapshot)
+		self.assertSameGraph(copy, loaded)
+		write_snapshot(loaded, path + '2', 8)
+		self.assertSameGraph(read_snapshot(path + '2')[1], loaded)
+		
+		with open(path, 'r+b') as f:
+			f.write(b'NOTASNAP')
+		self.assertRaises(GraphError, read_snapshot, path)
+	
+	def test_import_pickle(self):
+		g = Graph()
+		self.fill(g)
+		with open(self.location, 'wb') as f:
+			pickle.dump(g, f)
+		with GraphStorage(self.location) as storage:
+			self.assertSameGraph(storage.graph, g)
+		self.assertTrue(os.path.isfile(self.location + '.old'))
+		self.assertRaises(GraphError, GraphStorage, self.location, sync='never')
+
+if __name__ == '__main__':
+	unittest.main()
@@ -1,4 +1,8 @@
-from graph import Node, Edge, Graph, ElementList
+from graph import Node, Edge, Graph, ElementList, GraphError, ReadWriteLock
+from graph import Eq, In, Range, Prefix, Where, Not, Degree, filter
+import graph
+import pickle
+import threading
 import unittest
 
 class TestGraph(unittest.TestCase):
@@ -43,6 +47,20 @@ class TestGraph(unittest.TestCase):
 		self.assertTrue(set([e0]) == set(jack.edges('loves', intensity=100)))
 		self.assertTrue(set([]) == set(jack.edges('loves', properties={'ferocity':99}, intensity=100)))
 	
+	def test_Node_slots(self):
+		g = Graph()
+		jack = g.add_node(name='jack')
+		jill = g.add_node(name='jill')
+		g.add_edge(jack, 'loves', jill, intensity=100)
+		self.assertFalse(hasattr(jack, '__dict__'))
+		self.assertFalse(hasattr(jack, 'age'))
+		self.assertIsNone(getattr(jack.edges()[0], 'blindness', None))
+		copy = pickle.loads(pickle.dumps(g))
+		jack_copy = copy.node(name='jack')
+		self.assertEqual(jack_copy.adjacent_node('loves').name, 'jill')
+		self.assertEqual(jack_copy.edges()[0].intensity, 100)
+		self.assertTrue(jack_copy._graph is copy)
+	
 	def test_Edge_init(self):
 		jack = Node(0)
 		jill = Node(1)
@@ -128,6 +146,60 @@ class TestGraph(unittest.TestCase):
 		self.assertTrue(len(g._edges) == 0)
 		self.assertEqual(jill, g._nodes[1])
 	
+	def test_Graph_remove_edge_siblings(self):
+		g = Graph()
+		jack = g.add_node()
+		jill = g.add_node()
+		edges = [g.add_edge(jack, 'knows', jill) for _ in range(4)]
+		loop = g.add_edge(jack, 'knows', jack)
+		g.remove_edge(edges[1].id)
+		self.assertEqual(set(jack.edges('knows', 'outgoing')),
+						set(edges[:1] + edges[2:] + [loop]))
+		self.assertEqual(set(jill.edges('knows', 'incoming')),
+						set(edges[:1] + edges[2:]))
+		g.remove_edge(loop.id)
+		g.remove_edge(edges[0].id)
+		edges[2].label = 'loves'
+		self.assertEqual(jack.edges('knows'), [edges[3]])
+		self.assertEqual(jill.edges('loves'), [edges[2]])
+		copy = pickle.loads(pickle.dumps(g))
+		copy.remove_edge(edges[3].id)
+		self.assertEqual(copy.node(0)._edges.keys(), {'loves'})
+		# a node with a self loop
+		g.add_edge(jill, 'knows', jill)
+		g.remove_node(jill.id)
+		self.assertEqual(jack._edges, {})
+		self.assertEqual(len(g._edges), 0)
+		self.assertEqual(g.edge_label_counts(), {})
+	
+	def test_Graph_remove_nodes(self):
+		g = Graph()
+		g.create_index('node', 'type')
+		replay = g.add_node(type='replay')
+		comments = g.bulk_add_nodes([{'type': 'comment', 'stale': i % 2 == 0}
+									for i in range(10)])
+		g.bulk_add_edges([(replay.id, 'has', id) for id in comments])
+		g.bulk_add_edges([(comments[0], 'replies', comments[1])])
+		self.assertEqual(g.remove_nodes(type='comment', stale=True), 5)
+		self.assertEqual(len(g._nodes), 6)
+		self.assertEqual(sorted(node.id for node in replay.adjacent_nodes('has')),
+						comments[1::2])
+		self.assertEqual(g.edge_label_counts(), {'has': 5})
+		self.assertEqual(g.nodes(stale=True), [])
+		self.assertEqual(g.remove_nodes({'type': 'user'}), 0)
+	
+	def test_Graph_remove_edges(self):
+		g = Graph()
+		jack = g.add_node()
+		jill = g.add_node()
+		ids = g.bulk_add_edges([(jack.id, 'knows', jill.id, {'weight': i})
+								for i in range(6)])
+		self.assertEqual(g.remove_edges(ids[:3] + [ids[0], 100]), 3)
+		self.assertEqual(g.remove_edges(None, Range('weight', 4, 5)), 2)
+		self.assertEqual(g.remove_edges(ids, weight=0), 0)
+		self.assertEqual([edge.id for edge in jill.edges()], [ids[3]])
+		self.assertEqual(g.edge_count('knows'), 1)
+	
 	def test_Graph_find_reachable_by(self):
 		g = Graph()
 		
@@ -155,6 +227,174 @@ class TestGraph(unittest.TestCase):
 		iterator = g.find_reachable_nodes_from(a, contains='incoming')
 		self.assertEqual([f,e,b,c], list(iterator))
 		
+	def test_BreadthFirstTraverser(self):
+		g = Graph()
+		a = g.add_node(name='a')
+		b = g.add_node(name='b')
+		c = g.add_node(name='c')
+		d = g.add_node(name='d')
+		e = g.add_node(name='e')
+		g.add_edge(a, 'contains', b)
+		g.add_edge(a, 'contains', c)
+		g.add_edge(b, 'contains', d)
+		g.add_edge(d, 'contains', e)
+		g.add_edge(e, 'knows', a)
+		
+		self.assertEqual([b, c], list(g.find_reachable_nodes_from(a, max_depth=1)))
+		self.assertEqual([b, c, d], list(g.find_reachable_nodes_from(a, limit=3)))
+		no_b = lambda node: node.name != 'b'
+		self.assertEqual([c], list(g.find_reachable_nodes_from(a, predicate=no_b)))
+		self.assertEqual([e, a, b, c],
+						list(g.find_reachable_nodes_from(d, contains='outgoing',
+														knows='any')))
+		
+		iterator = g.find_reachable_nodes_from(a, limit=2)
+		self.assertEqual((iterator.current_node, iterator.depth), (a, 0))
+		self.assertEqual(next(iterator), b)
+		self.assertEqual((iterator.current_node, iterator.depth), (c, 1))
+		self.assertEqual(next(iterator), c)
+		self.assertEqual((iterator.current_node, iterator.depth), (None, -1))
+		self.assertRaises(StopIteration, next, iterator)
+		self.assertRaises(GraphError, g.find_reachable_nodes_from, a,
+						contains='sideways')
+	
+	def test_Graph_compact(self):
+		g = Graph()
+		a, b, c, d, e = [g.add_node() for _ in range(5)]
+		g.add_edge(a, 'contains', b)
+		g.add_edge(a, 'contains', c)
+		g.add_edge(b, 'knows', d)
+		g.add_edge(d, 'contains', a)
+		adjacency = g.compact()
+		self.assertEqual(list(adjacency.csrs[('contains', 0)][0]),
+						[0, 2, 2, 2, 3, 3])
+		self.assertEqual(list(adjacency.csrs[('contains', 0)][1]), [1, 2, 0])
+		self.assertEqual(list(g.find_reachable_nodes_from(a)), [b, c, d])
+		self.assertEqual(list(g.find_reachable_nodes_from(a, contains='any')),
+						[b, c, d])
+		self.assertEqual(a.adjacent_nodes('contains', 'any'), [b, c, d])
+		self.assertEqual(d.adjacent_nodes(direction='incoming'), [b])
+		
+		# changes are seen straight away, and folded in by the next compact
+		g.add_edge(c, 'knows', e)
+		self.assertTrue(g._compacted is adjacency)
+		self.assertEqual(list(g.find_reachable_nodes_from(a)), [b, c, d, e])
+		g.compact()
+		self.assertEqual(list(g.find_reachable_nodes_from(a)), [b, c, d, e])
+		self.assertEqual(e.adjacent_nodes(direction='incoming'), [c])
+		g.remove_node(e.id)
+		self.assertEqual(list(g.find_reachable_nodes_from(a)), [b, c, d])
+		g.compact()
+		self.assertEqual(list(g.find_reachable_nodes_from(a, max_depth=1)),
+						[b, c])
+		self.assertEqual(pickle.loads(pickle.dumps(g))._compacted, None)
+	
+	def test_Graph_shortest_path(self):
+		g = Graph()
+		a, b, c, d, e, f = [g.add_node() for _ in range(6)]
+		g.add_edge(a, 'knows', b)
+		g.add_edge(b, 'knows', c)
+		g.add_edge(c, 'knows', d)
+		g.add_edge(a, 'knows', e)
+		g.add_edge(e, 'knows', d)
+		g.add_edge(f, 'hates', a)
+		self.assertEqual(g.shortest_path(a, d), [a, e, d])
+		self.assertEqual(g.shortest_path(a, a), [a])
+		self.assertEqual(g.shortest_path(d, a), None)
+		self.assertEqual(g.shortest_path(d, a, knows='incoming'), [d, e, a])
+		self.assertEqual(g.shortest_path(f, d, knows='outgoing'), None)
+		self.assertEqual(g.shortest_path(f, d, knows='outgoing', hates='any'),
+						[f, a, e, d])
+		self.assertEqual(g.shortest_path(b, e, knows='any'), [b, a, e])
+	
+	def test_Graph_weighted_shortest_path(self):
+		g = Graph()
+		a, b, c, d = [g.add_node(x=x) for x in range(4)]
+		g.add_edge(a, 'road', b, weight=1)
+		g.add_edge(b, 'road', c, weight=1)
+		g.add_edge(a, 'road', c, weight=5)
+		g.add_edge(c, 'road', d, length=2)
+		self.assertEqual(g.weighted_shortest_path(a, c), (2, [a, b, c]))
+		self.assertEqual(g.weighted_shortest_path(a, d), (3, [a, b, c, d]))
+		self.assertEqual(g.weighted_shortest_path(a, d, weight='length'),
+						(3, [a, c, d]))
+		self.assertEqual(g.weighted_shortest_path(d, a), None)
+		self.assertEqual(g.weighted_shortest_path(d, a, road='incoming'),
+						(3, [d, c, b, a]))
+		heuristic = lambda node, end_node: abs(end_node.x - node.x) * 0.5
+		self.assertEqual(g.weighted_shortest_path(a, d, heuristic=heuristic),
+						(3, [a, b, c, d]))
+		g.add_edge(d, 'road', a, weight=-1)
+		self.assertRaises(GraphError, g.weighted_shortest_path, d, c)
+	
+	def test_Predicate(self):
+		jack = Node(0, name='jack', age=21)
+		jill = Node(1, name='jill', age=25)
+		jon = Node(2, name='jon', age='old')
+		bob = Node(3, name='bob')
+		nodes = [jack, jill, jon, bob]
+		self.assertEqual(filter(nodes, Eq('age', 21)), [jack])
+		self.assertEqual(filter(nodes, In('name', ['jill', 'bob'])), [jill, bob])
+		self.assertEqual(filter(nodes, Range('age', 21, 25)), [jack, jill])
+		self.assertEqual(filter(nodes, Range('age', 21, 25, include_low=False)),
+						[jill])
+		self.assertEqual(filter(nodes, Range('age', high=22)), [jack])
+		self.assertEqual(filter(nodes, Prefix('name', 'j')), [jack, jill, jon])
+		self.assertEqual(filter(nodes, Where('age', lambda a: a == 'old')), [jon])
+		self.assertEqual(filter(nodes, Prefix('name', 'j') & ~Eq('age', 21)),
+						[jill, jon])
+		self.assertEqual(filter(nodes, Eq('age', 21) | Eq('name', 'bob')),
+						[jack, bob])
+		self.assertEqual(filter(nodes, Not(Prefix('name', 'j')), name='bob'),
+						[bob])
+		self.assertEqual(ElementList(nodes).filter_by_property(In('age', [[], 25])),
+						[jill])
+	
+	def test_Predicate_indexes(self):
+		g = Graph()
+		g.create_index('node', 'type')
+		a = g.add_node(type='user', age=30)
+		b = g.add_node(type='replay')
+		c = g.add_node(type='user', age=40)
+		d = g.add_node(type='comment')
+		self.assertEqual(g.nodes(Eq('type', 'user') & Range('age', 35)), [c])
+		self.assertEqual(g.nodes(In('type', ['comment', 'replay'])), [d, b])
+		self.assertEqual(g.nodes(Eq('type', 'replay') | Eq('type', 'user')),
+						[b, a, c])
+		self.assertEqual(g.nodes(~Eq('type', 'user')), [b, d])
+		self.assertEqual(g.node(a.id, Range('age', 35)), None)
+		self.assertEqual(g.node(c.id, Range('age', 35)), c)
+	
+	def test_ElementIterator(self):
+		g = Graph()
+		jack = g.add_node(type='user', name='jack')
+		jill = g.add_node(type='user', name='jill')
+		replay = g.add_node(type='replay')
+		g.add_edge(jack, 'owns', replay)
+		g.add_edge(jill, 'owns', replay, shared=True)
+		self.assertEqual(g.iter_nodes(type='user').list(), ElementList([jack, jill]))
+		self.assertEqual(g.iter_nodes(type='user').first(), jack)
+		self.assertEqual(g.iter_nodes(type='nobody').first(), None)
+		self.assertEqual(g.iter_nodes().limit(2).list(), [jack, jill])
+		self.assertEqual(g.iter_nodes().count(), 3)
+		self.assertEqual(g.iter_nodes().filter_by_property(name='jill').list(),
+						[jill])
+		self.assertEqual(g.iter_edges('owns', shared=True).count(), 1)
+		self.assertEqual(replay.iter_edges('owns', 'incoming').count(), 2)
+		self.assertEqual(replay.iter_adjacent_nodes('owns', 'any').list(),
+						[jack, jill])
+		self.assertEqual(replay.adjacent_node('owns', 'incoming', name='jill'),
+						jill)
+		
+		# consuming the first match doesn't touch the remaining nodes
+		visited = []
+		def spy(value):
+			visited.append(value)
+			return True
+		self.assertEqual(g.iter_nodes(Where('type', spy)).first(), jack)
+		self.assertEqual(visited, ['user'])
+		self.assertRaises(GraphError, jack.edges, 'owns', 'sideways')
+	
 	def test_Graph_node(self):
 		g = Graph()
 		a = g.add_node()
@@ -193,6 +433,121 @@ class TestGraph(unittest.TestCase):
 		self.assertEqual(g.edges('dead'), ElementList())
 		self.assertEqual(g.edges(intensity=100), ElementList([loves]))
 		
+	def test_Graph_create_index(self):
+		g = Graph()
+		a = g.add_node(type='user', username='jack')
+		b = g.add_node(type='replay')
+		g.create_index('node', 'type')
+		g.create_index('node', 'username', unique=True)
+		c = g.add_node(type='user', username='jill')
+		self.assertEqual(g.nodes(type='user'), ElementList([a, c]))
+		self.assertEqual(g.node(username='jill'), c)
+		self.assertEqual(g.node(type='user', username='nobody'), None)
+		self.assertRaises(GraphError, g.add_node, username='jack')
+		self.assertEqual(len(g._nodes), 3)
+		self.assertRaises(GraphError, g.create_index, 'node', 'type')
+		
+		b.type = 'user'
+		self.assertEqual(g.nodes(type='user'), ElementList([a, c, b]))
+		self.assertEqual(g.nodes(type='replay'), ElementList())
+		self.assertRaises(GraphError, setattr, b, 'username', 'jill')
+		self.assertTrue('username' not in b.properties)
+		
+		g.remove_node(a.id)
+		self.assertEqual(g.nodes(type='user'), ElementList([c, b]))
+		self.assertEqual(g.node(username='jack'), None)
+		g.add_node(username='jack')
+		
+		g.drop_index('node', 'type')
+		self.assertEqual(g.nodes(type='user'), ElementList([b, c]))
+		self.assertRaises(GraphError, g.drop_index, 'node', 'type')
+	
+	def test_Graph_create_index_edges(self):
+		g = Graph()
+		jack = g.add_node()
+		jill = g.add_node()
+		g.create_index('edge', 'intensity')
+		loves = g.add_edge(jack, 'loves', jill, intensity=100)
+		kills = g.add_edge(jack, 'kills', jill, intensity=5)
+		self.assertEqual(g.edges(intensity=100), ElementList([loves]))
+		self.assertEqual(g.edges('kills', intensity=100), ElementList())
+		self.assertEqual(g.edge(label='kills', intensity=5), kills)
+		kills.intensity = 100
+		self.assertEqual(g.edges(intensity=100), ElementList([loves, kills]))
+		g.remove_edge(kills.id)
+		self.assertEqual(g.edges(intensity=100), ElementList([loves]))
+	
+	def test_Graph_edge_count(self):
+		g = Graph()
+		jack = g.add_node()
+		jill = g.add_node()
+		self.assertEqual(g.edge_count(), 0)
+		self.assertEqual(g.edge_count('loves'), 0)
+		loves = g.add_edge(jack, 'loves', jill)
+		g.add_edge(jill, 'loves', jack)
+		kills = g.add_edge(jack, 'kills', jill)
+		self.assertEqual(g.edge_count(), 3)
+		self.assertEqual(g.edge_count('loves'), 2)
+		self.assertEqual(g.edge_label_counts(), {'loves': 2, 'kills': 1})
+		g.remove_edge(kills.id)
+		self.assertEqual(g.edge_label_counts(), {'loves': 2})
+		
+		loves.label = 'hates'
+		self.assertEqual(g.edge_label_counts(), {'loves': 1, 'hates': 1})
+		self.assertEqual(g.edges('hates'), ElementList([loves]))
+		self.assertEqual(g.edge(label='hates'), loves)
+		self.assertEqual(jack.edges('hates', 'outgoing'), ElementList([loves]))
+		self.assertEqual(jill.edges('hates', 'incoming'), ElementList([loves]))
+		self.assertEqual(jack.edges('loves', 'outgoing'), ElementList())
+	
+	def test_Graph_bulk_add(self):
+		g = Graph()
+		g.create_index('node', 'name', unique=True)
+		ids = g.bulk_add_nodes(({'name': str(i)} for i in range(5)), batch_size=2)
+		self.assertEqual(ids, [0, 1, 2, 3, 4])
+		self.assertEqual(g.node(name='3').id, 3)
+		edge_ids = g.bulk_add_edges([(0, 'knows', 1), (1, 'knows', 2, {'since': 1}),
+									(2, 'likes', 0, None)], batch_size=2)
+		self.assertEqual(edge_ids, [5, 6, 7])
+		self.assertEqual(g.edge_label_counts(), {'knows': 2, 'likes': 1})
+		self.assertEqual(g.node(0).adjacent_node('knows', 'outgoing'), g.node(1))
+		self.assertEqual(g.edge(6).since, 1)
+		self.assertEqual(g.add_node().id, 8)
+		
+		# a bad batch adds nothing, earlier batches stay
+		self.assertRaises(GraphError, g.bulk_add_nodes,
+						[{'name': 'a'}, {'name': 'b'}, {'name': 'c'}, {'name': '1'}],
+						batch_size=2)
+		self.assertEqual(len(g.nodes(name='a')), 1)
+		self.assertEqual(len(g.nodes(name='c')), 0)
+		self.assertRaises(GraphError, g.bulk_add_edges, [(0, 'knows', 100)])
+		self.assertEqual(g.edge_count(), 3)
+	
+	def test_Graph_add_listener(self):
+		g = Graph()
+		changes = []
+		# properties are passed live, so keep a copy
+		listener = lambda *change: changes.append(pickle.loads(pickle.dumps(change)))
+		g.add_listener(listener)
+		jack = g.add_node(name='jack')
+		jill = g.add_node()
+		knows = g.add_edge(jack, 'knows', jill, since=2001)
+		jill.name = 'jill'
+		knows.label = 'loves'
+		g.remove_edge(knows.id)
+		g.remove_node(jill.id)
+		self.assertEqual(changes, [('add_node', 0, {'name': 'jack'}),
+								('add_node', 1, {}),
+								('add_edge', 2, 0, 'knows', 1, {'since': 2001}),
+								('set_property', 'node', 1, 'name', 'jill'),
+								('relabel_edge', 2, 'loves'),
+								('remove_edge', 2),
+								('remove_node', 1)])
+		g.remove_listener(listener)
+		g.add_node()
+		self.assertEqual(len(changes), 7)
+		self.assertEqual(pickle.loads(pickle.dumps(g))._listeners, [])
+	
 	def test_Node_adjacent_nodes(self):
 		g = Graph()
 		jack = g.add_node()
@@ -200,6 +555,122 @@ class TestGraph(unittest.TestCase):
 		g.add_edge(jack, 'loves', jill)
 		self.assertEqual(jack.adjacent_nodes(name="jill")[0], jill)
 		self.assertEqual(jack.adjacent_node(name="jill"), jill)
+	
+	def test_Graph_reachable_from_many(self):
+		g = Graph()
+		nodes = [g.add_node() for _ in range(8)]
+		for i in range(7):
+			g.add_edge(nodes[i], 'next', nodes[i + 1])
+			g.add_edge(nodes[i], 'skip', nodes[(i + 3) % 8])
+		found = g.reachable_from_many(nodes[:5], processes=2, next='outgoing',
+									skip='incoming')
+		self.assertEqual(list(found), [node.id for node in nodes[:5]])
+		for node in nodes[:5]:
+			self.assertEqual(found[node.id], [n.id for n in g.find_reachable_nodes_from(
+				node, next='outgoing', skip='incoming')])
+		# searching in this process leaves alone the CSRs pool processes
+		# share, which threads searching at once would overwrite
+		graph._share_adjacency('ids', 'csrs')
+		try:
+			self.assertEqual(g.reachable_from_many([0], processes=1, max_depth=2),
+							{0: [1, 3, 2, 4, 6]})
+			self.assertEqual((graph._shared_ids, graph._shared_csrs),
+							('ids', 'csrs'))
+		finally:
+			graph._share_adjacency(None, None)
+		self.assertEqual(g.reachable_from_many([0], limit=1), {0: [1]})
+		# a change since compact() is seen
+		g.add_edge(nodes[7], 'next', nodes[0])
+		self.assertEqual(g.reachable_from_many([nodes[7]], next='outgoing')[7],
+						[0, 1, 2, 3, 4, 5, 6])
+		self.assertRaises(GraphError, g.reachable_from_many, [99])
+	
+	def test_Graph_aggregate(self):
+		g = Graph()
+		jack = g.add_node(type='user')
+		jill = g.add_node(type='user')
+		replays = [g.add_node(type='replay', champion=champion, length=length)
+				for champion, length in [('Ahri', 10), ('Zed', 20), ('Ahri', 30)]]
+		g.add_node(name='hill')
+		for replay in replays:
+			g.add_edge(jack, 'owns', replay, views=replay.length)
+		g.add_edge(jill, 'knows', jack)
+		lengths = {'replays': ('count', None), 'total': ('sum', 'length'),
+				'shortest': ('min', 'length'), 'longest': ('max', 'length'),
+				'average': ('avg', 'length')}
+		self.assertEqual(g.aggregate(lengths, 'champion', type='replay'),
+						{'Ahri': {'replays': 2, 'total': 40, 'shortest': 10,
+								'longest': 30, 'average': 20},
+						'Zed': {'replays': 1, 'total': 20, 'shortest': 20,
+								'longest': 20, 'average': 20}})
+		self.assertEqual(g.aggregate(lengths, type='user'),
+						{'replays': 2, 'total': 0, 'shortest': None,
+						'longest': None, 'average': None})
+		self.assertEqual(g.aggregate(group_by='type'),
+						{'user': {'count': 2}, 'replay': {'count': 3},
+						None: {'count': 1}})
+		# the same read from an index
+		g.create_index('node', 'type')
+		self.assertEqual(g.aggregate(group_by='type'),
+						{'user': {'count': 2}, 'replay': {'count': 3},
+						None: {'count': 1}})
+		self.assertEqual(g.aggregate({'owned': ('avg', Degree('owns')),
+									'known': ('max', Degree('knows', 'any'))},
+									type='user'),
+						{'owned': 1.5, 'known': 1})
+		self.assertEqual(g.aggregate(group_by=Degree('owns'), type='user'),
+						{3: {'count': 1}, 0: {'count': 1}})
+		self.assertEqual(g.aggregate({'views': ('sum', 'views')}, None, 'edge',
+									'owns'), {'views': 60})
+		self.assertEqual(g.aggregate(element_type='edge', label='knows'),
+						{'count': 1})
+		self.assertRaises(GraphError, g.aggregate, {'x': ('median', 'length')})
+		self.assertRaises(GraphError, g.aggregate, {'x': ('sum', None)})
+		self.assertRaises(GraphError, g.aggregate, {'x': ('sum', Degree())},
+						element_type='edge')
+	
+	def test_ReadWriteLock(self):
+		lock = ReadWriteLock()
+		with lock.reading():
+			with lock.reading():
+				self.assertRaises(GraphError, lock.acquire_write)
+		with lock.writing():
+			with lock.writing():
+				with lock.reading():
+					pass
+		done = []
+		
+		def read():
+			with lock.reading():
+				done.append(True)
+		
+		with lock.writing():
+			thread = threading.Thread(target=read)
+			thread.start()
+			thread.join(0.1)
+			self.assertEqual(done, [])
+		thread.join()
+		self.assertEqual(len(done), 1)
+	
+	def test_Graph_threads(self):
+		g = Graph()
+		first = g.add_node()
+		
+		def client():
+			for _ in range(200):
+				node = g.add_node()
+				g.add_edge(first, 'knows', node)
+				first.adjacent_nodes('knows')
+		
+		threads = [threading.Thread(target=client) for _ in range(4)]
+		for thread in threads:
+			thread.start()
+		for thread in threads:
+			thread.join()
+		self.assertEqual(len(g._nodes), 801)
+		self.assertEqual(g._nextid, 1601)
+		self.assertEqual(len(first.adjacent_nodes('knows')), 800)
+		self.assertEqual(g.edge_count('knows'), 800)
 		
 
 		